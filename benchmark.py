@@ -0,0 +1,388 @@
+import argparse
+import contextlib
+import copy
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import spec_model
+import spec_generator
+import library_client
+import library_stub
+import metadata_writer
+import map2codelists
+import map2datasets
+import map2subsets
+import map2variables
+import map2vlm
+import sheet_order
+
+"""
+benchmark.py times each stage of the map2* scripts separately at several input sizes and records the wall time and
+the peak memory allocated by each stage. The inputs are scaled copies of the study inputs: the domain worksheets of the
+SDTM mapping spreadsheet and the Domains table are repeated, the vlm.json value level codelists are repeated under new
+dataset names, and the Library stages are run against a local library_stub serving synthetic CT codelists and SDTMIG
+datasets with the number of codelists and terms scaled up. Each stage is run --repeat times and the fastest time is
+kept; the peak memory is measured in one additional run with tracemalloc so tracing does not slow the timed runs.
+Each result is appended to a JSON Lines results file with the git commit, so regressions between commits can be
+listed with --compare.
+Example Cmd-line (optional args):
+    python benchmark.py -i ./data/SDTM-mapping-spec-20220406.xlsx -s 1,4,16 -r 3 --compare
+"""
+
+excel_map_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'SDTM-mapping-spec-20220406.xlsx')
+# JSON Lines file the benchmark results are appended to - assumes child data dir
+results_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'benchmarks.jsonl')
+# input size multipliers benchmarked by default
+default_scales = [1, 4, 16]
+# number of terms in each synthetic codelist before scaling
+base_codelist_terms = 50
+# slowdown, as a fraction of the previous time, reported as a regression by --compare
+default_threshold = 0.2
+
+
+class BenchStage:
+    def __init__(self, name, func, setup=None):
+        """
+        :param name: unique stage name used in the results
+        :param func: function timed for the stage; it is called with the arguments returned by setup
+        :param setup: function called before every run of the stage to create fresh inputs; it is not timed
+        """
+        self.name = name
+        self.func = func
+        self.setup = setup or (lambda: ())
+
+
+def scale_spec_model(model, scale):
+    """
+    :param model: SpecModel loaded from the SDTM mapping spreadsheet
+    :param scale: number of copies of each domain worksheet and Domains table entry
+    :return: SpecModel with the domain worksheets repeated; the copies keep the domain in the worksheet title
+    """
+    worksheets, copies = [], []
+    for sheet in model.worksheets:
+        if sheet.title == spec_model.domains_sheet:
+            worksheets.append(sheet)
+            continue
+        worksheets.append(sheet)
+        copies.extend(spec_model.SpecSheet(f"{sheet.title} {n}", sheet.columns) for n in range(1, scale))
+    return spec_model.SpecModel(model.spec_hash, model.domains * scale, worksheets + copies)
+
+
+def scale_vlm_codelists(codelists, scale):
+    """
+    :param codelists: dictionary of value level codelists loaded from the vlm.json file
+    :param scale: number of copies of each value level codelist
+    :return: dictionary with the codelists repeated for the datasets DOMAIN1, DOMAIN2 and so on
+    """
+    scaled = copy.deepcopy(codelists)
+    for n in range(1, scale):
+        for key, cl in codelists.items():
+            domain, variable = key.split(".")
+            scaled[f"{domain}{n}.{variable}"] = copy.deepcopy(cl)
+    return scaled
+
+
+def synthetic_codelist(c_code, n_terms, term_c_codes=(), submission_values=()):
+    """
+    :param c_code: codelist c-code
+    :param n_terms: number of generated terms
+    :param term_c_codes: c-codes of terms that must be in the codelist, such as those used by the codelist subsets
+    :param submission_values: submission values of terms that must be in the codelist, such as the domain names
+    :return: dictionary in the form of a CDISC Library CT codelist
+    """
+    terms = [{"conceptId": f"C9{c_code[1:]}{n:05d}", "submissionValue": f"{c_code}.{n}",
+              "preferredTerm": f"Term {n} of {c_code}"} for n in range(n_terms)]
+    terms.extend({"conceptId": term_c_code, "submissionValue": term_c_code, "preferredTerm": term_c_code}
+                 for term_c_code in term_c_codes if term_c_code != "NA")
+    terms.extend({"conceptId": f"C8{n:05d}", "submissionValue": value, "preferredTerm": value}
+                 for n, value in enumerate(submission_values))
+    return {"conceptId": c_code, "name": f"Codelist {c_code}", "submissionValue": c_code, "terms": terms}
+
+
+def synthetic_fixtures(domains, c_codes, n_terms):
+    """
+    create synthetic Library responses for the endpoints requested by map2datasets and map2codelists
+    :param domains: list of domain short names from the Domains worksheet
+    :param c_codes: list of codelist c-codes requested by map2codelists
+    :param n_terms: number of generated terms in each codelist
+    :return: dictionary of Library response bodies keyed by endpoint
+    """
+    fixtures = {}
+    class_links = []
+    class_terms = []
+    for class_name in sheet_order.class_order:
+        href = "/mdr/sdtmig/3-3/classes/" + class_name.title().replace(" ", "")
+        class_links.append({"href": href})
+        fixtures[href] = {"label": class_name.title(), "name": class_name.title()}
+        class_terms.append({"submissionValue": class_name, "synonyms": [class_name.title()]})
+    fixtures[map2datasets.classes_endpoint] = {"_links": {"classes": class_links}}
+    fixtures[map2datasets.class_ct_endpoint] = {"terms": class_terms}
+    for n, endpoint in enumerate(dict.fromkeys(map2datasets.lookup_domain_endpoint(domain) for domain in domains)):
+        class_name = sheet_order.class_order[n % len(sheet_order.class_order)]
+        fixtures[endpoint] = {"_links": {"parentClass": {"title": class_name.title()}},
+                              "datasetStructure": "One record per subject"}
+    subset_c_codes = {}
+    for subset in map2codelists.codelist_subsets:
+        subset_c_codes.setdefault(subset["oid"].split(".")[1], []).extend(
+            term["c_code"] for term in subset["terms"])
+    domain_names = [cl_oid.split(".")[2] for cl_oid in map2codelists.domain_codelists]
+    package = map2codelists.package_standard + "-" + map2codelists.package_date
+    for c_code in c_codes:
+        endpoint = "/mdr/ct/packages/" + package + "/codelists/" + c_code
+        fixtures[endpoint] = synthetic_codelist(c_code, n_terms, subset_c_codes.get(c_code, ()),
+                                                domain_names if c_code == "C66734" else ())
+    return fixtures
+
+
+def start_stub(fixtures, fixtures_dir):
+    """
+    :param fixtures: dictionary of Library response bodies keyed by endpoint
+    :param fixtures_dir: directory to save the fixture files served by the stand-in to
+    :return: LibraryStub serving the fixtures in a background thread
+    """
+    for endpoint, body in fixtures.items():
+        library_stub.record_fixture(fixtures_dir, endpoint, body)
+    return library_stub.LibraryStub(library_stub.load_fixtures(fixtures_dir)).start()
+
+
+@contextlib.contextmanager
+def scaled_codelists(scale):
+    """
+    temporarily repeat the map2codelists study codelists with synthetic c-codes so more codelists are requested
+    :param scale: number of copies of the study codelists
+    """
+    study_codelists = map2codelists.codelists
+    extra = [f"CL.C7{n:05d}" for n in range(len(study_codelists) * (scale - 1))]
+    map2codelists.codelists = study_codelists + extra
+    try:
+        yield
+    finally:
+        map2codelists.codelists = study_codelists
+
+
+def create_stages(model, base_vlm, stub, work_dir, workers):
+    """
+    :param model: scaled SpecModel
+    :param base_vlm: dictionary of scaled value level codelists
+    :param stub: LibraryStub serving the synthetic Library responses
+    :param work_dir: directory for the files written by the benchmark
+    :param workers: maximum number of concurrent Library requests
+    :return: list of BenchStage objects in the order they are run
+    """
+    map_xls = os.path.join(work_dir, "mapping-spec.xlsx")
+    spec_generator.write_spec_workbook(model, map_xls)
+    # save the model next to the spreadsheet so spec_load_saved only measures loading the saved model
+    spec_model.load_spec_model(map_xls)
+    sheets = spec_model.domain_sheets(model, map2variables.worksheet_skip)
+    mapper = map2variables.ColumnMapper()
+    variable_rows = [row for rows in map2variables.process_map_sheets(sheets, mapper) for row in rows]
+    study_subsets = map2subsets.codelists
+
+    def new_client():
+        return (library_client.LibraryClient("", None, stub.base_url),)
+
+    def subsets_setup():
+        map2subsets.codelists = copy.deepcopy(study_subsets)
+        return (model,)
+
+    def vlm_setup():
+        codelists = copy.deepcopy(base_vlm)
+        map2vlm.process_map_workbook(model, codelists)
+        return (codelists,)
+
+    def write_xlsx(constant_memory):
+        with metadata_writer.WorkbookWriter(os.path.join(work_dir, "variables.xlsx"), constant_memory) as writer:
+            writer.write_sheet("Variables", map2variables.header, variable_rows)
+
+    return [
+        BenchStage("spec_parse", spec_model.extract_model, lambda: (map_xls,)),
+        BenchStage("spec_load_saved", lambda: spec_model.load_spec_model(map_xls)),
+        BenchStage("map2variables.process_map_sheets", map2variables.process_map_sheets, lambda: (sheets, mapper)),
+        BenchStage("map2subsets.process_map_workbook", map2subsets.process_map_workbook, subsets_setup),
+        BenchStage("map2vlm.process_map_workbook", map2vlm.process_map_workbook,
+                   lambda: (model, copy.deepcopy(base_vlm))),
+        BenchStage("map2vlm.process_codelists", map2vlm.process_codelists, vlm_setup),
+        BenchStage("map2vlm.process_where_clauses", map2vlm.process_where_clauses, vlm_setup),
+        BenchStage("map2vlm.process_vlm", map2vlm.process_vlm, vlm_setup),
+        BenchStage("map2datasets.create_dataset_rows",
+                   lambda client: map2datasets.create_dataset_rows(model.domains, client, workers), new_client),
+        BenchStage("map2codelists.fetch_codelists",
+                   lambda client: map2codelists.fetch_codelists(map2codelists.get_codelist_c_codes(), client,
+                                                                workers), new_client),
+        BenchStage("map2codelists.create_codelist_rows", map2codelists.create_codelist_rows,
+                   lambda: (map2codelists.fetch_codelists(map2codelists.get_codelist_c_codes(), *new_client(),
+                                                          workers),)),
+        BenchStage("write_xlsx", write_xlsx, lambda: (False,)),
+        BenchStage("write_xlsx_constant_memory", write_xlsx, lambda: (True,)),
+    ]
+
+
+def run_stage(stage, repeat):
+    """
+    :param stage: BenchStage to run
+    :param repeat: number of timed runs; the fastest is kept
+    :return: tuple with the fastest wall time in seconds and the peak memory in bytes allocated by one run
+    """
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        times = []
+        for n in range(repeat):
+            args = stage.setup()
+            start = time.perf_counter()
+            stage.func(*args)
+            times.append(time.perf_counter() - start)
+        args = stage.setup()
+        tracemalloc.start()
+        try:
+            stage.func(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return min(times), peak
+
+
+def git_commit():
+    """
+    :return: string; the current git commit hash or an empty string when not run in a git repository
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.realpath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run_benchmarks(map_xls, scales, repeat=3, workers=library_client.default_workers, stage_names=None,
+                   vlm_file=map2vlm.vlm_file):
+    """
+    run every stage at each scale
+    :param map_xls: path and file name of the SDTM mapping spreadsheet the scaled inputs are created from
+    :param scales: list of input size multipliers
+    :param repeat: number of timed runs of each stage
+    :param workers: maximum number of concurrent Library requests
+    :param stage_names: names of the stages to run or None to run every stage
+    :param vlm_file: path and file name of the vlm.json file the scaled value level codelists are created from
+    :return: list of result dictionaries
+    """
+    base_model = spec_model.load_spec_model(map_xls)
+    with open(vlm_file, "r", encoding="utf-8") as file_in:
+        base_vlm = json.load(file_in)
+    commit = git_commit()
+    timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+    results = []
+    for scale in scales:
+        model = scale_spec_model(base_model, scale)
+        with tempfile.TemporaryDirectory() as work_dir, scaled_codelists(scale):
+            fixtures = synthetic_fixtures([domain for domain, description in model.domains],
+                                          map2codelists.get_codelist_c_codes(), base_codelist_terms * scale)
+            with start_stub(fixtures, os.path.join(work_dir, "fixtures")) as stub:
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    stages = create_stages(model, scale_vlm_codelists(base_vlm, scale), stub, work_dir, workers)
+                for stage in stages:
+                    if stage_names and stage.name not in stage_names:
+                        continue
+                    seconds, peak = run_stage(stage, repeat)
+                    result = {"commit": commit, "timestamp": timestamp, "python": platform.python_version(),
+                              "scale": scale, "stage": stage.name, "seconds": round(seconds, 6),
+                              "peak_mb": round(peak / (1024 * 1024), 3)}
+                    print(f"scale {scale:>4} {stage.name:<40} {seconds:9.4f}s {result['peak_mb']:10.3f} MB")
+                    results.append(result)
+    return results
+
+
+def save_results(results, file_name=results_file):
+    """
+    :param results: list of result dictionaries to append to the results file
+    :param file_name: path and file name of the JSON Lines results file
+    """
+    with open(file_name, "a", encoding="utf-8") as file_out:
+        for result in results:
+            file_out.write(json.dumps(result) + "\n")
+
+
+def load_results(file_name=results_file):
+    """
+    :param file_name: path and file name of the JSON Lines results file
+    :return: list of result dictionaries in the order they were saved
+    """
+    if not os.path.exists(file_name):
+        return []
+    with open(file_name, "r", encoding="utf-8") as file_in:
+        return [json.loads(line) for line in file_in if line.strip()]
+
+
+def compare_results(results, history, threshold=default_threshold):
+    """
+    compare each result with the latest earlier result for the same stage and scale from a different commit
+    :param results: list of result dictionaries from the current run
+    :param history: list of result dictionaries saved by earlier runs in the order they were saved
+    :param threshold: slowdown, as a fraction of the previous time, reported as a regression
+    :return: list of (result, previous result) tuples for the stages that are slower by more than the threshold
+    """
+    commit = results[0]["commit"] if results else ""
+    previous = {}
+    for result in history:
+        if result["commit"] != commit:
+            previous[(result["stage"], result["scale"])] = result
+    regressions = []
+    for result in results:
+        before = previous.get((result["stage"], result["scale"]))
+        if before is None:
+            continue
+        change = result["seconds"] / before["seconds"] - 1 if before["seconds"] else 0.0
+        print(f"scale {result['scale']:>4} {result['stage']:<40} {before['seconds']:9.4f}s -> "
+              f"{result['seconds']:9.4f}s ({change:+.0%}) vs {before['commit']}")
+        if change > threshold:
+            regressions.append((result, before))
+    return regressions
+
+
+def set_cmd_line_args():
+    """
+    get the command-line arguments needed to run the benchmarks
+    :return: return the argparse object with the command-line parameters
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input_file", help="path and file name of the SDTM map spreadsheet file",
+                        required=False, dest="map_xls", default=excel_map_file)
+    parser.add_argument("-v", "--vlm_file", help="path and file name of the vlm.json file", required=False,
+                        dest="vlm_file", default=map2vlm.vlm_file)
+    parser.add_argument("-s", "--scales", help="comma separated input size multipliers", required=False,
+                        dest="scales", default=",".join(str(scale) for scale in default_scales))
+    parser.add_argument("-r", "--repeat", help="number of timed runs of each stage", required=False,
+                        dest="repeat", type=int, default=3)
+    parser.add_argument("-w", "--workers", help="maximum number of concurrent Library requests", required=False,
+                        dest="workers", type=int, default=library_client.default_workers)
+    parser.add_argument("--stage", help="name of a stage to run; may be repeated", action="append", required=False,
+                        dest="stages", default=None)
+    parser.add_argument("-o", "--results_file", help="path and file name of the JSON Lines results file",
+                        required=False, dest="results_file", default=results_file)
+    parser.add_argument("--compare", help="compare the results with the previous commit's results", default=False,
+                        action="store_true", dest="compare")
+    parser.add_argument("--threshold", help="slowdown as a fraction of the previous time reported as a regression",
+                        required=False, dest="threshold", type=float, default=default_threshold)
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    """
+    main driver that runs the benchmarks, saves the results and optionally reports regressions
+    """
+    args = set_cmd_line_args()
+    scales = [int(scale) for scale in args.scales.split(",")]
+    history = load_results(args.results_file)
+    results = run_benchmarks(args.map_xls, scales, args.repeat, args.workers, args.stages,
+                             args.vlm_file)
+    save_results(results, args.results_file)
+    if args.compare:
+        regressions = compare_results(results, history, args.threshold)
+        print(f"{len(regressions)} stage(s) slower by more than {args.threshold:.0%}")
+
+
+if __name__ == '__main__':
+    main()
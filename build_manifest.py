@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+
+"""
+build_manifest.py supports the incremental mode of the map2* scripts. The manifest stores a hash of the content of
+each domain worksheet in the SDTM mapping spreadsheet together with the rows derived from that worksheet in the
+previous run. When the scripts are run again, only worksheets that are new or whose hash has changed are processed and
+the rows for the unchanged worksheets are re-used from the manifest. The manifest also records a hash of the settings
+used to derive the rows, such as the mapping spreadsheet layout, and all rows are derived again if the settings change.
+Example:
+    manifest = BuildManifest("./data/variables.xlsx.manifest.json", "map2variables", settings)
+    rows = manifest.get_rows(sheet.title, sheet_hash(sheet))
+"""
+
+# increment when the manifest layout or the derived rows change so older manifests are not re-used
+manifest_version = 1
+
+
+def sheet_hash(sheet, max_row=None):
+    """
+    :param sheet: SDTM mapping spreadsheet model worksheet
+    :param max_row: last row number (1-based) of the worksheet content used to derive the rows
+    :return: string; hex SHA-256 digest of the worksheet title and content
+    """
+    columns = list(sheet.iter_cols(min_col=1, max_col=sheet.max_column, min_row=1, max_row=max_row, values_only=True))
+    content = json.dumps([sheet.title, columns], default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def settings_hash(settings):
+    """
+    :param settings: JSON serializable settings used to derive the rows from each worksheet
+    :return: string; hex SHA-256 digest of the settings
+    """
+    return hashlib.sha256(json.dumps(settings, default=str).encode("utf-8")).hexdigest()
+
+
+class BuildManifest:
+    def __init__(self, manifest_file, script, settings=None):
+        """
+        :param manifest_file: path and file name of the manifest; it is created if it does not exist
+        :param script: name of the script that derived the rows so manifests are not mixed up between scripts
+        :param settings: JSON serializable settings used to derive the rows, such as the spreadsheet layout
+        """
+        self.manifest_file = manifest_file
+        self.script = script
+        self.settings = settings_hash(settings)
+        self.sheets = {}
+        self.used = set()
+        self.reused = 0
+        self.processed = 0
+        self.load()
+
+    def load(self):
+        """ load the worksheet hashes and rows saved by the previous run if they were derived the same way """
+        if not os.path.exists(self.manifest_file):
+            return
+        try:
+            with open(self.manifest_file, "r", encoding="utf-8") as file_in:
+                manifest = json.load(file_in)
+        except (OSError, ValueError):
+            return
+        if (manifest.get("version") == manifest_version and manifest.get("script") == self.script
+                and manifest.get("settings") == self.settings):
+            self.sheets = manifest.get("sheets", {})
+
+    def get_rows(self, title, content_hash):
+        """
+        :param title: worksheet title
+        :param content_hash: hash of the current worksheet content created by sheet_hash
+        :return: rows derived from the worksheet by the previous run or None if the worksheet is new or has changed
+        """
+        self.used.add(title)
+        entry = self.sheets.get(title)
+        if entry and entry["hash"] == content_hash:
+            self.reused += 1
+            return entry["rows"]
+        return None
+
+    def put_rows(self, title, content_hash, rows):
+        """
+        :param title: worksheet title
+        :param content_hash: hash of the current worksheet content created by sheet_hash
+        :param rows: JSON serializable rows derived from the worksheet
+        """
+        self.used.add(title)
+        self.processed += 1
+        self.sheets[title] = {"hash": content_hash, "rows": rows}
+
+    def save(self):
+        """ save the manifest, dropping worksheets that were not part of this run """
+        sheets = {title: entry for title, entry in self.sheets.items() if title in self.used}
+        manifest = {"version": manifest_version, "script": self.script, "settings": self.settings, "sheets": sheets}
+        try:
+            tmp_file = self.manifest_file + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as file_out:
+                json.dump(manifest, file_out)
+            os.replace(tmp_file, self.manifest_file)
+        except OSError as ex:
+            print(f"unable to save the build manifest to {self.manifest_file}: {ex}")
+        print(f"processed {self.processed} worksheets and re-used {self.reused} unchanged worksheets...")
+
+
+def add_manifest_args(parser):
+    """
+    add the incremental mode command-line argument to a script's argparse parser
+    :param parser: argparse parser object
+    """
+    parser.add_argument("-m", "--manifest", help="path and file name of the build manifest used to only process the "
+                        "worksheets that changed since the previous run", required=False, dest="manifest", default=None)
@@ -0,0 +1,161 @@
+import json
+import os
+import sqlite3
+
+"""
+ct_store.py provides a local SQLite store for a complete CDISC controlled terminology (CT) package. The package is
+retrieved from the CDISC Library in a single request, or read from a CDISC Library JSON export file, and saved with
+indexes on the codelist and term c-codes (conceptId) and submission values. Once loaded, codelists and terms are
+looked up in the local store instead of requesting each codelist from the Library. A store can hold more than one
+package, so the same database file can be re-used as the CT package for a study changes.
+Example:
+    store = CTStore("./data/ct_store.sqlite")
+    store.load_package_file("sdtmct-2021-12-17", "./path/to/sdtmct-2021-12-17.json")
+    cl = store.get_codelist("sdtmct-2021-12-17", "C66734")
+"""
+
+# default location of the CT store database - assumes child data dir
+default_store_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'ct_store.sqlite')
+
+schema = """
+CREATE TABLE IF NOT EXISTS package (
+    package TEXT PRIMARY KEY,
+    label TEXT
+);
+CREATE TABLE IF NOT EXISTS codelist (
+    package TEXT NOT NULL,
+    concept_id TEXT NOT NULL,
+    name TEXT,
+    submission_value TEXT,
+    extensible TEXT,
+    PRIMARY KEY (package, concept_id)
+);
+CREATE TABLE IF NOT EXISTS term (
+    package TEXT NOT NULL,
+    codelist_id TEXT NOT NULL,
+    order_nbr INTEGER NOT NULL,
+    concept_id TEXT NOT NULL,
+    submission_value TEXT,
+    preferred_term TEXT,
+    content TEXT NOT NULL,
+    PRIMARY KEY (package, codelist_id, order_nbr)
+);
+CREATE INDEX IF NOT EXISTS term_concept_id ON term (package, codelist_id, concept_id);
+CREATE INDEX IF NOT EXISTS term_submission_value ON term (package, codelist_id, submission_value);
+CREATE INDEX IF NOT EXISTS codelist_submission_value ON codelist (package, submission_value);
+"""
+
+
+class CTStore:
+    def __init__(self, db_file=default_store_file):
+        """
+        :param db_file: path and file name of the SQLite database used to store the CT packages
+        """
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file)
+        self.conn.executescript(schema)
+
+    def has_package(self, package):
+        """
+        :param package: CT package identifier such as sdtmct-2021-12-17
+        :return: True if the package has been loaded into the store
+        """
+        row = self.conn.execute("SELECT 1 FROM package WHERE package = ?", (package,)).fetchone()
+        return row is not None
+
+    def load_package(self, package, content):
+        """
+        save a complete CT package into the store replacing any previously loaded version of the package
+        :param package: CT package identifier such as sdtmct-2021-12-17
+        :param content: dictionary with the CT package content from the Library including all codelists and terms
+        :return: integer number of codelists loaded
+        """
+        with self.conn:
+            for table in ["term", "codelist", "package"]:
+                self.conn.execute(f"DELETE FROM {table} WHERE package = ?", (package,))
+            self.conn.execute("INSERT INTO package VALUES (?, ?)", (package, content.get("label", "")))
+            for cl in content["codelists"]:
+                self.conn.execute("INSERT INTO codelist VALUES (?, ?, ?, ?, ?)",
+                                  (package, cl["conceptId"], cl.get("name", ""), cl.get("submissionValue", ""),
+                                   str(cl.get("extensible", ""))))
+                self.conn.executemany("INSERT INTO term VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                      ((package, cl["conceptId"], order_nbr, term["conceptId"],
+                                        term.get("submissionValue", ""), term.get("preferredTerm", ""),
+                                        json.dumps(term))
+                                       for order_nbr, term in enumerate(cl.get("terms", []))))
+        return len(content["codelists"])
+
+    def load_package_file(self, package, package_file):
+        """
+        load a CT package from a CDISC Library JSON export file into the store
+        :param package: CT package identifier such as sdtmct-2021-12-17
+        :param package_file: path and file name of the JSON export of the CT package
+        :return: integer number of codelists loaded
+        """
+        with open(package_file, "r", encoding="utf-8") as file_in:
+            return self.load_package(package, json.load(file_in))
+
+    def load_package_from_library(self, package, client):
+        """
+        retrieve a complete CT package from the CDISC Library in a single request and load it into the store
+        :param package: CT package identifier such as sdtmct-2021-12-17
+        :param client: LibraryClient object used to request content from the CDISC Library
+        :return: integer number of codelists loaded
+        """
+        content = client.get_json("/mdr/ct/packages/" + package, package)
+        return self.load_package(package, content)
+
+    def get_codelist(self, package, c_code):
+        """
+        retrieve a codelist and its terms from the store in the same format returned by the CDISC Library
+        :param package: CT package identifier such as sdtmct-2021-12-17
+        :param c_code: the codelist c-code (conceptId)
+        :return: codelist dictionary with its terms or None if the codelist is not in the package
+        """
+        row = self.conn.execute("SELECT concept_id, name, submission_value, extensible FROM codelist "
+                                "WHERE package = ? AND concept_id = ?", (package, c_code)).fetchone()
+        if row is None:
+            return None
+        terms = [json.loads(term[0]) for term in self.conn.execute(
+            "SELECT content FROM term WHERE package = ? AND codelist_id = ? ORDER BY order_nbr", (package, c_code))]
+        return {"conceptId": row[0], "name": row[1], "submissionValue": row[2], "extensible": row[3],
+                "terms": terms}
+
+    def get_term(self, package, c_code, concept_id=None, submission_value=None):
+        """
+        look up a single codelist term by its c-code or by its submission value
+        :param package: CT package identifier such as sdtmct-2021-12-17
+        :param c_code: the codelist c-code (conceptId)
+        :param concept_id: the term c-code to look up
+        :param submission_value: the term submission value to look up when concept_id is not provided
+        :return: term dictionary in the format returned by the CDISC Library or None if not found
+        """
+        if concept_id is not None:
+            sql = "SELECT content FROM term WHERE package = ? AND codelist_id = ? AND concept_id = ?"
+            row = self.conn.execute(sql, (package, c_code, concept_id)).fetchone()
+        else:
+            sql = "SELECT content FROM term WHERE package = ? AND codelist_id = ? AND submission_value = ?"
+            row = self.conn.execute(sql, (package, c_code, submission_value)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def close(self):
+        self.conn.close()
+
+
+def open_store(package, client=None, db_file=default_store_file, package_file=None):
+    """
+    open the CT store and load the CT package if it has not already been loaded
+    :param package: CT package identifier such as sdtmct-2021-12-17
+    :param client: LibraryClient object used to retrieve the package when it is not loaded and no file is given
+    :param db_file: path and file name of the SQLite database used to store the CT packages
+    :param package_file: optional CDISC Library JSON export of the package to load into the store
+    :return: CTStore object with the package loaded
+    """
+    store = CTStore(db_file)
+    if package_file:
+        cl_count = store.load_package_file(package, package_file)
+        print(f"loaded {cl_count} codelists from {package_file} into the CT store...")
+    elif not store.has_package(package):
+        cl_count = store.load_package_from_library(package, client)
+        print(f"loaded {cl_count} codelists for {package} from the Library into the CT store...")
+    return store
@@ -0,0 +1,392 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import numpy as np
+    import pandas as pd
+except ImportError:
+    np = None
+    pd = None
+
+"""
+data_profile.py measures the Length and SignificantDigits of the numeric value level metadata from the study's SDTM
+datasets instead of using fixed defaults. Each dataset, a SAS XPORT (.xpt) or CSV file named after the dataset in the
+data directory, is read in chunks so only one chunk is held in memory at a time. For each chunk the length and the
+number of decimal digits of every value of a VLM variable are computed once for the whole column, and each VLM slice
+then selects its rows with a mask built from its where clause tests, so the work is done by pandas column operations
+rather than a Python loop over the records. Numbers are measured as written without an exponent and rounded to 15
+decimal places, so a float such as 0.1 + 0.2 is 0.3 rather than its 17 digit repr, and text is measured in UTF-8 bytes
+as the Define-XML Length is the number of bytes in a SAS XPORT dataset. The Length of a number is the number of
+characters it is written with, including a minus sign and the decimal point, which is the width w of the SAS w.d
+format map2vlm writes with the SignificantDigits as d. XPT files are read as cp1252 and CSV files as UTF-8 unless
+another encoding is given, and a dataset that cannot be decoded is reported and not measured. The longest value and
+the most decimal digits seen for each slice are kept across the chunks. The longest value of every variable is
+measured in the same way for the variables Length.
+The datasets can be shared across worker processes, one dataset per process at a time, starting with the largest
+datasets so a single large dataset such as LB does not start last. Profiling the datasets requires the optional
+pandas package.
+Example:
+    measured = data_profile.profile_vlm(codelists, "./path/to/sdtm", workers=4)
+    length = measured[("LB", "LBORRES", 0)]["length"]
+    lengths = data_profile.profile_lengths("./path/to/sdtm", workers=4)
+"""
+
+# number of records read from a dataset at a time
+default_chunk_size = 100000
+# VLM data types measured from the datasets
+number_types = ["integer", "float"]
+# dataset file extensions in the order they are looked for
+dataset_extensions = [".xpt", ".csv"]
+# encoding of the text in each type of dataset file unless --encoding is given; SAS XPORT files are usually written
+# from SAS sessions that use the Windows Latin-1 code page
+dataset_encodings = {".xpt": "cp1252", ".csv": "utf-8"}
+# number of worker processes the datasets are shared across
+default_workers = os.cpu_count() or 1
+# worker processes are spawned rather than forked, as define_build measures the datasets from its stage threads and
+# forking a process with running threads can deadlock the child
+process_context = multiprocessing.get_context("spawn")
+# most decimal places a float value is written with before it is measured
+float_precision = 15
+
+
+class VLMSlice:
+    def __init__(self, dataset, variable, idx, tests):
+        """
+        :param dataset: upper case name of the dataset the value level metadata is for, such as LB
+        :param variable: name of the variable the value level metadata is for, such as LBORRES
+        :param idx: index of the where clause in the variable's value level codelist
+        :param tests: list of where clause test dictionaries with the variable, comparator and list of values
+        """
+        self.dataset = dataset
+        self.variable = variable
+        self.idx = idx
+        self.tests = tests
+
+    @property
+    def key(self):
+        """ key of the slice in the dictionary of measured values """
+        return self.dataset, self.variable, self.idx
+
+
+def where_tests(where_clause):
+    """
+    :param where_clause: a where clause from vlm.json, a list of tests, or from map2subsets, a single test dictionary
+    :return: list of test dictionaries with the variable, comparator and a list of values
+    """
+    tests = where_clause if isinstance(where_clause, list) else [where_clause]
+    return [{"variable": test["variable"], "comparator": test["comparator"],
+             "value": test["value"] if isinstance(test["value"], list) else [test["value"]]} for test in tests]
+
+
+def vlm_slices(codelists):
+    """
+    :param codelists: dictionary of value level codelists keyed by DOMAIN.VARIABLE such as the vlm.json content
+    :return: list of VLMSlice objects for the integer and float value level metadata
+    """
+    slices = []
+    for key, cl in codelists.items():
+        if cl.get("VLM") == "No":
+            continue
+        dataset, variable = key.split(".")
+        for idx, data_type in enumerate(cl["type"]):
+            if data_type in number_types and idx < len(cl["whereclause"]):
+                slices.append(VLMSlice(dataset.upper(), variable, idx, where_tests(cl["whereclause"][idx])))
+    return slices
+
+
+def find_dataset_files(data_dir):
+    """
+    :param data_dir: directory with the SDTM datasets
+    :return: dictionary of the path and file name of each XPT or CSV dataset keyed by upper case dataset name; the
+    XPT file is used when a dataset has both
+    """
+    data_files = {}
+    for extension in reversed(dataset_extensions):
+        for name in sorted(os.listdir(data_dir)):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() == extension:
+                data_files[stem.upper()] = os.path.join(data_dir, name)
+    return data_files
+
+
+def find_dataset_file(data_dir, dataset):
+    """
+    :param data_dir: directory with the SDTM datasets
+    :param dataset: name of the dataset, such as LB; the file name is not case-sensitive
+    :return: path and file name of the dataset, or None if there is no XPT or CSV file for the dataset
+    """
+    return find_dataset_files(data_dir).get(dataset.upper())
+
+
+def map_datasets(func, tasks, workers=1):
+    """
+    run a function for each dataset, sharing the datasets across worker processes with the largest datasets first
+    :param func: module-level function called as func(*task) for each task
+    :param tasks: list of argument tuples, one per dataset, that start with the path and file name of the dataset
+    :param workers: number of worker processes; 1 reads the datasets in the current process
+    :return: list of the func results in the same order as tasks
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        return [func(*task) for task in tasks]
+    order = sorted(range(len(tasks)), key=lambda idx: os.path.getsize(tasks[idx][0]), reverse=True)
+    results = [None] * len(tasks)
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=process_context) as executor:
+        futures = {idx: executor.submit(func, *tasks[idx]) for idx in order}
+        for idx, future in futures.items():
+            results[idx] = future.result()
+    return results
+
+
+def read_chunks(data_file, columns=None, chunk_size=default_chunk_size, encoding=None):
+    """
+    read a dataset a chunk of records at a time
+    :param data_file: path and file name of a SAS XPORT (.xpt) or CSV dataset
+    :param columns: set of the column names needed, the other CSV columns are not read, or None to read every column
+    :param chunk_size: number of records in each chunk
+    :param encoding: encoding of the dataset text or None for the dataset_encodings default for the file extension
+    :return: generator of pandas DataFrames
+    """
+    if pd is None:
+        raise ImportError("profiling the SDTM datasets requires the optional pandas package: "
+                          "pip install -r requirements-optional.txt")
+    extension = os.path.splitext(data_file)[1].lower()
+    encoding = encoding or dataset_encodings.get(extension, "utf-8")
+    if extension == ".xpt":
+        with pd.read_sas(data_file, format="xport", chunksize=chunk_size, encoding=encoding) as reader:
+            yield from reader
+    else:
+        yield from pd.read_csv(data_file, chunksize=chunk_size, dtype=str, keep_default_na=False, encoding=encoding,
+                               usecols=None if columns is None else lambda column: column in columns)
+
+
+def value_text(values):
+    """
+    :param values: pandas Series with the values of a variable
+    :return: Series with the text of each value, stripped of spaces, with missing values as empty strings; numbers
+    are written without an exponent, rounded to float_precision decimal places and without trailing zeros
+    """
+    if pd.api.types.is_float_dtype(values):
+        # each distinct number is formatted once; whole numbers read as floats from a XPT file have no decimal part
+        texts = {value: np.format_float_positional(value, precision=float_precision, trim="-")
+                 for value in values.dropna().unique()}
+        return values.map(texts).fillna("")
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(str)
+    return values.fillna("").astype(str).str.strip()
+
+
+def value_lengths(values):
+    """
+    :param values: pandas Series with the values of a variable
+    :return: Series with the length of each value in UTF-8 bytes; missing values are NaN
+    """
+    text = value_text(values)
+    return text.where(text != "").str.encode("utf-8").str.len()
+
+
+def value_sizes(values):
+    """
+    :param values: pandas Series with the values of a variable
+    :return: tuple of Series with the length in UTF-8 bytes and the number of decimal digits of each value; missing
+    values are NaN. The length of a number counts its minus sign and decimal point, as in the width of a SAS w.d format
+    """
+    text = value_text(values)
+    text = text.where(text != "")
+    lengths = text.str.encode("utf-8").str.len()
+    decimals = text.str.partition(".")[2].str.len().where(text.notna())
+    return lengths, decimals
+
+
+def where_mask(chunk, tests, texts):
+    """
+    :param chunk: pandas DataFrame with a chunk of dataset records
+    :param tests: list of where clause test dictionaries with the variable, comparator and list of values
+    :param texts: dictionary of the value_text of the chunk columns already used in a test keyed by column name
+    :return: boolean Series selecting the records that meet every test, or None if a test variable is not in the chunk
+    """
+    mask = pd.Series(True, index=chunk.index)
+    for test in tests:
+        if test["variable"] not in chunk:
+            return None
+        if test["variable"] not in texts:
+            texts[test["variable"]] = value_text(chunk[test["variable"]])
+        column = texts[test["variable"]]
+        comparator = test["comparator"]
+        if comparator == "EQ":
+            mask &= column == str(test["value"][0])
+        elif comparator == "NE":
+            mask &= column != str(test["value"][0])
+        elif comparator == "IN":
+            mask &= column.isin([str(value) for value in test["value"]])
+        elif comparator == "NOTIN":
+            mask &= ~column.isin([str(value) for value in test["value"]])
+        else:
+            numbers = pd.to_numeric(column, errors="coerce")
+            limit = float(test["value"][0])
+            if comparator == "LT":
+                mask &= numbers < limit
+            elif comparator == "LE":
+                mask &= numbers <= limit
+            elif comparator == "GT":
+                mask &= numbers > limit
+            elif comparator == "GE":
+                mask &= numbers >= limit
+            else:
+                raise ValueError(f"unknown where clause comparator {comparator}")
+    return mask
+
+
+def profile_dataset(data_file, slices, chunk_size=default_chunk_size, encoding=None):
+    """
+    measure the longest value and the most decimal digits of each value level slice of a dataset
+    :param data_file: path and file name of the SAS XPORT (.xpt) or CSV dataset
+    :param slices: list of VLMSlice objects for the dataset
+    :param chunk_size: number of records read at a time
+    :param encoding: encoding of the dataset text or None for the default for the file extension
+    :return: dictionary of the length and significant_digits measured for each slice keyed by slice key; slices
+    without any values, and every slice of a dataset that cannot be decoded, are not included
+    """
+    by_variable = {}
+    for vlm_slice in slices:
+        by_variable.setdefault(vlm_slice.variable, []).append(vlm_slice)
+    columns = set(by_variable) | {test["variable"] for vlm_slice in slices for test in vlm_slice.tests}
+    measured = {}
+    try:
+        for chunk in read_chunks(data_file, columns, chunk_size, encoding):
+            texts = {}
+            for variable, variable_slices in by_variable.items():
+                if variable not in chunk:
+                    continue
+                lengths, decimals = value_sizes(chunk[variable])
+                for vlm_slice in variable_slices:
+                    mask = where_mask(chunk, vlm_slice.tests, texts)
+                    if mask is None:
+                        continue
+                    max_length = lengths[mask].max()
+                    if pd.isna(max_length):
+                        continue
+                    sizes = measured.setdefault(vlm_slice.key, {"length": 0, "significant_digits": 0})
+                    sizes["length"] = max(sizes["length"], int(max_length))
+                    sizes["significant_digits"] = max(sizes["significant_digits"], int(decimals[mask].max()))
+    except UnicodeDecodeError as ex:
+        print(f"unable to decode {data_file}, so its value level slices are not measured; set --encoding: {ex}")
+        return {}
+    return measured
+
+
+def profile_vlm(codelists, data_dir, chunk_size=default_chunk_size, workers=1, encoding=None):
+    """
+    measure the Length and SignificantDigits of the integer and float value level metadata from the SDTM datasets
+    :param codelists: dictionary of value level codelists keyed by DOMAIN.VARIABLE such as the vlm.json content
+    :param data_dir: directory with the SDTM datasets as XPT or CSV files named after each dataset
+    :param chunk_size: number of records read at a time
+    :param workers: number of worker processes the datasets are shared across
+    :param encoding: encoding of the dataset text or None for the default for each file extension
+    :return: dictionary of the length and significant_digits measured for each slice keyed by (dataset, variable,
+    where clause index)
+    """
+    slices = vlm_slices(codelists)
+    by_dataset = {}
+    for vlm_slice in slices:
+        by_dataset.setdefault(vlm_slice.dataset, []).append(vlm_slice)
+    tasks = []
+    for dataset, dataset_slices in by_dataset.items():
+        data_file = find_dataset_file(data_dir, dataset)
+        if data_file is None:
+            print(f"no XPT or CSV file found for dataset {dataset} in {data_dir}")
+            continue
+        print(f"profiling {len(dataset_slices)} value level slices in {data_file}...")
+        tasks.append((data_file, dataset_slices, chunk_size, encoding))
+    measured = {}
+    for dataset_measured in map_datasets(profile_dataset, tasks, workers):
+        measured.update(dataset_measured)
+    missing = [vlm_slice.key for vlm_slice in slices if vlm_slice.key not in measured]
+    if missing:
+        print(f"no values found for {len(missing)} value level slices; the default Length is used for them")
+    return measured
+
+
+def column_lengths(data_file, chunk_size=default_chunk_size, encoding=None):
+    """
+    measure the longest value of every column of a dataset
+    :param data_file: path and file name of the SAS XPORT (.xpt) or CSV dataset
+    :param chunk_size: number of records read at a time
+    :param encoding: encoding of the dataset text or None for the default for the file extension
+    :return: dictionary of the length of the longest value keyed by column name; columns without values, and every
+    column of a dataset that cannot be decoded, are not included
+    """
+    lengths = {}
+    try:
+        for chunk in read_chunks(data_file, None, chunk_size, encoding):
+            for column in chunk.columns:
+                max_length = value_lengths(chunk[column]).max()
+                if not pd.isna(max_length):
+                    lengths[column] = max(lengths.get(column, 0), int(max_length))
+    except UnicodeDecodeError as ex:
+        print(f"unable to decode {data_file}, so its variable lengths are not measured; set --encoding: {ex}")
+        return {}
+    return lengths
+
+
+def profile_lengths(data_dir, datasets=None, chunk_size=default_chunk_size, workers=1, encoding=None):
+    """
+    measure the longest value of every variable in the SDTM datasets
+    :param data_dir: directory with the SDTM datasets as XPT or CSV files named after each dataset
+    :param datasets: list of the dataset names to measure or None to measure every dataset in data_dir
+    :param chunk_size: number of records read at a time
+    :param workers: number of worker processes the datasets are shared across
+    :param encoding: encoding of the dataset text or None for the default for each file extension
+    :return: dictionary of the length of the longest value keyed by (upper case dataset, variable)
+    """
+    data_files = find_dataset_files(data_dir)
+    if datasets is not None:
+        names = {dataset.upper() for dataset in datasets}
+        data_files = {dataset: data_file for dataset, data_file in data_files.items() if dataset in names}
+    print(f"measuring the variable lengths in {len(data_files)} datasets in {data_dir}...")
+    lengths = {}
+    tasks = [(data_file, chunk_size, encoding) for data_file in data_files.values()]
+    results = map_datasets(column_lengths, tasks, workers)
+    for dataset, dataset_lengths in zip(data_files, results):
+        for variable, length in dataset_lengths.items():
+            lengths[(dataset, variable)] = length
+    return lengths
+
+
+def add_data_args(parser):
+    """
+    add the SDTM dataset profiling command-line arguments to a script's argparse parser
+    :param parser: argparse parser object
+    """
+    parser.add_argument("-d", "--data_dir", help="directory with the SDTM datasets as XPT or CSV files used to "
+                        "measure the numeric value level Length and SignificantDigits", required=False,
+                        dest="data_dir", default=None)
+    parser.add_argument("--chunk_size", help="number of dataset records read at a time", required=False,
+                        dest="chunk_size", type=int, default=default_chunk_size)
+    parser.add_argument("--data_workers", help="number of worker processes the datasets are shared across",
+                        required=False, dest="data_workers", type=int, default=default_workers)
+    parser.add_argument("--encoding", help="encoding of the text in the SDTM datasets (default: cp1252 for XPT and "
+                        "UTF-8 for CSV files)", required=False, dest="encoding", default=None)
+
+
+def create_vlm_profile(args, codelists):
+    """
+    measure the value level metadata from the datasets given by the command-line arguments added by add_data_args
+    :param args: argparse object with the command-line parameters
+    :param codelists: dictionary of value level codelists keyed by DOMAIN.VARIABLE
+    :return: dictionary of the measured value level metadata, empty if no data directory is given
+    """
+    if not args.data_dir:
+        return {}
+    return profile_vlm(codelists, args.data_dir, args.chunk_size, args.data_workers, args.encoding)
+
+
+def create_lengths(args):
+    """
+    measure the variable lengths from the datasets given by the command-line arguments added by add_data_args
+    :param args: argparse object with the command-line parameters
+    :return: dictionary of the longest value of each variable keyed by (dataset, variable), empty if no data
+    directory is given
+    """
+    if not args.data_dir:
+        return {}
+    return profile_lengths(args.data_dir, None, args.chunk_size, args.data_workers, args.encoding)
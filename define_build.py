@@ -0,0 +1,341 @@
+import argparse
+import os.path
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import library_client
+import metadata_writer
+import define_xml_writer
+import define_render
+import spec_model
+import map2codelists
+import map2datasets
+import map2variables
+import map2vlm
+import sheet_order
+import data_profile
+
+"""
+define_build.py runs the map2datasets, map2variables, map2codelists and map2vlm steps as one pipeline and writes a
+single odmlib metadata workbook with the Datasets, Variables, ValueLevel, WhereClauses and Codelists worksheets. Each
+step is a stage with explicit dependencies on the stages whose results it uses. A stage starts as soon as the stages
+it depends on have finished, so independent stages run concurrently; for example, the codelists are retrieved from the
+CDISC Library while the mapping spreadsheet is parsed, and the domain worksheets can be shared across worker processes
+with the --jobs argument. The time taken by each stage is reported when the pipeline finishes. The -x argument also
+writes the rows directly to a Define-XML v2.1 file without going through the odmlib workbook.
+There is no map2subsets stage: the codelist subsets are created by the codelists stage from the Library terms, and the
+value level metadata by the vlm stage from vlm.json, which replaces the codelists dictionary in map2subsets. Running
+map2subsets as well would write the FA.FAORRES and LB.LBORRES value level metadata twice.
+Example Cmd-line (optional args):
+    python define_build.py -i ./path/to/mapping_spec.xlsx -o ./path/to/define-metadata.xlsx
+"""
+
+# maximum number of stages run at the same time
+default_stage_workers = 4
+# seconds between checks for changes to the mapping spreadsheet and vlm.json file in watch mode
+default_watch_interval = 0.5
+# output odmlib metadata workbook with all the generated worksheets - assumes child data dir
+excel_define_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'define-metadata.xlsx')
+
+
+class Stage:
+    def __init__(self, name, func, deps=()):
+        """
+        :param name: unique stage name used to refer to the stage result
+        :param func: function run by the stage; it is called with the results of the deps stages in order
+        :param deps: names of the stages that must finish before this stage starts
+        """
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+
+class Pipeline:
+    def __init__(self, workers=default_stage_workers):
+        """
+        :param workers: maximum number of stages run at the same time
+        """
+        self.workers = workers
+        self.stages = {}
+        self.results = {}
+        self.timings = {}
+
+    def add_stage(self, name, func, deps=()):
+        """
+        add a stage to the pipeline; stages must be added after the stages they depend on
+        :param name: unique stage name used to refer to the stage result
+        :param func: function run by the stage; it is called with the results of the deps stages in order
+        :param deps: names of the stages that must finish before this stage starts
+        """
+        if name in self.stages:
+            raise ValueError(f"Stage {name} has already been added to the pipeline")
+        unknown = [dep for dep in deps if dep not in self.stages]
+        if unknown:
+            raise ValueError(f"Stage {name} depends on unknown stage(s) {', '.join(unknown)}")
+        self.stages[name] = Stage(name, func, deps)
+
+    def invalidate(self, names):
+        """
+        discard the results of stages and of every stage that depends on them so the next run re-runs them
+        :param names: names of the stages whose inputs have changed
+        :return: list of the names of the discarded stages in the order the stages were added
+        """
+        stale = set(names)
+        # stages are added after the stages they depend on, so one pass in order finds every dependent stage
+        for name, stage in self.stages.items():
+            if any(dep in stale for dep in stage.deps):
+                stale.add(name)
+        for name in stale:
+            self.results.pop(name, None)
+        return [name for name in self.stages if name in stale]
+
+    def run(self):
+        """
+        run every stage that does not have a result once its dependencies have finished, running independent stages
+        concurrently
+        :return: dictionary of stage results keyed by stage name
+        """
+        pending = {name: stage for name, stage in self.stages.items() if name not in self.results}
+        running = {}
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if all(dep in self.results for dep in stage.deps):
+                        running[executor.submit(self.run_stage, stage)] = name
+                        del pending[name]
+                done, not_done = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    # a stage that fails stops the pipeline with the stage's exception
+                    self.results[running.pop(future)] = future.result()
+        return self.results
+
+    def run_stage(self, stage):
+        """
+        :param stage: Stage object to run with the results of the stages it depends on
+        :return: the stage result
+        """
+        start = time.perf_counter()
+        result = stage.func(*[self.results[dep] for dep in stage.deps])
+        self.timings[stage.name] = time.perf_counter() - start
+        print(f"finished stage {stage.name} in {self.timings[stage.name]:.2f}s...")
+        return result
+
+    def print_timings(self, total):
+        """
+        print the time taken by each stage in the order the stages were added
+        :param total: seconds taken to run the whole pipeline
+        """
+        for name in self.stages:
+            print(f"    {name:<20} {self.timings.get(name, 0.0):8.2f}s")
+        print(f"    {'total':<20} {total:8.2f}s")
+
+
+def create_variable_rows(map_workbook, mapper, jobs=1):
+    """
+    create the odmlib variables rows for all domain worksheets
+    :param map_workbook: SDTM mapping spreadsheet model
+    :param mapper: ColumnMapper compiled for the mapping spreadsheet layout
+    :param jobs: number of worker processes the domain worksheets are shared across
+    :return: list of variable row dictionaries in mapping spreadsheet worksheet order
+    """
+    sheets = spec_model.domain_sheets(map_workbook, map2variables.worksheet_skip)
+    sheet_rows = map2variables.process_map_sheets(sheets, mapper, jobs)
+    return [row for rows in sheet_rows for row in rows]
+
+
+def create_vlm_rows(map_workbook, measured=None, jobs=1):
+    """
+    create the value level metadata, where clause and value level codelist rows
+    :param map_workbook: SDTM mapping spreadsheet model
+    :param measured: dictionary of the value level metadata measured by data_profile.profile_vlm or None
+    :param jobs: number of worker processes the domain worksheets are shared across
+    :return: dictionary with the codelists, whereclauses and valuelevel rows
+    """
+    codelists = map2vlm.load_vlm_codelists()
+    map2vlm.process_map_workbook(map_workbook, codelists, jobs)
+    return {"codelists": map2vlm.process_codelists(codelists),
+            "whereclauses": map2vlm.process_where_clauses(codelists),
+            "valuelevel": map2vlm.process_vlm(codelists, measured)}
+
+
+def order_rows(orders, datasets, variables, codelists, vlm):
+    """
+    sort the generated rows for each output worksheet; variables and value level rows sorted on Dataset are grouped
+    by dataset in the same order as the datasets rows
+    :param orders: dictionary of sheet_order.SheetOrder objects keyed by output worksheet
+    :param datasets: list of dataset rows
+    :param variables: list of variable rows
+    :param codelists: list of codelist rows for the CDISC CT codelists and subsets
+    :param vlm: dictionary with the value level metadata rows created by create_vlm_rows
+    :return: dictionary with the datasets, variables, codelists, whereclauses and valuelevel rows in sort order
+    """
+    datasets = sheet_order.sort_rows("datasets", datasets, orders)
+    orders = sheet_order.rank_datasets(orders, datasets)
+    return {"datasets": datasets,
+            "variables": sheet_order.sort_rows("variables", variables, orders),
+            "codelists": sheet_order.sort_rows("codelists", codelists + vlm["codelists"], orders),
+            "whereclauses": sheet_order.sort_rows("whereclauses", vlm["whereclauses"], orders),
+            "valuelevel": sheet_order.sort_rows("valuelevel", vlm["valuelevel"], orders)}
+
+
+def write_workbook(writer, rows):
+    """
+    write the generated rows to the odmlib metadata workbook
+    :param writer: WorkbookWriter for the odmlib metadata workbook
+    :param rows: dictionary with the rows for each output worksheet created by order_rows
+    """
+    writer.write_sheet("Datasets", map2datasets.header, rows["datasets"])
+    writer.write_sheet("Variables", map2variables.header, rows["variables"])
+    writer.write_sheet("ValueLevel", map2vlm.vlm_header, rows["valuelevel"])
+    writer.write_sheet("WhereClauses", map2vlm.wc_header, rows["whereclauses"])
+    writer.write_sheet("Codelists", map2vlm.cl_header, rows["codelists"])
+    writer.close()
+
+
+def write_define_xml(args, rows):
+    """
+    write the generated rows directly to a Define-XML v2.1 file
+    :param args: argparse object with the Define-XML file name and the header command-line parameters
+    :param rows: dictionary with the rows for each output worksheet created by order_rows
+    """
+    with open(args.define_xml, "wb") as file_out:
+        # the CT standard version is the CT package the codelists were retrieved from unless --ct_version is given
+        writer = define_xml_writer.create_writer(args, file_out, map2codelists.package_date)
+        missing = writer.write_define(rows["datasets"], rows["variables"], rows["codelists"], rows["valuelevel"],
+                                      rows["whereclauses"])
+    # the file is kept to inspect, but a Define-XML without some of the variables is not valid
+    if missing:
+        raise ValueError(f"{args.define_xml} is missing the variables for dataset(s) {', '.join(missing)} as they "
+                         f"are not in the Domains worksheet")
+
+
+def create_pipeline(args, client):
+    """
+    create the pipeline stages and their dependencies
+    :param args: argparse object with the command-line parameters
+    :param client: LibraryClient object used to request content from the CDISC Library
+    :return: Pipeline object ready to run
+    """
+    layout = map2variables.load_layout(args.layout_file)
+    pipeline = Pipeline(args.stage_workers)
+    pipeline.add_stage("spec", lambda: spec_model.load_spec_model(args.map_xls))
+    pipeline.add_stage("library_codelists", lambda: map2codelists.load_codelists(client, args.workers, args.ct_store,
+                                                                                 args.ct_package_file))
+    orders = sheet_order.create_orders(args)
+    pipeline.add_stage("datasets", lambda spec: map2datasets.create_dataset_rows(spec.domains, client, args.workers,
+                                                                                 orders), ["spec"])
+    pipeline.add_stage("variable_lengths", lambda: data_profile.create_lengths(args))
+    pipeline.add_stage("variables", lambda spec, lengths: create_variable_rows(
+        spec, map2variables.ColumnMapper(layout, lengths), args.jobs), ["spec", "variable_lengths"])
+    pipeline.add_stage("vlm_profile", lambda: data_profile.create_vlm_profile(args, map2vlm.load_vlm_codelists()))
+    pipeline.add_stage("vlm", lambda spec, measured: create_vlm_rows(spec, measured, args.jobs),
+                       ["spec", "vlm_profile"])
+    # the codelists stage also creates the codelist subsets that map2subsets writes to its own workbook
+    pipeline.add_stage("codelists", map2codelists.create_codelist_rows, ["library_codelists"])
+    pipeline.add_stage("order", lambda *results: order_rows(orders, *results),
+                       ["datasets", "variables", "codelists", "vlm"])
+    if not args.no_workbook:
+        pipeline.add_stage("workbook", lambda rows: write_workbook(metadata_writer.create_writer(args), rows),
+                           ["order"])
+    if args.define_xml:
+        pipeline.add_stage("define_xml", lambda rows: write_define_xml(args, rows), ["order"])
+    return pipeline
+
+
+def watch(pipeline, watched_files, interval=default_watch_interval):
+    """
+    re-run the stages affected by changes to the watched files until interrupted with Ctrl-C; the results of the other
+    stages, such as the codelists retrieved from the Library, are kept in memory and re-used
+    :param pipeline: Pipeline object that has already been run
+    :param watched_files: dictionary of the names of the stages that read a file keyed by path and file name
+    :param interval: seconds between checks for changed files
+    """
+    stamps = {file_name: define_render.file_stamp(file_name) for file_name in watched_files}
+    print(f"watching {', '.join(watched_files)}, press Ctrl-C to stop...")
+    try:
+        while True:
+            time.sleep(interval)
+            changed = [file_name for file_name in watched_files
+                       if define_render.file_stamp(file_name) != stamps[file_name]]
+            if not changed:
+                continue
+            for file_name in changed:
+                stamps[file_name] = define_render.file_stamp(file_name)
+            stale = pipeline.invalidate([name for file_name in changed for name in watched_files[file_name]])
+            print(f"{', '.join(changed)} changed, re-running {', '.join(stale)}...")
+            start = time.perf_counter()
+            try:
+                pipeline.run()
+            except Exception as ex:
+                # a file saved part way or with errors is retried when it is next saved
+                print(f"unable to regenerate the metadata: {ex}")
+                continue
+            print(f"regenerated the metadata in {time.perf_counter() - start:.2f}s...")
+    except KeyboardInterrupt:
+        pass
+
+
+def set_cmd_line_args():
+    """
+    get the command-line arguments needed to generate the odmlib metadata workbook
+    :return: return the argparse object with the command-line parameters
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input_file", help="path and file name of the SDTM map spreadsheet file",
+                        required=False, dest="map_xls", default=map2variables.excel_map_file)
+    parser.add_argument("-o", "--output_file", help="path and file name of Define-XML v2.1 metadata spreadsheet file",
+                        required=False, dest="define_xls", default=excel_define_file)
+    parser.add_argument("-a", "--api_key", help="CDISC Library API key",
+                        required=False, dest="api_key", default=map2codelists.library_api_key)
+    parser.add_argument("-w", "--workers", help="maximum number of concurrent CDISC Library requests",
+                        required=False, dest="workers", type=int, default=library_client.default_workers)
+    parser.add_argument("--stage_workers", help="maximum number of stages run at the same time",
+                        required=False, dest="stage_workers", type=int, default=default_stage_workers)
+    parser.add_argument("-j", "--jobs", help="number of worker processes the domain worksheets are shared across",
+                        required=False, dest="jobs", type=int, default=1)
+    parser.add_argument("-s", "--ct_store", help="path and file name of a local CT store (SQLite) to look up "
+                        "codelists from", required=False, dest="ct_store", default=None)
+    parser.add_argument("-p", "--ct_package_file", help="CDISC Library JSON export of the CT package to load into "
+                        "the CT store", required=False, dest="ct_package_file", default=None)
+    parser.add_argument("-l", "--layout", help="path and file name of a JSON mapping spreadsheet row layout",
+                        required=False, dest="layout_file", default=None)
+    parser.add_argument("-x", "--define_xml", help="path and file name of a Define-XML v2.1 file to write directly "
+                        "from the generated rows", required=False, dest="define_xml", default=None)
+    parser.add_argument("--no_workbook", help="do not write the odmlib metadata workbook, such as when only the "
+                        "Define-XML file is needed", required=False, dest="no_workbook", action="store_true",
+                        default=False)
+    parser.add_argument("--watch", help="keep running and regenerate the outputs affected by each change to the "
+                        "mapping spreadsheet or vlm.json file", required=False, dest="watch", action="store_true",
+                        default=False)
+    parser.add_argument("--interval", help="seconds between checks for changed files in watch mode",
+                        required=False, dest="interval", type=float, default=default_watch_interval)
+    library_client.add_client_args(parser)
+    metadata_writer.add_writer_args(parser)
+    sheet_order.add_order_args(parser)
+    data_profile.add_data_args(parser)
+    define_xml_writer.add_define_args(parser)
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    """
+    main driver that runs all the stages and creates the combined odmlib metadata workbook
+    """
+    args = set_cmd_line_args()
+    client = library_client.create_client(args, keep_responses=args.watch)
+    start = time.perf_counter()
+    pipeline = create_pipeline(args, client)
+    try:
+        pipeline.run()
+        outputs = ([] if args.no_workbook else [args.define_xls]) + ([args.define_xml] if args.define_xml else [])
+        print(f"created {' and '.join(outputs)} with stage timings:")
+        pipeline.print_timings(time.perf_counter() - start)
+        if args.watch:
+            watch(pipeline, {args.map_xls: ["spec"], map2vlm.vlm_file: ["vlm_profile"]}, args.interval)
+    finally:
+        client.close()
+    client.print_stats()
+
+
+if __name__ == '__main__':
+    main()
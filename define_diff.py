@@ -0,0 +1,310 @@
+import argparse
+import csv
+import json
+import os
+import xml.etree.ElementTree as ET
+from openpyxl import load_workbook
+
+"""
+define_diff.py compares the metadata generated by the map2* scripts with a released Define-XML file, such as
+t1d-define.xml, and reports the ItemGroupDefs, ItemDefs, CodeLists, ValueListDefs and WhereClauseDefs that were added,
+removed or changed. The released Define-XML is streamed with iterparse and each definition is reduced to a small
+summary keyed by OID as soon as its end tag is read, after which the element is discarded. Only the OID index is kept
+in memory, never the document tree, so multi-MB defines are indexed quickly with flat memory use.
+The generated metadata can be the odmlib metadata workbook written by define_build.py, the directory of csv or jsonl
+worksheet files written with its -f argument, or a second Define-XML file such as the one written by its -x argument.
+Example Cmd-line (optional args):
+    python define_diff.py -d ./data/t1d-define.xml -g ./data/define-metadata.xlsx -o ./data/define-diff.json
+"""
+
+released_define_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 't1d-define.xml')
+generated_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'define-metadata.xlsx')
+
+odm_ns = "{http://www.cdisc.org/ns/odm/v1.3}"
+def_ns = "{http://www.cdisc.org/ns/def/v2.1}"
+# definitions indexed by OID, in the order they are reported
+index_kinds = ["ItemGroupDef", "ItemDef", "CodeList", "ValueListDef", "WhereClauseDef"]
+# element tag for each kind of definition
+kind_tags = {odm_ns + "ItemGroupDef": "ItemGroupDef", odm_ns + "ItemDef": "ItemDef", odm_ns + "CodeList": "CodeList",
+             def_ns + "ValueListDef": "ValueListDef", def_ns + "WhereClauseDef": "WhereClauseDef"}
+# odmlib metadata worksheets read from the generated metadata in the order of the index_rows parameters
+generated_sheets = ["Datasets", "Variables", "Codelists", "ValueLevel", "WhereClauses"]
+
+
+def text(value):
+    """
+    :param value: attribute, element text or worksheet cell value
+    :return: the value as a stripped string with whole numbers read from a worksheet, such as 8.0, written as 8
+    """
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return " ".join(str(value).split())
+
+
+def translated_text(elem, name="Description"):
+    """
+    :param elem: element with an optional Description or Decode child element
+    :param name: name of the child element with the TranslatedText
+    :return: string; the text of the first TranslatedText or an empty string
+    """
+    return text(elem.findtext(odm_ns + name + "/" + odm_ns + "TranslatedText"))
+
+
+def summarize_element(kind, elem):
+    """
+    reduce a definition element to the content compared by the diff
+    :param kind: kind of definition, one of index_kinds
+    :param elem: complete definition element
+    :return: dictionary summary of the definition
+    """
+    if kind == "ItemGroupDef":
+        class_elem = elem.find(def_ns + "Class")
+        return {"Name": text(elem.get("Name")), "Description": translated_text(elem),
+                "Class": text(class_elem.get("Name") if class_elem is not None else ""),
+                "Structure": text(elem.get(def_ns + "Structure")), "Purpose": text(elem.get("Purpose")),
+                "Repeating": text(elem.get("Repeating")), "IsReferenceData": text(elem.get("IsReferenceData")),
+                "ItemRefs": [text(item_ref.get("ItemOID")) for item_ref in elem.iter(odm_ns + "ItemRef")]}
+    elif kind == "ItemDef":
+        codelist = elem.find(odm_ns + "CodeListRef")
+        value_list = elem.find(def_ns + "ValueListRef")
+        return {"Name": text(elem.get("Name")), "Label": translated_text(elem),
+                "DataType": text(elem.get("DataType")), "Length": text(elem.get("Length")),
+                "SignificantDigits": text(elem.get("SignificantDigits")),
+                "CodeList": text(codelist.get("CodeListOID") if codelist is not None else ""),
+                "ValueList": text(value_list.get("ValueListOID") if value_list is not None else "")}
+    elif kind == "CodeList":
+        terms = [text(item.get("CodedValue")) for item in elem if item.tag in (odm_ns + "CodeListItem",
+                                                                              odm_ns + "EnumeratedItem")]
+        return {"Name": text(elem.get("Name")), "DataType": text(elem.get("DataType")), "Terms": terms}
+    elif kind == "ValueListDef":
+        return {"ItemRefs": [text(item_ref.get("ItemOID")) for item_ref in elem.iter(odm_ns + "ItemRef")]}
+    checks = []
+    for range_check in elem.iter(odm_ns + "RangeCheck"):
+        values = "|".join(text(value.text) for value in range_check.iter(odm_ns + "CheckValue"))
+        checks.append(f"{text(range_check.get(def_ns + 'ItemOID'))} {text(range_check.get('Comparator'))} {values}")
+    return {"RangeChecks": checks}
+
+
+def new_index():
+    return {kind: {} for kind in index_kinds}
+
+
+def index_define(define_file):
+    """
+    stream a Define-XML file and index the definitions by OID without building the document tree
+    :param define_file: path and file name of the Define-XML file
+    :return: dictionary of {OID: summary} dictionaries keyed by the kind of definition
+    """
+    index = new_index()
+    depth = 0
+    kind_depth = None
+    parents = []
+    for event, elem in ET.iterparse(define_file, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            parents.append(elem)
+            if kind_depth is None and elem.tag in kind_tags:
+                kind_depth = depth
+            continue
+        parents.pop()
+        if depth == kind_depth:
+            kind = kind_tags[elem.tag]
+            # OIDs are normalized with text in the same way as the generated rows so stray spaces are not reported
+            index[kind][text(elem.get("OID"))] = summarize_element(kind, elem)
+            kind_depth = None
+        if kind_depth is None:
+            # discard each element once read, removing it from its parent so the tree does not grow
+            elem.clear()
+            if parents:
+                parents[-1].remove(elem)
+        depth -= 1
+    return index
+
+
+def index_rows(datasets, variables, codelists, value_levels, where_clauses):
+    """
+    index the rows generated for the odmlib metadata worksheets in the same form as index_define
+    :param datasets: iterable of Datasets worksheet rows
+    :param variables: iterable of Variables worksheet rows
+    :param codelists: iterable of Codelists worksheet rows
+    :param value_levels: iterable of ValueLevel worksheet rows
+    :param where_clauses: iterable of WhereClauses worksheet rows
+    :return: dictionary of {OID: summary} dictionaries keyed by the kind of definition
+    """
+    index = new_index()
+    item_groups, item_defs = index["ItemGroupDef"], index["ItemDef"]
+    for row in datasets:
+        item_groups[text(row["OID"])] = {
+            "Name": text(row["Dataset"]), "Description": text(row["Description"]), "Class": text(row["Class"]),
+            "Structure": text(row["Structure"]), "Purpose": text(row["Purpose"]), "Repeating": text(row["Repeating"]),
+            "IsReferenceData": text(row["Reference Data"]), "ItemRefs": []}
+    # ItemRefs are added to the datasets in the order of the variable rows
+    value_list_rows = list(value_levels)
+    value_list_oids = {text(row["OID"]) for row in value_list_rows}
+    for row in variables:
+        item_group = item_groups.get("IG." + text(row["Dataset"]))
+        if item_group is not None:
+            item_group["ItemRefs"].append(text(row["OID"]))
+        value_list_oid = "VL." + text(row["Dataset"]) + "." + text(row["Variable"])
+        item_defs.setdefault(text(row["OID"]), {
+            "Name": text(row["Variable"]), "Label": text(row["Label"]), "DataType": text(row["Data Type"]),
+            "Length": text(row["Length"]), "SignificantDigits": text(row["Significant Digits"]),
+            "CodeList": text(row["CodeList"]),
+            "ValueList": value_list_oid if value_list_oid in value_list_oids else ""})
+    for row in value_list_rows:
+        index["ValueListDef"].setdefault(text(row["OID"]), {"ItemRefs": []})["ItemRefs"].append(text(row["ItemOID"]))
+        item_defs.setdefault(text(row["ItemOID"]), {
+            "Name": text(row["Variable"]), "Label": "", "DataType": text(row["Data Type"]),
+            "Length": text(row["Length"]), "SignificantDigits": text(row["Significant Digits"]),
+            "CodeList": text(row["Codelist"]), "ValueList": ""})
+    for row in where_clauses:
+        check = f"IT.{text(row['Dataset'])}.{text(row['Variable'])} {text(row['Comparator'])} {text(row['Value'])}"
+        index["WhereClauseDef"].setdefault(text(row["OID"]), {"RangeChecks": []})["RangeChecks"].append(check)
+    current_oid, duplicate = None, False
+    for row in codelists:
+        oid = text(row["OID"])
+        if oid != current_oid:
+            # the first definition of a codelist wins, as in the Define-XML written by define_xml_writer
+            current_oid, duplicate = oid, oid in index["CodeList"]
+            if not duplicate:
+                index["CodeList"][oid] = {"Name": text(row["Name"]), "DataType": text(row["Data Type"]), "Terms": []}
+        if not duplicate and text(row["Term"]):
+            index["CodeList"][oid]["Terms"].append(text(row["Term"]))
+    return index
+
+
+def read_sheet_rows(generated, sheet_name):
+    """
+    :param generated: path of the odmlib metadata workbook or the directory of csv or jsonl worksheet files
+    :param sheet_name: name of the odmlib worksheet to read
+    :return: generator of row dictionaries keyed by the worksheet column headers
+    """
+    if os.path.isdir(generated):
+        csv_file = os.path.join(generated, sheet_name + ".csv")
+        if os.path.exists(csv_file):
+            with open(csv_file, "r", newline="", encoding="utf-8") as file_in:
+                yield from csv.DictReader(file_in)
+        else:
+            with open(os.path.join(generated, sheet_name + ".jsonl"), "r", encoding="utf-8") as file_in:
+                for line in file_in:
+                    yield json.loads(line)
+        return
+    workbook = load_workbook(filename=generated, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        header = next(rows, ())
+        for row in rows:
+            if any(value not in (None, "") for value in row):
+                yield dict(zip(header, row))
+    finally:
+        workbook.close()
+
+
+def index_generated(generated):
+    """
+    :param generated: path of a Define-XML file, odmlib metadata workbook or directory of worksheet files
+    :return: dictionary of {OID: summary} dictionaries keyed by the kind of definition
+    """
+    if generated.lower().endswith(".xml"):
+        return index_define(generated)
+    return index_rows(*[read_sheet_rows(generated, sheet_name) for sheet_name in generated_sheets])
+
+
+def compare_field(released, generated):
+    """
+    :param released: field value from the released Define-XML
+    :param generated: field value from the generated metadata
+    :return: dictionary describing the difference or None if the values match
+    """
+    if released == generated:
+        return None
+    if isinstance(released, list):
+        generated_set, released_set = set(generated), set(released)
+        removed = [value for value in released if value not in generated_set]
+        added = [value for value in generated if value not in released_set]
+        if not removed and not added:
+            return {"order": "differs"}
+        return {"removed": removed, "added": added}
+    return {"released": released, "generated": generated}
+
+
+def diff_indexes(released, generated):
+    """
+    compare the definitions in two OID indexes
+    :param released: OID index of the released Define-XML
+    :param generated: OID index of the generated metadata
+    :return: dictionary keyed by the kind of definition with the added, removed and changed OIDs
+    """
+    diff = {}
+    for kind in index_kinds:
+        released_defs, generated_defs = released[kind], generated[kind]
+        changed = {}
+        for oid in released_defs.keys() & generated_defs.keys():
+            fields = {}
+            for field, value in released_defs[oid].items():
+                field_diff = compare_field(value, generated_defs[oid].get(field, [] if isinstance(value, list) else ""))
+                if field_diff:
+                    fields[field] = field_diff
+            if fields:
+                changed[oid] = fields
+        diff[kind] = {"added": sorted(generated_defs.keys() - released_defs.keys()),
+                      "removed": sorted(released_defs.keys() - generated_defs.keys()),
+                      "changed": dict(sorted(changed.items()))}
+    return diff
+
+
+def print_diff(diff):
+    """
+    print a summary of the diff followed by each added, removed and changed definition
+    :param diff: dictionary created by diff_indexes
+    """
+    for kind in index_kinds:
+        kind_diff = diff[kind]
+        print(f"{kind}: {len(kind_diff['added'])} added, {len(kind_diff['removed'])} removed, "
+              f"{len(kind_diff['changed'])} changed")
+        for oid in kind_diff["added"]:
+            print(f"    + {oid}")
+        for oid in kind_diff["removed"]:
+            print(f"    - {oid}")
+        for oid, fields in kind_diff["changed"].items():
+            for field, field_diff in fields.items():
+                print(f"    ~ {oid} {field}: {json.dumps(field_diff)}")
+
+
+def set_cmd_line_args():
+    """
+    get the command-line arguments needed to compare the generated metadata with a released Define-XML file
+    :return: return the argparse object with the command-line parameters
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--define_file", help="path and file name of the released Define-XML file",
+                        required=False, dest="define_file", default=released_define_file)
+    parser.add_argument("-g", "--generated", help="path and file name of the generated odmlib metadata workbook, "
+                        "directory of csv or jsonl worksheet files, or Define-XML file", required=False,
+                        dest="generated", default=generated_file)
+    parser.add_argument("-o", "--output_file", help="path and file name of a JSON file to save the diff to",
+                        required=False, dest="diff_file", default=None)
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    """
+    main driver that indexes the released Define-XML and the generated metadata and reports the differences
+    """
+    args = set_cmd_line_args()
+    print(f"indexing {args.define_file}...")
+    released = index_define(args.define_file)
+    print(f"indexing {args.generated}...")
+    generated = index_generated(args.generated)
+    diff = diff_indexes(released, generated)
+    print_diff(diff)
+    if args.diff_file:
+        with open(args.diff_file, "w", encoding="utf-8") as file_out:
+            json.dump(diff, file_out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
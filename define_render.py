@@ -0,0 +1,195 @@
+import argparse
+import os
+import time
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+"""
+define_render.py renders one or more Define-XML files to HTML with the define2-1.xsl stylesheet provided with the
+Define-XML v2.1 standard. The stylesheet is compiled once and the compiled transform is re-used for every file
+rendered by the same run, so rendering a batch of defines or re-rendering in watch mode only pays the cost of the
+transform itself. The stylesheet is only compiled again if it changes. An HTML file that is newer than both its
+Define-XML file and the stylesheet is not rendered again unless --force is given, so repeated runs after a metadata
+tweak only render the defines that changed. The time taken to compile the stylesheet and render each file is printed.
+Rendering requires the optional lxml package.
+Example Cmd-line (optional args):
+    python define_render.py -d ./data/t1d-define.xml -o ./data --watch
+"""
+
+stylesheet_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'define2-1.xsl')
+define_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 't1d-define.xml')
+# seconds between checks for changed files in watch mode
+default_interval = 1.0
+
+
+def file_stamp(file_name):
+    """
+    :param file_name: path and file name of the file to check
+    :return: tuple of the modification time and size used to tell if a file has changed, or None if it does not exist
+    """
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class DefineRenderer:
+    def __init__(self, xsl_file=stylesheet_file, params=None):
+        """
+        :param xsl_file: path and file name of the define2-1.xsl stylesheet
+        :param params: dictionary of stylesheet parameters, such as {"displayCommentsTable": "1"}
+        """
+        if etree is None:
+            raise ImportError("HTML rendering requires the optional lxml package: "
+                              "pip install -r requirements-optional.txt")
+        self.xsl_file = xsl_file
+        self.params = {name: etree.XSLT.strparam(value) for name, value in (params or {}).items()}
+        self.transform = None
+        self.xsl_stamp = None
+
+    def get_transform(self):
+        """
+        :return: the compiled stylesheet, compiling it only the first time or if the stylesheet has changed
+        """
+        stamp = file_stamp(self.xsl_file)
+        if self.transform is None or stamp != self.xsl_stamp:
+            start = time.perf_counter()
+            self.transform = etree.XSLT(etree.parse(self.xsl_file))
+            self.xsl_stamp = stamp
+            print(f"compiled {self.xsl_file} in {time.perf_counter() - start:.3f}s")
+        return self.transform
+
+    def is_current(self, xml_file, html_file):
+        """
+        :param xml_file: path and file name of the Define-XML file
+        :param html_file: path and file name of the HTML rendering
+        :return: True if the HTML file is newer than both the Define-XML file and the stylesheet
+        """
+        html_stamp = file_stamp(html_file)
+        if html_stamp is None:
+            return False
+        return all(stamp is not None and stamp[0] <= html_stamp[0]
+                   for stamp in (file_stamp(xml_file), file_stamp(self.xsl_file)))
+
+    def render(self, xml_file, html_file, force=False, verbose=True):
+        """
+        render a Define-XML file to HTML
+        :param xml_file: path and file name of the Define-XML file
+        :param html_file: path and file name of the HTML file to write
+        :param force: render the file even if the HTML file is up to date
+        :param verbose: report files that are already up to date
+        :return: True if the file was rendered, False if the HTML file was already up to date
+        """
+        if not force and self.is_current(xml_file, html_file):
+            if verbose:
+                print(f"{html_file} is up to date")
+            return False
+        transform = self.get_transform()
+        start = time.perf_counter()
+        html = transform(etree.parse(xml_file), **self.params)
+        tmp_file = html_file + ".tmp"
+        html.write_output(tmp_file)
+        os.replace(tmp_file, html_file)
+        print(f"rendered {xml_file} to {html_file} in {time.perf_counter() - start:.3f}s")
+        return True
+
+
+def html_file_name(xml_file, output_dir=None):
+    """
+    :param xml_file: path and file name of the Define-XML file
+    :param output_dir: directory to write the HTML file to; defaults to the directory of the Define-XML file
+    :return: path and file name of the HTML file named after the Define-XML file
+    """
+    base_name = os.path.splitext(os.path.basename(xml_file))[0] + ".html"
+    return os.path.join(output_dir or os.path.dirname(xml_file), base_name)
+
+
+def render_all(renderer, xml_files, output_dir=None, force=False, verbose=True):
+    """
+    :param renderer: DefineRenderer object
+    :param xml_files: list of Define-XML files to render
+    :param output_dir: directory to write the HTML files to
+    :param force: render every file even if its HTML file is up to date
+    :param verbose: report files that are already up to date
+    :return: integer number of files rendered
+    """
+    rendered = 0
+    for xml_file in xml_files:
+        try:
+            rendered += renderer.render(xml_file, html_file_name(xml_file, output_dir), force, verbose)
+        except (OSError, etree.Error) as ex:
+            print(f"unable to render {xml_file}: {ex}")
+    return rendered
+
+
+def watch(renderer, xml_files, output_dir=None, interval=default_interval):
+    """
+    re-render the Define-XML files whenever they or the stylesheet change until interrupted with Ctrl-C
+    :param renderer: DefineRenderer object
+    :param xml_files: list of Define-XML files to watch
+    :param output_dir: directory to write the HTML files to
+    :param interval: seconds between checks for changed files
+    """
+    print(f"watching {len(xml_files)} Define-XML file(s), press Ctrl-C to stop...")
+    try:
+        while True:
+            time.sleep(interval)
+            render_all(renderer, xml_files, output_dir, verbose=False)
+    except KeyboardInterrupt:
+        pass
+
+
+def stylesheet_param(param):
+    """
+    :param param: stylesheet parameter from the command-line given as name=value
+    :return: tuple of the parameter name and value
+    """
+    name, sep, value = param.partition("=")
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(f"stylesheet parameter {param} must be given as name=value")
+    return name, value
+
+
+def set_cmd_line_args():
+    """
+    get the command-line arguments needed to render Define-XML files to HTML
+    :return: return the argparse object with the command-line parameters
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--define_files", help="path and file name of one or more Define-XML files to render",
+                        nargs="+", required=False, dest="define_files", default=[define_file])
+    parser.add_argument("-o", "--output_dir", help="directory to write the HTML files to; defaults to the directory "
+                        "of each Define-XML file", required=False, dest="output_dir", default=None)
+    parser.add_argument("-s", "--stylesheet", help="path and file name of the define2-1.xsl stylesheet",
+                        required=False, dest="stylesheet", default=stylesheet_file)
+    parser.add_argument("-P", "--param", help="stylesheet parameter as name=value, such as displayCommentsTable=1",
+                        type=stylesheet_param, action="append", required=False,
+                        dest="params", default=None)
+    parser.add_argument("--force", help="render every file even if its HTML file is up to date", default=False,
+                        action="store_true", dest="force")
+    parser.add_argument("--watch", help="keep running and re-render the files whenever they change", default=False,
+                        action="store_true", dest="watch")
+    parser.add_argument("--interval", help="seconds between checks for changed files in watch mode", type=float,
+                        required=False, dest="interval", default=default_interval)
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    """
+    main driver that renders the Define-XML files to HTML and optionally keeps watching them for changes
+    """
+    args = set_cmd_line_args()
+    renderer = DefineRenderer(args.stylesheet, dict(args.params or []))
+    start = time.perf_counter()
+    rendered = render_all(renderer, args.define_files, args.output_dir, args.force)
+    print(f"rendered {rendered} of {len(args.define_files)} file(s) in {time.perf_counter() - start:.3f}s")
+    if args.watch:
+        watch(renderer, args.define_files, args.output_dir, args.interval)
+
+
+if __name__ == '__main__':
+    main()
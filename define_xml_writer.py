@@ -0,0 +1,325 @@
+import datetime
+from itertools import groupby
+from xml.sax.saxutils import XMLGenerator
+
+"""
+define_xml_writer.py writes a Define-XML v2.1 file directly from the rows created for the odmlib metadata worksheets,
+without first writing the worksheets and converting them with odmlib. The file is written element by element as the
+rows are read, so no document tree is built in memory. Rows for the same ValueListDef, WhereClauseDef or CodeList are
+expected to be next to each other, which is the order the map2* scripts create them in. The ItemRefs for each dataset
+and the OIDs already written are the only content kept while the file is written. The study names and the versions of
+the standards in the header are taken from the command-line arguments added by add_define_args.
+Example:
+    with open("./data/define.xml", "wb") as file_out:
+        DefineXMLWriter(file_out, study_metadata("T1DEXI"), define_standards("3.3", "1.1", "2021-12-17")).write_define(
+            datasets, variables, codelists, value_levels, where_clauses)
+"""
+
+# study level content for the Define-XML header used when it is not given on the command line
+default_study_name = "T1DEXI"
+default_study_description = ("The T1DEXI study was designed to create an aggregated dataset including exercise, CGM "
+                             "and other relevant data inputs related to glucose response to exercise for those living "
+                             "with type 1 diabetes.")
+default_protocol_name = ("Type 1 Diabetes EXercise Initiative: The Effect of Exercise on Glycemic Control in Type 1 "
+                         "Diabetes Study")
+# versions of the standards used when they are not given on the command line; the CT version is the CT package the
+# codelists are retrieved from
+default_sdtmig_version = "3.3"
+default_sdtmig_md_version = "1.1"
+default_ct_version = "2021-12-17"
+
+# text for the comments referenced by the CodeList column in the mapping spreadsheet
+comments = {"COM.ISO8601": "ISO 8601 is an international standard for date and time representations",
+            "COM.ISO3166-1": "ISO 3166-1 alpha-3 is an international standard for defining codes for the names of "
+                             "countries, dependent territories, and special areas of geographical interest."}
+
+odm_namespaces = {"xmlns": "http://www.cdisc.org/ns/odm/v1.3", "xmlns:xlink": "http://www.w3.org/1999/xlink",
+                  "xmlns:def": "http://www.cdisc.org/ns/def/v2.1"}
+
+
+def study_metadata(name, description=default_study_description, protocol=default_protocol_name):
+    """
+    :param name: study name used in the StudyName and the Study and MetaDataVersion OIDs
+    :param description: study description
+    :param protocol: protocol name
+    :return: dictionary with the study level content for the Define-XML header
+    """
+    return {"oid": "ODM." + name, "name": name, "mdv_oid": "MDV." + name, "mdv_name": "MDV " + name,
+            "mdv_description": "Data Definitions for " + name, "description": description, "protocol": protocol}
+
+
+def define_standards(sdtmig_version=default_sdtmig_version, sdtmig_md_version=default_sdtmig_md_version,
+                     ct_version=default_ct_version):
+    """
+    :param sdtmig_version: SDTMIG version such as 3.3
+    :param sdtmig_md_version: SDTMIG for medical devices version such as 1.1
+    :param ct_version: CDISC/NCI SDTM CT package date such as 2021-12-17
+    :return: list of the def:Standard attributes referenced by the StandardOID attributes in the generated rows
+    """
+    return [{"OID": "STD.1", "Name": "SDTMIG", "Type": "IG", "Version": sdtmig_version, "Status": "Final"},
+            {"OID": "STD.2", "Name": "SDTMIG-MD", "Type": "IG", "Version": sdtmig_md_version, "Status": "Final"},
+            {"OID": "STD.3", "Name": "CDISC/NCI", "Type": "CT", "PublishingSet": "SDTM", "Version": ct_version,
+             "Status": "Final"}]
+
+
+def attributes(*pairs):
+    """
+    :param pairs: (attribute name, value) tuples
+    :return: dictionary of the attributes that have a value, with the values converted to strings
+    """
+    return {name: str(value) for name, value in pairs if value is not None and value != ""}
+
+
+class DefineXMLWriter:
+    def __init__(self, file_out, study=None, standards=None, indent="  "):
+        """
+        :param file_out: binary file object to write the Define-XML to
+        :param study: dictionary with the study level content created by study_metadata or None for the defaults
+        :param standards: list of the standards created by define_standards or None for the default versions
+        :param indent: string used to indent each level of nested elements
+        """
+        self.study = study or study_metadata(default_study_name)
+        self.standards = standards or define_standards()
+        self.xml = XMLGenerator(file_out, encoding="utf-8", short_empty_elements=True)
+        self.indent = indent
+        self.depth = 0
+        self.item_oids = set()
+        self.dataset_names = set()
+        self.comment_oids = set()
+        self.value_list_oids = set()
+        self.missing_datasets = []
+        self.value_level_items = {}
+
+    def start(self, name, attrs=None):
+        if self.depth:
+            self.xml.ignorableWhitespace("\n" + self.indent * self.depth)
+        self.xml.startElement(name, attrs or {})
+        self.depth += 1
+
+    def end(self, name):
+        self.depth -= 1
+        self.xml.ignorableWhitespace("\n" + self.indent * self.depth)
+        self.xml.endElement(name)
+
+    def element(self, name, attrs=None, text=None):
+        """ write an element that has only attributes and optional text content """
+        self.xml.ignorableWhitespace("\n" + self.indent * self.depth)
+        self.xml.startElement(name, attrs or {})
+        if text is not None:
+            self.xml.characters(str(text))
+        self.xml.endElement(name)
+
+    def description(self, text, name="Description"):
+        self.start(name)
+        self.element("TranslatedText", {"xml:lang": "en"}, text)
+        self.end(name)
+
+    def write_define(self, datasets, variables, codelists, value_levels, where_clauses):
+        """
+        write the complete Define-XML document from the rows created for the odmlib metadata worksheets
+        :param datasets: list of Datasets worksheet rows
+        :param variables: list of Variables worksheet rows grouped by dataset
+        :param codelists: iterable of Codelists worksheet rows grouped by codelist OID
+        :param value_levels: list of ValueLevel worksheet rows grouped by value list OID
+        :param where_clauses: iterable of WhereClauses worksheet rows grouped by where clause OID
+        :return: list of the datasets with variables that were not written as they are not in the Datasets rows
+        """
+        self.value_list_oids = {row["OID"] for row in value_levels}
+        self.xml.startDocument()
+        self.start_study()
+        self.write_value_lists(value_levels)
+        self.write_where_clauses(where_clauses)
+        self.write_item_groups(datasets, variables)
+        self.write_item_defs(variables, value_levels)
+        self.write_codelists(codelists)
+        self.write_comments()
+        self.end_study()
+        self.xml.endDocument()
+        return self.missing_datasets
+
+    def start_study(self):
+        study = self.study
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        odm_attrs = {"FileOID": "ODM.DEFINE21." + study["name"], "CreationDateTime": now, "AsOfDateTime": now,
+                     "ODMVersion": "1.3.2", "FileType": "Snapshot", "Originator": "T1Dexi map2* scripts",
+                     "SourceSystem": "define_xml_writer", "def:Context": "Other"}
+        odm_attrs.update(odm_namespaces)
+        self.start("ODM", odm_attrs)
+        self.start("Study", {"OID": study["oid"]})
+        self.start("GlobalVariables")
+        self.element("StudyName", text=study["name"])
+        self.element("StudyDescription", text=study["description"])
+        self.element("ProtocolName", text=study["protocol"])
+        self.end("GlobalVariables")
+        self.start("MetaDataVersion", {"OID": study["mdv_oid"], "Name": study["mdv_name"],
+                                       "Description": study["mdv_description"], "def:DefineVersion": "2.1.0"})
+        self.start("def:Standards")
+        for standard in self.standards:
+            self.element("def:Standard", standard)
+        self.end("def:Standards")
+
+    def end_study(self):
+        self.end("MetaDataVersion")
+        self.end("Study")
+        self.end("ODM")
+        self.xml.ignorableWhitespace("\n")
+
+    def write_value_lists(self, value_levels):
+        for oid, rows in groupby(value_levels, key=lambda row: row["OID"]):
+            self.start("def:ValueListDef", {"OID": oid})
+            item_oids = set()
+            for row in rows:
+                # an ItemOID shared by several where clauses would leave only one ItemDef for all of their slices
+                if row["ItemOID"] in item_oids:
+                    raise ValueError(f"ItemOID {row['ItemOID']} is used more than once in value list {oid}")
+                item_oids.add(row["ItemOID"])
+                self.start("ItemRef", attributes(("ItemOID", row["ItemOID"]), ("Mandatory", row["Mandatory"] or "No"),
+                                                 ("OrderNumber", row["Order"])))
+                self.element("def:WhereClauseRef", {"WhereClauseOID": row["Where Clause"]})
+                self.end("ItemRef")
+            self.end("def:ValueListDef")
+
+    def write_where_clauses(self, where_clauses):
+        for oid, rows in groupby(where_clauses, key=lambda row: row["OID"]):
+            self.start("def:WhereClauseDef", {"OID": oid})
+            for row in rows:
+                item_oid = "IT." + row["Dataset"] + "." + row["Variable"]
+                self.start("RangeCheck", {"SoftHard": "Soft", "def:ItemOID": item_oid, "Comparator": row["Comparator"]})
+                for check_value in str(row["Value"]).split("|"):
+                    self.element("CheckValue", text=check_value)
+                self.end("RangeCheck")
+            self.end("def:WhereClauseDef")
+
+    def write_item_groups(self, datasets, variables):
+        # only the ItemRef attributes are kept for each dataset as the datasets are ordered differently to the variables
+        item_refs = {}
+        for row in variables:
+            item_refs.setdefault(row["Dataset"], []).append(
+                attributes(("ItemOID", row["OID"]), ("Mandatory", row["Mandatory"] or "No"),
+                           ("OrderNumber", row["Order"]), ("KeySequence", row["KeySequence"]), ("Role", row["Role"]),
+                           ("def:IsNonStandard", row["IsNonStandard"])))
+        for row in datasets:
+            dataset = row["Dataset"]
+            self.dataset_names.add(dataset)
+            domain = "" if dataset.startswith("SUPP") or dataset == "RELREC" else dataset[:2]
+            self.start("ItemGroupDef", attributes(
+                ("OID", row["OID"]), ("Name", dataset), ("Repeating", row["Repeating"]), ("Domain", domain),
+                ("SASDatasetName", dataset), ("IsReferenceData", row["Reference Data"]), ("Purpose", row["Purpose"]),
+                ("def:Structure", row["Structure"]), ("def:ArchiveLocationID", "LF." + dataset),
+                ("def:StandardOID", row["StandardOID"] or "STD.1"), ("def:IsNonStandard", row["IsNonStandard"]),
+                ("def:HasNoData", row["HasNoData"])))
+            self.description(row["Description"])
+            for item_ref in item_refs.pop(dataset, []):
+                self.element("ItemRef", item_ref)
+            self.element("def:Class", {"Name": row["Class"]})
+            self.start("def:leaf", {"ID": "LF." + dataset, "xlink:href": dataset.lower() + ".xpt"})
+            self.element("def:title", text=dataset.lower() + ".xpt")
+            self.end("def:leaf")
+            self.end("ItemGroupDef")
+        self.missing_datasets = list(item_refs)
+
+    def write_item_defs(self, variables, value_levels):
+        for row in variables:
+            if row["OID"] in self.item_oids or row["Dataset"] not in self.dataset_names:
+                continue
+            self.item_oids.add(row["OID"])
+            value_list_oid = "VL." + row["Dataset"] + "." + row["Variable"]
+            self.write_item_def(row["OID"], row["Variable"], row["Data Type"], row["Length"],
+                                row["Significant Digits"], row["Format"], row["Label"], row["CodeList"],
+                                row["Comment"], value_list_oid if value_list_oid in self.value_list_oids else "")
+        for row in value_levels:
+            item = (row["Variable"], row["Data Type"], row["Length"], row["Significant Digits"], row["Format"],
+                    row["Codelist"], row["Comment"])
+            if row["ItemOID"] in self.value_level_items:
+                # the same ItemDef may be referenced from more than one value list but must not be defined differently
+                if self.value_level_items[row["ItemOID"]] != item:
+                    raise ValueError(f"ItemOID {row['ItemOID']} is defined more than once in the ValueLevel rows "
+                                     f"with different attributes")
+                continue
+            self.value_level_items[row["ItemOID"]] = item
+            if row["ItemOID"] in self.item_oids:
+                continue
+            self.item_oids.add(row["ItemOID"])
+            self.write_item_def(row["ItemOID"], row["Variable"], row["Data Type"], row["Length"],
+                                row["Significant Digits"], row["Format"], "", row["Codelist"], row["Comment"], "")
+
+    def write_item_def(self, oid, name, data_type, length, sig_digits, display_format, label, codelist, comment,
+                       value_list_oid):
+        if comment:
+            self.comment_oids.add(comment)
+        self.start("ItemDef", attributes(
+            ("OID", oid), ("Name", name), ("DataType", data_type), ("Length", length),
+            ("SignificantDigits", sig_digits), ("SASFieldName", name[:8]), ("def:DisplayFormat", display_format),
+            ("def:CommentOID", comment)))
+        if label:
+            self.description(label)
+        if codelist:
+            self.element("CodeListRef", {"CodeListOID": codelist})
+        if value_list_oid:
+            self.element("def:ValueListRef", {"ValueListOID": value_list_oid})
+        self.end("ItemDef")
+
+    def write_codelists(self, codelists):
+        codelist_oids = set()
+        for oid, rows in groupby(codelists, key=lambda row: row["OID"]):
+            # one codelist is buffered at a time to know whether the terms have decodes
+            rows = list(rows)
+            if oid in codelist_oids:
+                print(f"codelist {oid} is defined more than once and only the first definition was written")
+                continue
+            codelist_oids.add(oid)
+            first = rows[0]
+            self.start("CodeList", attributes(("OID", oid), ("Name", first["Name"]), ("DataType", first["Data Type"]),
+                                              ("def:StandardOID", first["StandardOID"])))
+            has_decodes = any(row["Decoded Value"] for row in rows)
+            item_name = "CodeListItem" if has_decodes else "EnumeratedItem"
+            for row in rows:
+                extended = "Yes" if row["IsNonStandard"] == "Yes" and first["NCI Codelist Code"] else ""
+                self.start(item_name, attributes(("CodedValue", row["Term"]), ("OrderNumber", row["Order"]),
+                                                 ("def:ExtendedValue", extended)))
+                if has_decodes:
+                    self.description(row["Decoded Value"] or row["Term"], "Decode")
+                if row["NCI Term Code"]:
+                    self.element("Alias", {"Context": "nci:ExtCodeID", "Name": row["NCI Term Code"]})
+                self.end(item_name)
+            if first["NCI Codelist Code"]:
+                self.element("Alias", {"Context": "nci:ExtCodeID", "Name": first["NCI Codelist Code"]})
+            self.end("CodeList")
+
+    def write_comments(self):
+        for oid in sorted(self.comment_oids):
+            self.start("def:CommentDef", {"OID": oid})
+            self.description(comments.get(oid, oid))
+            self.end("def:CommentDef")
+
+
+def add_define_args(parser):
+    """
+    add the Define-XML header command-line arguments to a script's argparse parser
+    :param parser: argparse parser object
+    """
+    parser.add_argument("--study_name", help="study name used in the Define-XML StudyName and OIDs", required=False,
+                        dest="study_name", default=default_study_name)
+    parser.add_argument("--study_description", help="Define-XML StudyDescription", required=False,
+                        dest="study_description", default=default_study_description)
+    parser.add_argument("--protocol_name", help="Define-XML ProtocolName", required=False, dest="protocol_name",
+                        default=default_protocol_name)
+    parser.add_argument("--sdtmig_version", help="SDTMIG version of the Define-XML standards", required=False,
+                        dest="sdtmig_version", default=default_sdtmig_version)
+    parser.add_argument("--sdtmig_md_version", help="SDTMIG-MD version of the Define-XML standards", required=False,
+                        dest="sdtmig_md_version", default=default_sdtmig_md_version)
+    parser.add_argument("--ct_version", help="SDTM CT package date of the Define-XML standards; defaults to the CT "
+                        "package the codelists are retrieved from", required=False, dest="ct_version", default=None)
+
+
+def create_writer(args, file_out, ct_version=default_ct_version):
+    """
+    create the Define-XML writer from the command-line arguments added by add_define_args
+    :param args: argparse object with the command-line parameters
+    :param file_out: binary file object to write the Define-XML to
+    :param ct_version: SDTM CT package date used when the --ct_version argument is not given
+    :return: DefineXMLWriter object
+    """
+    study = study_metadata(args.study_name, args.study_description, args.protocol_name)
+    standards = define_standards(args.sdtmig_version, args.sdtmig_md_version, args.ct_version or ct_version)
+    return DefineXMLWriter(file_out, study, standards)
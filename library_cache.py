@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+"""
+library_cache.py provides a persistent on-disk cache for CDISC Library API responses that is shared by the map2*
+scripts. Library content is immutable for a given CT package or SDTMIG version, so each response is stored in a JSON
+file named by the SHA-256 hash of the package and endpoint. Cached responses older than the TTL are revalidated with
+the Library using the ETag returned with the original response. The cache is trimmed back to its size limit by
+removing the least recently used responses. In offline mode the Library is never contacted and only cached responses
+are used, which makes it possible to run the scripts on machines without internet access.
+"""
+
+# default cache location - assumes child data dir
+default_cache_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'library_cache')
+# cached responses are revalidated with the Library after this many days
+default_ttl_days = 30
+# the cache is trimmed back to this many megabytes when it grows too large
+default_max_mb = 256
+
+
+class LibraryCacheMiss(Exception):
+    """ raised in offline mode when a response is requested that is not in the cache """
+    pass
+
+
+class LibraryCache:
+    def __init__(self, cache_dir=default_cache_dir, ttl_days=default_ttl_days, max_mb=default_max_mb, offline=False):
+        """
+        :param cache_dir: directory used to store the cached Library responses
+        :param ttl_days: number of days a cached response is used before it is revalidated with the Library
+        :param max_mb: maximum size of the cache in megabytes before least recently used responses are removed
+        :param offline: when True only cached responses are used and the Library is never contacted
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl_days * 24 * 60 * 60
+        self.max_bytes = max_mb * 1024 * 1024
+        self.offline = offline
+        self.total_bytes = None
+        # responses may be added to the cache from concurrent worker threads
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(endpoint, package=""):
+        """
+        create the content address for a Library response
+        :param endpoint: Library API endpoint string
+        :param package: CT package or standard version the endpoint belongs to
+        :return: string; hex SHA-256 digest that identifies the cached response
+        """
+        return hashlib.sha256((package + "|" + endpoint).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def get(self, endpoint, package=""):
+        """
+        retrieve a cached Library response
+        :param endpoint: Library API endpoint string
+        :param package: CT package or standard version the endpoint belongs to
+        :return: dictionary with the cached response and its metadata or None if not cached
+        """
+        path = self._path(self.make_key(endpoint, package))
+        try:
+            with open(path, "r", encoding="utf-8") as file_in:
+                entry = json.load(file_in)
+        except (OSError, ValueError):
+            return None
+        # record the access time so eviction removes the least recently used responses first; this is best-effort as
+        # a read-only or shared cache can still be read
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def is_fresh(self, entry):
+        """
+        :param entry: cached response dictionary returned by get
+        :return: True if the cached response is within its TTL and does not need to be revalidated
+        """
+        return time.time() - entry["fetched"] < self.ttl
+
+    def put(self, endpoint, body, etag="", package=""):
+        """
+        add or replace a Library response in the cache
+        :param endpoint: Library API endpoint string
+        :param body: the JSON response content from the Library
+        :param etag: the ETag header returned by the Library used to revalidate the response
+        :param package: CT package or standard version the endpoint belongs to
+        :return: dictionary with the cached response and its metadata
+        """
+        entry = {"endpoint": endpoint, "package": package, "etag": etag, "fetched": time.time(), "body": body}
+        path = self._path(self.make_key(endpoint, package))
+        with self.lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file_out:
+                json.dump(entry, file_out)
+            os.replace(tmp_path, path)
+            if self.total_bytes is None:
+                self.total_bytes = self._scan_size()
+            else:
+                self.total_bytes += os.path.getsize(path) - old_size
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+        return entry
+
+    def refresh(self, entry):
+        """
+        reset the TTL for a cached response after the Library confirms it has not changed
+        :param entry: cached response dictionary returned by get
+        """
+        self.put(entry["endpoint"], entry["body"], entry["etag"], entry["package"])
+
+    def _cache_files(self):
+        for dir_path, dir_names, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                if file_name.endswith(".json"):
+                    yield os.path.join(dir_path, file_name)
+
+    def _scan_size(self):
+        return sum(os.path.getsize(path) for path in self._cache_files())
+
+    def evict(self):
+        """
+        remove the least recently used responses until the cache is smaller than 90% of its size limit
+        """
+        files = sorted(self._cache_files(), key=os.path.getmtime)
+        self.total_bytes = sum(os.path.getsize(path) for path in files)
+        target = self.max_bytes * 0.9
+        for path in files:
+            if self.total_bytes <= target:
+                break
+            self.total_bytes -= os.path.getsize(path)
+            os.remove(path)
+
+
+def add_cache_args(parser):
+    """
+    add the Library response cache command-line arguments to a script's argparse parser
+    :param parser: argparse parser object
+    """
+    parser.add_argument("--cache_dir", help="directory used to cache CDISC Library responses",
+                        required=False, dest="cache_dir", default=default_cache_dir)
+    parser.add_argument("--cache_ttl", help="days before a cached Library response is revalidated",
+                        required=False, dest="cache_ttl", type=float, default=default_ttl_days)
+    parser.add_argument("--cache_max_mb", help="maximum size of the Library response cache in megabytes",
+                        required=False, dest="cache_max_mb", type=float, default=default_max_mb)
+    parser.add_argument("--no_cache", help="always request content from the CDISC Library",
+                        required=False, dest="no_cache", action="store_true", default=False)
+    parser.add_argument("--offline", help="only use cached CDISC Library responses",
+                        required=False, dest="offline", action="store_true", default=False)
+
+
+def create_cache(args):
+    """
+    create the Library response cache from the command-line arguments added by add_cache_args
+    :param args: argparse object with the command-line parameters
+    :return: LibraryCache object or None if caching is disabled
+    """
+    if args.no_cache and not args.offline:
+        return None
+    return LibraryCache(args.cache_dir, args.cache_ttl, args.cache_max_mb, args.offline)
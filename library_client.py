@@ -0,0 +1,313 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import library_cache
+import library_stub
+
+"""
+library_client.py provides the CDISC Library API client shared by the map2* scripts. The client keeps a pooled
+requests Session so connections to the Library are re-used across requests and worker threads, asks the Library for
+gzip compressed responses, and applies a timeout to every request as well as an optional deadline for all the
+requests made during a run so that a stalled connection cannot hang a script. Responses are read from and added to
+the LibraryCache when one is provided, and a long-running process, such as define_build in watch mode, can also keep
+every response in memory so each endpoint is only retrieved once. Requests that fail with a server error or are
+rate limited (HTTP 5xx or 429) are retried a few times with an exponential backoff, and a LibraryRequestError naming
+the URL and status is raised if the Library still does not return the content. The client counts the requests made and
+the bytes received and keeps a histogram of the request latencies.
+"""
+
+library_base_url = "https://library.cdisc.org/api"
+# seconds allowed to establish a connection and to wait for the Library to send data
+default_connect_timeout = 10
+default_read_timeout = 60
+# maximum number of connections kept open to the Library
+default_pool_size = 16
+# maximum number of concurrent requests made to the Library by get_many
+default_workers = 8
+# upper bounds in seconds of the request latency histogram buckets; slower requests are counted in a final bucket
+latency_buckets = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+# HTTP status codes of Library responses that are retried, as the same request may succeed later
+retry_statuses = {429, 500, 502, 503, 504}
+# number of times a request that fails with a retry status is retried
+default_retries = 3
+# seconds waited before the first retry; the wait doubles for each later retry
+default_backoff = 0.5
+# most seconds waited before a retry, including a wait asked for by the Library with a Retry-After header
+max_backoff = 30.0
+
+
+class LibraryDeadlineExceeded(Exception):
+    """ raised when the overall deadline for the Library requests made during a run has passed """
+    pass
+
+
+class LibraryRequestError(Exception):
+    """ raised when the Library does not return the content for an endpoint """
+    def __init__(self, url, status_code, attempts=1):
+        """
+        :param url: the URL requested
+        :param status_code: HTTP status code of the last response from the Library
+        :param attempts: number of times the URL was requested
+        """
+        super().__init__(f"CDISC Library returned HTTP {status_code} for {url} after {attempts} attempt(s)")
+        self.url = url
+        self.status_code = status_code
+        self.attempts = attempts
+
+
+class LibraryClient:
+    def __init__(self, api_key, cache=None, base_url=library_base_url, connect_timeout=default_connect_timeout,
+                 read_timeout=default_read_timeout, deadline=None, pool_size=default_pool_size, record_dir=None,
+                 keep_responses=False, retries=default_retries, backoff=default_backoff):
+        """
+        :param api_key: string CDISC Library API key
+        :param cache: LibraryCache object used to store Library responses or None to skip the cache
+        :param base_url: base URL for the Library API
+        :param connect_timeout: seconds allowed to establish a connection to the Library
+        :param read_timeout: seconds allowed between bytes received from the Library
+        :param deadline: seconds allowed for all requests made by this client or None for no overall deadline
+        :param pool_size: maximum number of connections kept open to the Library
+        :param record_dir: directory to save every Library response to as a fixture for library_stub or None
+        :param keep_responses: keep every response in memory and return it for later requests for the same endpoint,
+        such as in a long-running watch mode
+        :param retries: number of times a request that fails with a server error or is rate limited is retried
+        :param backoff: seconds waited before the first retry; the wait doubles for each later retry
+        """
+        self.cache = cache
+        self.base_url = base_url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = time.monotonic() + deadline if deadline else None
+        self.record_dir = record_dir
+        self.responses = {} if keep_responses else None
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept": "application/json", "Accept-Encoding": "gzip, deflate",
+                                     "User-Agent": "crawler", "api-key": api_key})
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.memory_hits = 0
+        self.revalidations = 0
+        self.retried = 0
+        self.latency_seconds = 0.0
+        self.latency_counts = [0] * (len(latency_buckets) + 1)
+
+    def _timeout(self, url):
+        """
+        :param url: the URL about to be requested, used in the error message if the deadline has passed
+        :return: tuple with the connect and read timeouts for the next request limited by the overall deadline
+        """
+        if self.deadline is None:
+            return self.connect_timeout, self.read_timeout
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise LibraryDeadlineExceeded(f"deadline for CDISC Library requests passed before requesting {url}")
+        return min(self.connect_timeout, remaining), min(self.read_timeout, remaining)
+
+    def _count(self, counter, amount=1):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def _count_latency(self, seconds):
+        bucket = next((idx for idx, bound in enumerate(latency_buckets) if seconds <= bound), len(latency_buckets))
+        with self.lock:
+            self.latency_seconds += seconds
+            self.latency_counts[bucket] += 1
+
+    def _record(self, endpoint, body, etag):
+        """
+        save a response as a fixture for library_stub when a record_dir is set, whether the response came from the
+        Library or the cache
+        :param endpoint: Library API endpoint string
+        :param body: the JSON response content
+        :param etag: the ETag of the response
+        """
+        if self.record_dir:
+            library_stub.record_fixture(self.record_dir, endpoint, body, etag)
+
+    def _retry_wait(self, r, attempt):
+        """
+        :param r: requests Response with a retry status
+        :param attempt: number of the failed attempt starting at 0
+        :return: seconds to wait before the next attempt, limited by max_backoff and the overall deadline
+        """
+        wait = self.backoff * 2 ** attempt
+        retry_after = r.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            wait = max(wait, float(retry_after))
+        wait = min(wait, max_backoff)
+        if self.deadline is not None:
+            wait = min(wait, max(0.0, self.deadline - time.monotonic()))
+        return wait
+
+    def _get(self, url, headers):
+        """
+        GET a URL, retrying with an exponential backoff while the Library responds with a retry status
+        :param url: the URL to request
+        :param headers: dictionary of additional request headers
+        :return: requests Response with a status that is not retried
+        """
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            r = self.session.get(url, headers=headers, timeout=self._timeout(url))
+            self._count_latency(time.perf_counter() - start)
+            self._count("requests")
+            self._count("bytes_received", int(r.headers.get("Content-Length", len(r.content))))
+            self._count("bytes_decoded", len(r.content))
+            if r.status_code not in retry_statuses:
+                return r
+            self._count("errors")
+            if attempt < self.retries:
+                self._count("retried")
+                time.sleep(self._retry_wait(r, attempt))
+        raise LibraryRequestError(url, r.status_code, self.retries + 1)
+
+    def get_json(self, endpoint, package=""):
+        """
+        retrieve the JSON content for an endpoint from the responses kept in memory, the cache or the CDISC Library
+        :param endpoint: endpoint string used to create the API call to the Library
+        :param package: CT package or standard version the endpoint belongs to and is used in the cache key
+        :return: json results from memory, the cache or the Library GET request for the endpoint
+        """
+        if self.responses is None:
+            return self.fetch_json(endpoint, package)
+        key = (package, endpoint)
+        if key in self.responses:
+            self._count("memory_hits")
+            return self.responses[key]
+        body = self.fetch_json(endpoint, package)
+        if body is not None:
+            self.responses[key] = body
+        return body
+
+    def fetch_json(self, endpoint, package=""):
+        """
+        retrieve the JSON content for an endpoint from the cache or the CDISC Library
+        :param endpoint: endpoint string used to create the API call to the Library
+        :param package: CT package or standard version the endpoint belongs to and is used in the cache key
+        :return: json results from the cache or the Library GET request for the endpoint
+        :raises LibraryRequestError: if the Library does not return the content, after retrying server errors
+        """
+        cache = self.cache
+        entry = cache.get(endpoint, package) if cache else None
+        if entry and (cache.offline or cache.is_fresh(entry)):
+            self._count("cache_hits")
+            self._record(endpoint, entry["body"], entry["etag"])
+            return entry["body"]
+        if cache:
+            self._count("cache_misses")
+            if cache.offline:
+                raise library_cache.LibraryCacheMiss(f"offline mode: no cached response for {endpoint} in "
+                                                     f"{cache.cache_dir}")
+        url = self.base_url + endpoint
+        headers = {}
+        if entry and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        r = self._get(url, headers)
+        if r.status_code == 304 and entry:
+            self._count("revalidations")
+            cache.refresh(entry)
+            self._record(endpoint, entry["body"], entry["etag"])
+            return entry["body"]
+        elif r.status_code == 200:
+            body = r.json()
+            if cache:
+                cache.put(endpoint, body, r.headers.get("ETag", ""), package)
+            self._record(endpoint, body, r.headers.get("ETag", ""))
+            return body
+        else:
+            self._count("errors")
+            raise LibraryRequestError(url, r.status_code)
+
+    def get_many(self, endpoints, package="", workers=default_workers, skip_errors=False):
+        """
+        retrieve the JSON content for a set of endpoints concurrently, requesting each distinct endpoint only once
+        :param endpoints: list of endpoint strings; duplicate endpoints are coalesced into a single request
+        :param package: CT package or standard version the endpoints belong to and is used in the cache key
+        :param workers: maximum number of concurrent requests made to the Library
+        :param skip_errors: report an endpoint the Library does not return and use None as its result instead of
+        raising LibraryRequestError
+        :return: dictionary of json results keyed by endpoint in the order each endpoint first appears
+        """
+        unique_endpoints = list(dict.fromkeys(endpoints))
+        get_json = self.get_json_or_none if skip_errors else self.get_json
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            results = executor.map(lambda endpoint: get_json(endpoint, package), unique_endpoints)
+            return dict(zip(unique_endpoints, results))
+
+    def get_json_or_none(self, endpoint, package=""):
+        """
+        :param endpoint: endpoint string used to create the API call to the Library
+        :param package: CT package or standard version the endpoint belongs to and is used in the cache key
+        :return: json results for the endpoint, or None after reporting the error if the Library does not return it
+        """
+        try:
+            return self.get_json(endpoint, package)
+        except LibraryRequestError as ex:
+            print(f"unable to retrieve {endpoint}: {ex}")
+            return None
+
+    def stats(self):
+        """
+        :return: dictionary with the request, byte, cache and latency counters for this client
+        """
+        with self.lock:
+            bounds = [f"<={bound}s" for bound in latency_buckets] + [f">{latency_buckets[-1]}s"]
+            return {"requests": self.requests, "errors": self.errors, "bytes_received": self.bytes_received,
+                    "bytes_decoded": self.bytes_decoded, "cache_hits": self.cache_hits,
+                    "cache_misses": self.cache_misses, "memory_hits": self.memory_hits,
+                    "revalidations": self.revalidations, "retries": self.retried,
+                    "latency_seconds": round(self.latency_seconds, 6),
+                    "latency_histogram": dict(zip(bounds, self.latency_counts))}
+
+    def print_stats(self):
+        """ print a summary of the Library requests made by this client """
+        stats = self.stats()
+        print(f"made {stats['requests']} Library requests ({stats['errors']} errors, {stats['retries']} retried) "
+              f"receiving {stats['bytes_received']} bytes ({stats['bytes_decoded']} decoded), "
+              f"{stats['cache_hits']} cache hits, {stats['revalidations']} revalidated...")
+
+    def close(self):
+        self.session.close()
+
+
+def add_client_args(parser):
+    """
+    add the Library client and response cache command-line arguments to a script's argparse parser
+    :param parser: argparse parser object
+    """
+    parser.add_argument("--base_url", help="base URL for the CDISC Library API, such as a local library_stub",
+                        required=False, dest="base_url", default=library_base_url)
+    parser.add_argument("--record_dir", help="directory to save the CDISC Library responses to for library_stub",
+                        required=False, dest="record_dir", default=None)
+    parser.add_argument("--timeout", help="seconds to wait for the CDISC Library to connect or send data",
+                        required=False, dest="timeout", type=float, default=default_read_timeout)
+    parser.add_argument("--deadline", help="seconds allowed for all CDISC Library requests made in a run",
+                        required=False, dest="deadline", type=float, default=None)
+    parser.add_argument("--retries", help="number of times a CDISC Library request that fails with a server error or "
+                        "is rate limited is retried", required=False, dest="retries", type=int, default=default_retries)
+    library_cache.add_cache_args(parser)
+
+
+def create_client(args, keep_responses=False):
+    """
+    create the Library client from the command-line arguments added by add_client_args
+    :param args: argparse object with the command-line parameters including the api_key
+    :param keep_responses: keep every response in memory for later requests for the same endpoint
+    :return: LibraryClient object
+    """
+    cache = library_cache.create_cache(args)
+    return LibraryClient(args.api_key, cache, args.base_url, connect_timeout=min(default_connect_timeout, args.timeout),
+                         read_timeout=args.timeout, deadline=args.deadline, record_dir=args.record_dir,
+                         keep_responses=keep_responses, retries=args.retries)
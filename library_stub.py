@@ -0,0 +1,194 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+library_stub.py is a local stand-in for the CDISC Library API that replays recorded responses. It is used to run,
+benchmark and test the Library-backed code paths in the map2* scripts without network access or a Library API key.
+Responses are recorded by running a script with the --record_dir argument, which saves every Library response as a
+fixture file. A LibraryCache directory can also be used as the fixtures directory. The stand-in can inject latency and
+errors to measure how the scripts behave with a slow or unreliable Library.
+Example Cmd-line:
+    python map2codelists.py --record_dir ./data/library_fixtures
+    python library_stub.py -f ./data/library_fixtures -p 8800 --latency 0.05 --error_rate 0.01
+    python map2codelists.py --no_cache --base_url http://127.0.0.1:8800/api
+"""
+
+# default location of the recorded Library responses - assumes child data dir
+default_fixtures_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'library_fixtures')
+# the stand-in serves the endpoints under the same path prefix as the Library
+api_prefix = "/api"
+
+
+def fixture_file_name(endpoint):
+    """
+    :param endpoint: Library API endpoint string
+    :return: string; file name used to save the recorded response for the endpoint
+    """
+    return hashlib.sha256(endpoint.encode("utf-8")).hexdigest() + ".json"
+
+
+def record_fixture(fixtures_dir, endpoint, body, etag=""):
+    """
+    save a Library response as a fixture file that can be replayed by the stand-in
+    :param fixtures_dir: directory to save the fixture file to
+    :param endpoint: Library API endpoint string
+    :param body: the JSON response content from the Library
+    :param etag: the ETag header returned by the Library
+    """
+    os.makedirs(fixtures_dir, exist_ok=True)
+    with open(os.path.join(fixtures_dir, fixture_file_name(endpoint)), "w", encoding="utf-8") as file_out:
+        json.dump({"endpoint": endpoint, "etag": etag, "body": body}, file_out)
+
+
+def load_fixtures(fixtures_dir):
+    """
+    load the recorded responses from a fixtures or LibraryCache directory
+    :param fixtures_dir: directory searched for JSON files with endpoint and body content
+    :return: dictionary keyed by endpoint with the serialized response body and ETag
+    """
+    fixtures = {}
+    for dir_path, dir_names, file_names in os.walk(fixtures_dir):
+        for file_name in sorted(file_names):
+            if not file_name.endswith(".json"):
+                continue
+            with open(os.path.join(dir_path, file_name), "r", encoding="utf-8") as file_in:
+                fixture = json.load(file_in)
+            if "endpoint" not in fixture or "body" not in fixture:
+                continue
+            content = json.dumps(fixture["body"]).encode("utf-8")
+            etag = fixture.get("etag") or '"' + hashlib.sha256(content).hexdigest()[:32] + '"'
+            fixtures[fixture["endpoint"]] = {"content": content, "gzip": gzip.compress(content), "etag": etag}
+    return fixtures
+
+
+class LibraryStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fixtures, port=0, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        """
+        :param fixtures: dictionary of recorded responses created by load_fixtures
+        :param port: port to listen on; 0 picks a free port
+        :param latency: seconds added to every response
+        :param jitter: maximum random seconds added to the latency of each response
+        :param error_rate: fraction of requests that fail with an HTTP 503 error
+        :param seed: random seed used for the jitter and errors so runs are reproducible
+        """
+        super().__init__(("127.0.0.1", port), LibraryStubHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.thread = None
+
+    @property
+    def base_url(self):
+        """ the base URL to pass to the scripts with the --base_url argument """
+        return f"http://127.0.0.1:{self.server_address[1]}{api_prefix}"
+
+    def next_delay_and_error(self):
+        """
+        :return: tuple with the seconds to delay the next response and True if the response should fail
+        """
+        with self.lock:
+            self.requests += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            return delay, self.random.random() < self.error_rate
+
+    def start(self):
+        """ serve requests in a background thread and return the stand-in so it can be used in a with statement """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        if self.thread:
+            self.shutdown()
+        super().__exit__(*args)
+
+
+class LibraryStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        delay, is_error = self.server.next_delay_and_error()
+        if delay:
+            time.sleep(delay)
+        endpoint = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        if endpoint.startswith(api_prefix):
+            endpoint = endpoint[len(api_prefix):]
+        fixture = self.server.fixtures.get(endpoint)
+        if is_error:
+            self.send_content(503, b'{"message": "injected error"}')
+        elif fixture is None:
+            self.send_content(404, b'{"message": "no recorded response"}')
+        elif self.headers.get("If-None-Match") == fixture["etag"]:
+            self.send_content(304, b"", fixture["etag"])
+        elif "gzip" in self.headers.get("Accept-Encoding", ""):
+            self.send_content(200, fixture["gzip"], fixture["etag"], "gzip")
+        else:
+            self.send_content(200, fixture["content"], fixture["etag"])
+
+    def send_content(self, status, content, etag="", encoding=""):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if etag:
+            self.send_header("ETag", etag)
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def set_cmd_line_args():
+    """
+    get the command-line arguments needed to run the Library stand-in
+    :return: return the argparse object with the command-line parameters
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--fixtures", help="directory with the recorded Library responses",
+                        required=False, dest="fixtures_dir", default=default_fixtures_dir)
+    parser.add_argument("-p", "--port", help="port to listen on", required=False, dest="port", type=int, default=8800)
+    parser.add_argument("--latency", help="seconds added to every response",
+                        required=False, dest="latency", type=float, default=0.0)
+    parser.add_argument("--jitter", help="maximum random seconds added to the latency",
+                        required=False, dest="jitter", type=float, default=0.0)
+    parser.add_argument("--error_rate", help="fraction of requests that fail with an HTTP 503 error",
+                        required=False, dest="error_rate", type=float, default=0.0)
+    parser.add_argument("--seed", help="random seed for the jitter and injected errors",
+                        required=False, dest="seed", type=int, default=None)
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    """
+    main driver that serves the recorded Library responses until interrupted
+    """
+    args = set_cmd_line_args()
+    fixtures = load_fixtures(args.fixtures_dir)
+    stub = LibraryStub(fixtures, args.port, args.latency, args.jitter, args.error_rate, args.seed)
+    print(f"serving {len(fixtures)} recorded Library responses at {stub.base_url}...")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"served {stub.requests} requests...")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,10 @@
-import requests
-import xlsxwriter as XLS
 import os.path
 import argparse
+import library_client
+import ct_store
+import metadata_writer
+import profiler
+import sheet_order
 
 """
 map2codelists.py generates the codelist metadata based used to generate codelists in Define-XML v2.1. The codelists were
@@ -64,24 +67,55 @@ header = ["OID", "Name", "NCI Codelist Code", "Data Type", "Order", "Term", "NCI
 # the worksheets to skip when processing the SDTM mapping spreadsheet
 worksheet_skip = ["T1Dexi Tables", "Domains", "Sheet1"]
 
+# maximum number of concurrent requests made to the CDISC Library when retrieving codelists
+max_workers = library_client.default_workers
+
 # output spreadsheet with just the codelists tab that can be copied to the odmlib spreadsheet - assumes child data dir
 excel_define_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'codelists-test.xlsx')
 
 
-def get_codelist_from_library(endpoint, api_key):
+def get_codelist_c_codes():
+    """
+    find the c-codes for all the codelists retrieved from the Library including the codelist subsets and domains
+    :return: list of unique codelist c-codes in the order they are first used
+    """
+    c_codes = [cl_oid.split(".")[1] for cl_oid in codelists]
+    c_codes.append("C66734")
+    c_codes.extend(subset["oid"].split(".")[1] for subset in codelist_subsets)
+    return list(dict.fromkeys(c_codes))
+
+
+def fetch_codelists(c_codes, client, workers=max_workers):
+    """
+    retrieve a set of codelists from the Library concurrently using a bounded pool of worker threads
+    :param c_codes: list of codelist c-codes to retrieve from the Library
+    :param client: LibraryClient object used to request content from the CDISC Library
+    :param workers: maximum number of concurrent requests made to the Library
+    :return: dictionary of Library codelists keyed by c-code in the same order as c_codes
+    """
+    package = package_standard + "-" + package_date
+    endpoints = ["/mdr/ct/packages/" + package + "/codelists/" + c_code for c_code in c_codes]
+    results = client.get_many(endpoints, package, workers)
+    library_codelists = {c_code: results[endpoint] for c_code, endpoint in zip(c_codes, endpoints)}
+    print(f"retrieved {len(library_codelists)} codelists from the Library...")
+    return library_codelists
+
+
+def fetch_codelists_from_store(c_codes, store):
     """
-    retrieve a codelist from the CDISC Library using the provided endpoint
-    :param endpoint: endpoint string used to create the API call to the Library to retrieve a codelist
-    :param api_key: string CDISC Library API key
-    :return: json results from Library GET request for a specified codelist
+    retrieve a set of codelists from the local CT store instead of requesting each one from the Library
+    :param c_codes: list of codelist c-codes to retrieve from the CT store
+    :param store: CTStore object with the study CT package loaded
+    :return: dictionary of codelists keyed by c-code in the same order as c_codes
     """
-    base_url = "https://library.cdisc.org/api"
-    headers = {"Accept": "application/json", "User-Agent": "crawler", "api-key": api_key}
-    r = requests.get(base_url + endpoint, headers=headers)
-    if r.status_code == 200:
-        return r.json()
-    else:
-        print(f"HTTPError {r.status_code} for url {base_url + endpoint}")
+    package = package_standard + "-" + package_date
+    library_codelists = {}
+    for c_code in c_codes:
+        library_codelists[c_code] = store.get_codelist(package, c_code)
+        if library_codelists[c_code] is None:
+            print(f"codelist {c_code} not found in CT package {package}")
+    print(f"retrieved {len(library_codelists)} codelists from the CT store...")
+    return library_codelists
 
 
 def process_library_codelist(cl_oid, cl):
@@ -109,16 +143,13 @@ def process_library_codelist(cl_oid, cl):
     return rows
 
 
-def create_domain_codelist_subsets(worksheet, row_nbr, api_key):
+def create_domain_codelist_subsets(library_codelists):
     """ create a codelist subset for each domain used in the study
-    :param worksheet: odmlib worksheet object to write to
-    :param row_nbr: row number to start appending codelists to the worksheet
-    :param api_key: string CDISC Library API key
-    :return: row_nbr: integer that indicates where to start appending new codelists
+    :param library_codelists: dictionary of codelists retrieved from the Library keyed by c-code
+    :return: list of domain codelist rows ready to add to the odmlib codelist worksheet
     """
     cl_count = 0
-    endpoint = "/mdr/ct/packages/" + package_standard + "-" + package_date + "/codelists/C66734"
-    cl = get_codelist_from_library(endpoint, api_key)
+    domain_terms = index_terms(library_codelists["C66734"], "submissionValue")
     rows = []
     for order_nbr, cl_oid in enumerate(domain_codelists):
         row = {key: "" for key in header}
@@ -128,7 +159,7 @@ def create_domain_codelist_subsets(worksheet, row_nbr, api_key):
         row["NCI Codelist Code"] = "C66734"
         row["Data Type"] = "text"
         row["Order"] = 1        # every domain codelist has 1 term
-        term = get_domain_term(cl, domain_oid[2])
+        term = get_domain_term(domain_terms, domain_oid[2])
         row["Term"] = term["Term"]
         row["NCI Term Code"] = term["NCI Term Code"]
         row["Decoded Value"] = term["Decoded Value"]
@@ -137,29 +168,40 @@ def create_domain_codelist_subsets(worksheet, row_nbr, api_key):
         row["StandardOID"] = term["StandardOID"]
         rows.append(row)
         cl_count += 1
-
-    row_nbr = write_codelist_to_xls(worksheet, rows, row_nbr)
     print(f"added {cl_count} domain codelist subsets...")
-    return row_nbr
+    return rows
 
 
-def get_domain_term(cl, domain):
+def index_terms(cl, key):
+    """
+    create a look-up table for the terms in a codelist
+    :param cl: codelist retrieved from the Library or the CT store
+    :param key: the term attribute to index on, such as submissionValue or conceptId
+    :return: dictionary of terms keyed by the key attribute - the first term wins if a key value is repeated
+    """
+    terms = {}
+    for term in cl["terms"]:
+        terms.setdefault(term[key], term)
+    return terms
+
+
+def get_domain_term(domain_terms, domain):
     """
     create the codelist term values for a given domain code
-    :param cl: the codelist for domains
+    :param domain_terms: the terms from the codelist for domains indexed by submission value
     :param domain: the 2 letter domain abbreviation to use to find the codelist term details to return
     :return: term dictionary with the details of the domain codelist term
     """
     term = {}
-    for domain_term in cl["terms"]:
-        if domain_term["submissionValue"] == domain:
-            term["Term"] = domain_term["submissionValue"]
-            term["NCI Term Code"] = domain_term["conceptId"]
-            term["Decoded Value"] = domain_term["preferredTerm"]
-            term["Comment"] = ""
-            term["IsNonStandard"] = ""
-            term["StandardOID"] = "STD.3"
-            return term
+    domain_term = domain_terms.get(domain)
+    if domain_term:
+        term["Term"] = domain_term["submissionValue"]
+        term["NCI Term Code"] = domain_term["conceptId"]
+        term["Decoded Value"] = domain_term["preferredTerm"]
+        term["Comment"] = ""
+        term["IsNonStandard"] = ""
+        term["StandardOID"] = "STD.3"
+        return term
     term["Term"] = domain
     term["NCI Term Code"] = ""
     term["Decoded Value"] = ""
@@ -169,50 +211,85 @@ def get_domain_term(cl, domain):
     return term
 
 
-def create_defined_subsets(worksheet, row_nbr, api_key):
+def merge_subsets(subsets):
+    """
+    group the codelist subset definitions by codelist, merging the terms of definitions that repeat a codelist
+    :param subsets: list of codelist subset definitions such as codelist_subsets
+    :return: dictionary of the subset terms keyed by codelist c-code in the order the codelists are first defined; a
+    term is included once for each c-code, or for each submission value of the non-standard terms with c-code "NA"
+    """
+    merged = {}
+    for subset in subsets:
+        terms = merged.setdefault(subset["oid"].split(".")[1], {})
+        for term_dict in subset["terms"]:
+            key = term_dict["sub_val"] if term_dict["c_code"] == "NA" else term_dict["c_code"]
+            terms.setdefault(key, term_dict)
+    return {c_code: list(terms.values()) for c_code, terms in merged.items()}
+
+
+def resolve_subset_terms(cl, subset_terms):
+    """
+    match the subset terms to the terms of the complete codelist using a look-up table of the codelist terms by c-code
+    :param cl: the complete codelist retrieved from the Library or the CT store, or None if it was not found
+    :param subset_terms: list of the term dictionaries with the c_code and sub_val of each subset term
+    :return: tuple of the matched codelist terms in codelist order, the submission values of the non-standard terms
+    that extend the codelist and the c-codes not found in the codelist
+    """
+    positions = {}
+    for idx, term in enumerate(cl["terms"] if cl else []):
+        positions.setdefault(term["conceptId"], (idx, term))
+    matched = []
+    extensions = []
+    unmatched = []
+    for term_dict in subset_terms:
+        if term_dict["c_code"] == "NA":
+            extensions.append(term_dict["sub_val"])
+        elif term_dict["c_code"] in positions:
+            matched.append(positions[term_dict["c_code"]])
+        else:
+            unmatched.append(term_dict["c_code"])
+    matched.sort(key=lambda position: position[0])
+    return [term for idx, term in matched], extensions, unmatched
+
+
+def create_defined_subsets(library_codelists, subsets=None):
     """
     generate codelist subsets based on the codelist_subset dictionary created from the mapping spreadsheet
-    :param worksheet: the Excel worksheet to write the codelist subset values to
-    :param row_nbr: the current row number in the worksheet (start writing from this row an retrun incremented value)
-    :param api_key: the Library API key needed to authenticate access to retrieve the codelist
-    :return: integer: the incremented row_nbr to indicate the current row in the worksheet
+    :param library_codelists: dictionary of codelists retrieved from the Library keyed by c-code
+    :param subsets: list of codelist subset definitions or None to use codelist_subsets
+    :return: list of codelist subset rows ready to add to the odmlib codelist worksheet
     """
-    cl_count = 0
     rows = []
-    for subset in codelist_subsets:
-        c_code = subset["oid"].split(".")[1]
-        # get the complete codelist from the Library to use to populate the subset terms
-        endpoint = "/mdr/ct/packages/" + package_standard + "-" + package_date + "/codelists/" + c_code
-        cl = get_codelist_from_library(endpoint, api_key)
+    merged = merge_subsets(codelist_subsets if subsets is None else subsets)
+    for c_code, subset_terms in merged.items():
+        # the complete codelist from the Library is used to populate the subset terms
+        cl = library_codelists.get(c_code)
+        terms, submission_values, unmatched = resolve_subset_terms(cl, subset_terms)
+        if unmatched:
+            print(f"c-codes {', '.join(unmatched)} not found in {c_code}")
+        name = cl["submissionValue"] if cl else ""
         order_nbr = 1
-        cl_count += 1
-        # find the non-standard terms that extend a codelist and have a c-code == "NA"
-        submission_values = [term_dict["sub_val"] for term_dict in subset["terms"] if term_dict["c_code"] == "NA"]
-        term_c_codes = [term_dict["c_code"] for term_dict in subset["terms"]]
-        is_term_found = False
         # populate fields of the subset term from the Library content
-        for term in cl["terms"]:
-            if term["conceptId"] in term_c_codes:
-                row = {key: "" for key in header}
-                row["OID"] = "CL." + c_code
-                row["Name"] = cl["submissionValue"]
-                row["NCI Codelist Code"] = c_code
-                row["Data Type"] = "text"
-                row["Order"] = order_nbr
-                row["Term"] = term["submissionValue"]
-                row["NCI Term Code"] = term["conceptId"]
-                row["Decoded Value"] = term["preferredTerm"]
-                row["Comment"] = ""
-                row["IsNonStandard"] = ""
-                row["StandardOID"] = "STD.3"
-                is_term_found = True
-                order_nbr += 1
-                rows.append(row)
+        for term in terms:
+            row = {key: "" for key in header}
+            row["OID"] = "CL." + c_code
+            row["Name"] = name
+            row["NCI Codelist Code"] = c_code
+            row["Data Type"] = "text"
+            row["Order"] = order_nbr
+            row["Term"] = term["submissionValue"]
+            row["NCI Term Code"] = term["conceptId"]
+            row["Decoded Value"] = term["preferredTerm"]
+            row["Comment"] = ""
+            row["IsNonStandard"] = ""
+            row["StandardOID"] = "STD.3"
+            order_nbr += 1
+            rows.append(row)
         # process non-standard terms that extend a codelist
         for sv in submission_values:
             row = {key: "" for key in header}
             row["OID"] = "CL." + c_code
-            row["Name"] = cl["submissionValue"]
+            row["Name"] = name
             row["NCI Codelist Code"] = c_code
             row["Data Type"] = "text"
             row["Order"] = order_nbr
@@ -220,39 +297,51 @@ def create_defined_subsets(worksheet, row_nbr, api_key):
             row["Comment"] = ""
             row["IsNonStandard"] = "Yes"
             row["StandardOID"] = ""
-            is_term_found = True
             order_nbr += 1
             rows.append(row)
-        if not is_term_found:
+        if not terms and not submission_values:
             print(f"No terms found in {c_code}")
-    row_nbr = write_codelist_to_xls(worksheet, rows, row_nbr)
-    print(f"added {cl_count} defined subsets...")
-    return row_nbr
+    print(f"added {len(merged)} defined subsets...")
+    return rows
 
 
-def write_codelist_to_xls(worksheet, rows, row_nbr=0):
+def create_codelist_rows(library_codelists):
     """
-    write codelist term rows to the odmlib worksheet
-    :param worksheet: odmlib worksheet object to write to
-    :param rows: a list of codelist row dictionaries to write to the worksheet
-    :param row_nbr: integer row number that indicates which worksheet row to begin appending terms
-    :return: integer row number that indicates the next row to begin appending terms
+    create all the odmlib codelist worksheet rows: the study codelists, the domain codelists and the codelist subsets
+    :param library_codelists: dictionary of codelists retrieved from the Library keyed by c-code
+    :return: list of codelist rows in the order they are added to the odmlib codelist worksheet
     """
-    for row in rows:
-        row_nbr += 1
-        for c, col_name in enumerate(header):
-            worksheet.write(row_nbr, c, row[col_name])
-    return row_nbr
+    rows = []
+    cl_count = 0
+    # add codelists
+    for cl_oid in codelists:
+        prefix, c_code = cl_oid.split(".")
+        rows.extend(process_library_codelist(cl_oid, library_codelists[c_code]))
+        cl_count += 1
+    print(f"added {cl_count} codelists...")
+    # add domain codelists
+    rows.extend(create_domain_codelist_subsets(library_codelists))
+    # add process codelist subsets
+    rows.extend(create_defined_subsets(library_codelists))
+    return rows
 
 
-def write_header_row(worksheet, header_format):
+def load_codelists(client, workers=max_workers, ct_store_file=None, ct_package_file=None):
     """
-    write the worksheet header column labels to the odmlib worksheet
-    :param worksheet: the odmlib worksheet to write the column headers to
-    :param header_format: the header format to indicate the style of the header columns
+    retrieve all the codelists needed from the CT store or the Library before generating the rows
+    :param client: LibraryClient object used to request content from the CDISC Library
+    :param workers: maximum number of concurrent requests made to the Library
+    :param ct_store_file: path and file name of a local CT store to look up the codelists from or None
+    :param ct_package_file: CDISC Library JSON export of the CT package to load into the CT store or None
+    :return: dictionary of codelists keyed by c-code
     """
-    for c, header_label in enumerate(header):
-        worksheet.write(0, c, header_label, header_format)
+    if ct_store_file or ct_package_file:
+        store = ct_store.open_store(package_standard + "-" + package_date, client,
+                                    ct_store_file or ct_store.default_store_file, ct_package_file)
+        library_codelists = fetch_codelists_from_store(get_codelist_c_codes(), store)
+        store.close()
+        return library_codelists
+    return fetch_codelists(get_codelist_c_codes(), client, workers)
 
 
 def set_cmd_line_args():
@@ -265,6 +354,16 @@ def set_cmd_line_args():
                         required=False, dest="api_key", default=library_api_key)
     parser.add_argument("-o", "--output_file", help="path and file name of Define-XML v2.1 metadata spreadsheet file",
                         required=False, dest="define_xls", default=excel_define_file)
+    parser.add_argument("-w", "--workers", help="maximum number of concurrent CDISC Library requests",
+                        required=False, dest="workers", type=int, default=max_workers)
+    parser.add_argument("-s", "--ct_store", help="path and file name of a local CT store (SQLite) to load the complete "
+                        "CT package into and look up codelists from", required=False, dest="ct_store", default=None)
+    parser.add_argument("-p", "--ct_package_file", help="CDISC Library JSON export of the CT package to load into "
+                        "the CT store", required=False, dest="ct_package_file", default=None)
+    library_client.add_client_args(parser)
+    metadata_writer.add_writer_args(parser)
+    profiler.add_profile_args(parser)
+    sheet_order.add_order_args(parser)
     args = parser.parse_args()
     return args
 
@@ -274,30 +373,20 @@ def main():
     main driver for creating the odmlib worksheet and writing codelist and associated terms to it
     """
     args = set_cmd_line_args()
-    workbook = XLS.Workbook(args.define_xls, {"strings_to_numbers": False})
-    header_format = workbook.add_format({"bold": True, "bg_color": "#CCFFFF", "border": True, "border_color": "black"})
-    worksheet = workbook.add_worksheet("codelists")
-    write_header_row(worksheet, header_format)
-
-    cl_count = 0
-    row_nbr = 0
-    # add codelists
-    for cl_oid in codelists:
-        prefix, c_code = cl_oid.split(".")
-        endpoint = "/mdr/ct/packages/" + package_standard + "-" + package_date + "/codelists/" + c_code
-        cl = get_codelist_from_library(endpoint, args.api_key)
-        rows = process_library_codelist(cl_oid, cl)
-        row_nbr = write_codelist_to_xls(worksheet, rows, row_nbr)
-        cl_count += 1
-    print(f"added {cl_count} codelists...")
-
-    # add domain codelists
-    row_nbr = create_domain_codelist_subsets(worksheet, row_nbr, args.api_key)
-
-    # add process codelist subsets
-    row_nbr = create_defined_subsets(worksheet, row_nbr, args.api_key)
-
-    workbook.close()
+    profile = profiler.create_profiler(args, "map2codelists")
+    client = library_client.create_client(args)
+    writer = metadata_writer.create_writer(args)
+
+    with profile.stage("load_codelists"):
+        library_codelists = load_codelists(client, args.workers, args.ct_store, args.ct_package_file)
+    with profile.stage("create_codelist_rows"):
+        rows = create_codelist_rows(library_codelists)
+    with profile.stage("write_output"):
+        writer.write_sheet("codelists", header, sheet_order.sort_rows("codelists", rows,
+                                                                      sheet_order.create_orders(args)))
+        writer.close()
+    client.print_stats()
+    profile.close(client)
 
 
 if __name__ == '__main__':
@@ -1,8 +1,10 @@
 import argparse
 import os
-from openpyxl import load_workbook
-import xlsxwriter as XLS
-import requests
+import spec_model
+import library_client
+import metadata_writer
+import profiler
+import sheet_order
 
 """
 map2datasets.py extracts the variables from the mapping spreadsheet and generates a Define-XML v2.1 metadata worksheet
@@ -19,9 +21,10 @@ library_api_key = "e9a7d1b9bf1a4036ae7b25533a081565"
 
 # SDTM mapping spreadsheet worksheets to skip as they do not contain variables for a given domain
 worksheet_skip = ["T1Dexi SDTM Summary", "T1Dexi Tables", "Domains", "Sheet1"]
-# dataset ordering for SDTM define-xml based on MSG 2.0
-class_order = ["TRIAL DESIGN", "SPECIAL PURPOSE", "INTERVENTIONS", "EVENTS", "FINDINGS", "FINDINGS ABOUT",
-               "RELATIONSHIP", "STUDY REFERENCE"]
+
+# Library endpoints for the SDTMIG 3.3 classes and the Define-XML CT codelist for class names
+classes_endpoint = "/mdr/sdtmig/3-3/classes"
+class_ct_endpoint = "/mdr/ct/packages/define-xmlct-2021-12-17/codelists/C103329"
 
 # name and path of the input SDTM mapping spreadsheet and default -i CLI arg value - assumes child data dir
 # excel_map_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'SDTM-mapping-spec-02Feb2022.xlsx')
@@ -31,62 +34,36 @@ excel_map_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data
 excel_define_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'datasets_test.xlsx')
 
 
-def write_header_row(worksheet, header_format):
-    """
-    write the worksheet header column labels to the odmlib worksheet
-    :param worksheet: the odmlib worksheet to write the column headers to
-    :param header_format: the header format to indicate the style of the header columns
-    """
-    for c, header_label in enumerate(header):
-        worksheet.write(0, c, header_label, header_format)
-
-
-def create_define_sheet(table, sheet_name, workbook, header_format):
+def resolve_library_content(domains, client, workers=library_client.default_workers):
     """
-    write variable definition rows to the odmlib worksheet
-    :param table: list of row dictionaries with content to write to the worksheet
-    :param sheet_name: name of the odmlib worksheet to create to write variable content
-    :param workbook: workbook object to add the worksheet to
-    :param header_format: format for the header_row used when writing the column headers
+    retrieve all the Library content needed to generate the datasets rows before the rows are created. The distinct
+    endpoints are collected first, so domains that share an endpoint, such as the FA* domains, are requested once.
+    :param domains: list of domain short names from the Domains worksheet
+    :param client: LibraryClient object used to request content from the CDISC Library
+    :param workers: maximum number of concurrent requests made to the Library
+    :return: dictionary of Library content keyed by endpoint, with None for the domain endpoints not retrieved
     """
-    worksheet = workbook.add_worksheet(sheet_name)
-    write_header_row(worksheet, header_format)
-    for r, row in enumerate(table):
-        for c, col_name in enumerate(header):
-            try:
-                worksheet.write(r+1, c, row[col_name])
-            except Exception as ex:
-                print(ex)
+    library = client.get_many([classes_endpoint, class_ct_endpoint], workers=workers)
+    # a domain the Library does not return, such as a custom domain, is reported and skipped when the rows are created
+    library.update(client.get_many([lookup_domain_endpoint(domain) for domain in domains], workers=workers,
+                                   skip_errors=True))
+    # the class hierarchy links are only known once the classes have been retrieved
+    class_hrefs = [cl_dict["href"] for cl_dict in library[classes_endpoint]["_links"]["classes"]]
+    library.update(client.get_many(class_hrefs, workers=workers))
+    print(f"resolved {len(library)} distinct Library endpoints for {len(domains)} domains...")
+    return library
 
 
-def get_endpoint_from_library(endpoint, api_key):
-    """
-    retrieve a codelist from the CDISC Library using the provided endpoint
-    :param endpoint: endpoint string used to create the API call to the Library to retrieve a codelist
-    :param api_key: string CDISC Library API key
-    :return: json results from Library GET request for a specified codelist
-    """
-    base_url = "https://library.cdisc.org/api"
-    headers = {"Accept": "application/json", "User-Agent": "crawler", "api-key": api_key}
-    r = requests.get(base_url + endpoint, headers=headers)
-    if r.status_code == 200:
-        return r.json()
-    else:
-        print(f"HTTPError {r.status_code} for url {base_url + endpoint}")
-
-
-def load_class_names(api_key):
+def load_class_names(library):
     """
     lookup the class names for the datasets in SDTMIG 3.3
-    :param api_key: string; API key needed to authenticate and access the CDISC Library API
+    :param library: dictionary of Library content keyed by endpoint created by resolve_library_content
     :return: dictionary of class names associated with the dataset
     """
-    endpoint = "/mdr/sdtmig/3-3/classes"
-    classes = get_endpoint_from_library(endpoint, api_key)
-    class_sub_vals = lookup_class_sub_values(api_key)
+    class_sub_vals = lookup_class_sub_values(library)
     class_names = {}
-    for cl_dict in classes["_links"]["classes"]:
-        class_dict = get_endpoint_from_library(cl_dict["href"], api_key)
+    for cl_dict in library[classes_endpoint]["_links"]["classes"]:
+        class_dict = library[cl_dict["href"]]
         class_names[class_dict["label"]] = find_class_match(class_dict["name"], class_sub_vals)
     return class_names
 
@@ -106,14 +83,13 @@ def find_class_match(name, sub_vals):
     return name
 
 
-def lookup_class_sub_values(api_key):
+def lookup_class_sub_values(library):
     """
     lookup Define-XML class controlled terminology
-    :param api_key: string; API key to access the Library API
+    :param library: dictionary of Library content keyed by endpoint created by resolve_library_content
     :return: dictionary with the synonyms needed to look-up the Define-XML CT Class term
     """
-    endpoint = "/mdr/ct/packages/define-xmlct-2021-12-17/codelists/C103329"
-    cl = get_endpoint_from_library(endpoint, api_key)
+    cl = library[class_ct_endpoint]
     class_sub_vals = {}
     for term in cl["terms"]:
         class_sub_vals[term["submissionValue"]] = term["synonyms"]
@@ -137,32 +113,29 @@ def lookup_domain_endpoint(domain):
     return endpoint
 
 
-def process_map_sheet(sheet, def_workbook, header_format, api_key):
+def create_dataset_rows(domains, client, workers=library_client.default_workers, orders=None):
     """
-    process the content in the SDTM mapping spreadsheet to generate the define-xml metadata worksheet
-    :param sheet: SDTM mapping spreadsheet worksheet to parse
-    :param domain: 2-letter domain abbreviation used to identify the domain for a variable
-    :param def_workbook: obmlib define-xml workbook to add variables worksheet to
-    :param header_format: format for worksheet column headers
-    """
-    class_names = load_class_names(api_key)
-    domain = sheet["A3"].value
-    is_ap_domain = False
-    ap_domain = None
-    if domain[:2] == "AP":
-        is_ap_domain = True
-        ap_domain = domain[2:]
+    create the odmlib datasets worksheet rows for the domains used in the study
+    :param domains: list of (domain, description) tuples from the SDTM mapping spreadsheet Domains worksheet
+    :param client: LibraryClient object used to request content from the CDISC Library
+    :param workers: maximum number of concurrent requests made to the Library
+    :param orders: dictionary of sheet_order.SheetOrder objects keyed by output worksheet or None for the defaults
+    :return: list of dataset row dictionaries ordered by class and dataset name; domains without Library content
+    are skipped
+    """
+    library_content = resolve_library_content([domain for domain, description in domains], client, workers)
+    class_names = load_class_names(library_content)
     rows = []
-    row_nbr = 3
-    while domain:
-        row_dict = {key: "" for key in header}
+    for domain, description in domains:
         endpoint = lookup_domain_endpoint(domain)
-        library = get_endpoint_from_library(endpoint, api_key)
+        library = library_content[endpoint]
+        if library is None:
+            print(f"skipping dataset {domain} as the Library did not return its content from {endpoint}")
+            continue
+        row_dict = {key: "" for key in header}
         row_dict["OID"] = "IG." + domain
         row_dict["Dataset"] = domain
-        row_dict["Description"] = sheet["B" + str(row_nbr)].value
-        if library is None:
-            print()
+        row_dict["Description"] = description
         row_dict["Class"] = class_names[library["_links"]["parentClass"]["title"]]
         row_dict["Structure"] = library["datasetStructure"]
         row_dict["Purpose"] = "Tabulation"
@@ -176,34 +149,21 @@ def process_map_sheet(sheet, def_workbook, header_format, api_key):
         row_dict["StandardOID"] = ""
         row_dict["HasNoData"] = ""
         rows.append(row_dict)
-        row_nbr += 1
-        # make sure all domains are listed in the Domains Used table as blank cells will break out of the loop
-        domain = sheet["A" + str(row_nbr)].value
-    ordered_rows = sort_domain_order(rows)
-    create_define_sheet(ordered_rows, sheet.title, def_workbook, header_format)
-
-
-def sort_domain_order(rows):
-    sorted_table = []
-    for class_name in class_order:
-        row_subset = []
-        for row in rows:
-            if row["Class"] == class_name:
-                row_subset.append(row)
-        sorted_rows = sort_by_dataset_name(row_subset)
-        sorted_table.extend(sorted_rows)
-    return sorted_table
-
-
-def sort_by_dataset_name(rows):
-    sorted_table = []
-    dataset_names = [row["Dataset"] for row in rows]
-    dataset_names.sort()
-    for name in dataset_names:
-        for row in rows:
-            if row["Dataset"] == name:
-                sorted_table.append(row)
-    return sorted_table
+    return sheet_order.sort_rows("datasets", rows, orders)
+
+
+def process_map_sheet(domains, sheet_name, writer, client, workers=library_client.default_workers, orders=None):
+    """
+    process the content in the SDTM mapping spreadsheet to generate the define-xml metadata worksheet
+    :param domains: list of (domain, description) tuples from the SDTM mapping spreadsheet Domains worksheet
+    :param sheet_name: name of the odmlib worksheet to create
+    :param writer: WorkbookWriter for the odmlib define-xml workbook to add the datasets worksheet to
+    :param client: LibraryClient object used to request content from the CDISC Library
+    :param workers: maximum number of concurrent requests made to the Library
+    :param orders: dictionary of sheet_order.SheetOrder objects keyed by output worksheet or None for the defaults
+    """
+    ordered_rows = create_dataset_rows(domains, client, workers, orders)
+    writer.write_sheet(sheet_name, header, ordered_rows)
 
 
 def set_cmd_line_args():
@@ -218,6 +178,12 @@ def set_cmd_line_args():
                         required=False, dest="define_xls", default=excel_define_file)
     parser.add_argument("-a", "--api_key", help="CDISC Library API key",
                         required=False, dest="api_key", default=library_api_key)
+    parser.add_argument("-w", "--workers", help="maximum number of concurrent CDISC Library requests",
+                        required=False, dest="workers", type=int, default=library_client.default_workers)
+    library_client.add_client_args(parser)
+    metadata_writer.add_writer_args(parser)
+    profiler.add_profile_args(parser)
+    sheet_order.add_order_args(parser)
     args = parser.parse_args()
     return args
 
@@ -227,12 +193,18 @@ def main():
     main driver application that processes the SDTM mapping spreadsheet and creates and odmlib dataset worksheet
     """
     args = set_cmd_line_args()
-    def_workbook = XLS.Workbook(args.define_xls, {"strings_to_numbers": False})
-    header_format = def_workbook.add_format({"bold": True, "bg_color": "#CCFFFF", "border": True, "border_color": "black"})
-    map_workbook = load_workbook(filename=args.map_xls, read_only=False, data_only=True)
-    sheet = map_workbook["Domains"]
-    process_map_sheet(sheet, def_workbook, header_format, args.api_key)
-    def_workbook.close()
+    profile = profiler.create_profiler(args, "map2datasets")
+    client = library_client.create_client(args)
+    writer = metadata_writer.create_writer(args)
+    with profile.stage("load_spec"):
+        map_model = spec_model.load_spec_model(args.map_xls)
+    with profile.stage("create_dataset_rows"):
+        ordered_rows = create_dataset_rows(map_model.domains, client, args.workers, sheet_order.create_orders(args))
+    with profile.stage("write_output"):
+        writer.write_sheet(spec_model.domains_sheet, header, ordered_rows)
+        writer.close()
+    client.print_stats()
+    profile.close(client)
 
 
 if __name__ == '__main__':
@@ -1,8 +1,12 @@
-from openpyxl import load_workbook
-import xlsxwriter as XLS
 import os.path
 import json
 import argparse
+import spec_model
+import metadata_writer
+import build_manifest
+import profiler
+import sheet_order
+import data_profile
 
 """
 map2subsets.py generates content for the ValueLevel, WhereClauses, and CodeLists worksheets in the T1Dexi odmlib
@@ -83,6 +87,9 @@ excel_map_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data
 subset_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'cl_subsets.json')
 excel_define_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'codelist_subsets-test.xlsx')
 
+# Length and SignificantDigits of numeric value level metadata used when they are not measured from the datasets
+default_number_length = 3
+default_sigdigits = 2
 # worksheet headers
 cl_header = ["OID", "Name", "NCI Codelist Code", "Data Type", "Order", "Term", "NCI Term Code", "Decoded Value",
           "Comment", "IsNonStandard", "StandardOID"]
@@ -105,7 +112,9 @@ def process_map_sheet(sheet, domain):
     process the content in the SDTM mapping spreadsheet for content to use in the define-xml metadata worksheets
     :param sheet: SDTM mapping spreadsheet worksheet to parse
     :param domain: 2-letter domain abbreviation used to identify the domain for a variable
+    :return: dictionary of the updates to the codelists dictionary keyed by DOMAIN.VARIABLE
     """
+    updates = {}
     # assumes not more than 6 VLM (max_row=17)
     for col_num, col in enumerate(sheet.iter_cols(min_col=2,max_col=sheet.max_column, min_row=1, max_row=17, values_only=True)):
         # row_dict = {key: "" for key in header}
@@ -118,9 +127,47 @@ def process_map_sheet(sheet, domain):
                     subset_codes.append(cell)
                     # if more than one subset then have VLM and must lookup testcds
             print(f"found {len(subset_codes)} subsets for {var_name} in domain {domain}")
-            codelists[domain + "." + var_name]["domain"] = domain
+            update = updates.setdefault(domain + "." + var_name, {})
+            update["domain"] = domain
             if subset_codes:
-                codelists[domain + "." + var_name]["subset_terms"] = subset_codes
+                update["subset_terms"] = subset_codes
+    return updates
+
+
+def apply_sheet_updates(updates):
+    """
+    add the content found in a mapping spreadsheet worksheet to the codelists dictionary
+    :param updates: dictionary of the updates to the codelists dictionary created by process_map_sheet
+    """
+    for variable_key, update in updates.items():
+        if variable_key not in codelists:
+            print(f"skipping {variable_key} as it is not in the codelists dictionary")
+            continue
+        codelists[variable_key].update(update)
+
+
+def process_map_workbook(map_workbook, manifest=None, profile=None):
+    """
+    add the content from each domain worksheet in the SDTM mapping spreadsheet to the codelists dictionary
+    :param map_workbook: SDTM mapping spreadsheet model
+    :param manifest: BuildManifest with the updates from the previous run to re-use if a worksheet has not changed
+    :param profile: Profiler that records the time taken by each worksheet or None
+    """
+    profile = profile or profiler.Profiler("map2subsets")
+    for sheet in map_workbook.worksheets:
+        if sheet.title not in worksheet_skip:
+            domain = sheet.title.split()
+            updates = None
+            if manifest:
+                content_hash = build_manifest.sheet_hash(sheet, 17)
+                updates = manifest.get_rows(sheet.title, content_hash)
+            if updates is None:
+                print(f"processing {sheet.title}...")
+                with profile.sheet(sheet.title):
+                    updates = process_map_sheet(sheet, domain[0])
+                if manifest:
+                    manifest.put_rows(sheet.title, content_hash, updates)
+            apply_sheet_updates(updates)
 
 
 def process_codelists():
@@ -182,24 +229,31 @@ def find_cl_max_length(codelist):
     return max_length
 
 
-def find_number_length(domain, variable):
+def find_number_length(domain, variable, idx=None, measured=None):
     """
-    placeholder to determine the length of numeric fields assigned as value level metadata
+    determine the length of numeric fields assigned as value level metadata from the values in the SDTM datasets
     :param domain: the domain / dataset in which the variable exists
     :param variable: the name of the variable
-    :return: integer indicating number length - UPDATE THIS DEFAULT VALUE TO GET ACTUAL LENGTH
+    :param idx: index of the where clause for the value level metadata
+    :param measured: dictionary of the value level metadata measured by data_profile.profile_vlm or None
+    :return: integer length of the longest value, or the default length if no values were measured
     """
-    return 3
+    sizes = (measured or {}).get((domain.upper(), variable, idx))
+    return sizes["length"] if sizes else default_number_length
 
 
-def find_number_sigdigits(domain, variable):
+def find_number_sigdigits(domain, variable, idx=None, measured=None):
     """
-    placeholder to determine the number of significant digits for numeric fields assigned as value level metadata
+    determine the number of significant digits for numeric fields assigned as value level metadata from the values
+    in the SDTM datasets
     :param domain: the domain / dataset in which the variable exists
     :param variable: the name of the variable
-    :return: integer indicating number of significant digits - UPDATE THIS DEFAULT TO GET ACTUAL SIGNIFICANT DIGITS
+    :param idx: index of the where clause for the value level metadata
+    :param measured: dictionary of the value level metadata measured by data_profile.profile_vlm or None
+    :return: integer most decimal digits of any value, or the default if no values were measured
     """
-    return 2
+    sizes = (measured or {}).get((domain.upper(), variable, idx))
+    return sizes["significant_digits"] if sizes else default_sigdigits
 
 
 def process_where_clauses():
@@ -225,9 +279,10 @@ def process_where_clauses():
     return rows
 
 
-def process_vlm():
+def process_vlm(measured=None):
     """
     process the codelist dictionary with SDTM mapping content to generate the Value Level metadata XLS rows
+    :param measured: dictionary of the value level metadata measured by data_profile.profile_vlm or None
     :return: list of dictionaries with value level metadata worksheet rows
     """
     rows = []
@@ -251,14 +306,14 @@ def process_vlm():
                 row["Format"] = ""
             elif row["Data Type"] == "integer":
                 row["Codelist"] = ""
-                row["Length"] = find_number_length(domain, variable)
+                row["Length"] = find_number_length(domain, variable, idx, measured)
                 row["Significant Digits"] = ""
                 row["Format"] = ""
             else:
                 row["Codelist"] = ""
-                row["Length"] = find_number_length(domain, variable)
-                row["Significant Digits"] = find_number_sigdigits(domain, variable)
-                row["Format"] = str(find_number_length(domain, variable)) + "." + str(row["Significant Digits"])
+                row["Length"] = find_number_length(domain, variable, idx, measured)
+                row["Significant Digits"] = find_number_sigdigits(domain, variable, idx, measured)
+                row["Format"] = str(row["Length"]) + "." + str(row["Significant Digits"])
             # how determine mandatory for VLM?
             row["Mandatory"] = "No"
             row["Order"] = idx + 1
@@ -279,33 +334,6 @@ def generate_wc_name(wc_name):
     return wc_name_value
 
 
-def write_codelist_to_xls(worksheet, rows, header, row_nbr=0):
-    """
-    write code list, value level, or where clause rows to the odmlib worksheet
-    :param worksheet: odmlib worksheet object to write to
-    :param rows: a list of dictionaries (rows) to write to the worksheet
-    :param row_nbr: integer row number that indicates which worksheet row to begin appending terms
-    :return: integer row number that indicates the next row to begin appending content
-    """
-    for row in rows:
-        row_nbr += 1
-        for c, col_name in enumerate(header):
-            worksheet.write(row_nbr, c, row[col_name])
-    return row_nbr
-
-
-def write_header_row(worksheet, header, header_format):
-    """
-    write the worksheet header column labels to a given odmlib worksheet
-    write the header row for a given worksheet
-    :param worksheet: the odmlib worksheet to write the column headers to
-    :param header: the header for the worksheet to be generated
-    :param header_format: the header format to indicate the style of the header columns
-    """
-    for c, header_label in enumerate(header):
-        worksheet.write(0, c, header_label, header_format)
-
-
 def set_cmd_line_args():
     """
     get the command-line arguments needed to convert the Excel input file into Define-XML
@@ -316,6 +344,11 @@ def set_cmd_line_args():
                         required=False, dest="map_xls", default=excel_map_file)
     parser.add_argument("-o", "--output_file", help="path and file name of Define-XML v2.1 metadata spreadsheet file",
                         required=False, dest="define_xls", default=excel_define_file)
+    build_manifest.add_manifest_args(parser)
+    metadata_writer.add_writer_args(parser)
+    profiler.add_profile_args(parser)
+    sheet_order.add_order_args(parser)
+    data_profile.add_data_args(parser)
     args = parser.parse_args()
     return args
 
@@ -325,35 +358,37 @@ def main():
     main driver for creating the odmlib worksheet for ValueLists, WhereClauses, and CodeLists
     """
     args = set_cmd_line_args()
-    def_workbook = XLS.Workbook(args.define_xls, {"strings_to_numbers": False})
-    header_format = def_workbook.add_format({"bold": True, "bg_color": "#CCFFFF", "border": True, "border_color": "black"})
-    map_workbook = load_workbook(filename=args.map_xls, read_only=False, data_only=True)
-    for sheet in map_workbook.worksheets:
-        if sheet.title not in worksheet_skip:
-            print(f"processing {sheet.title}...")
-            domain = sheet.title.split()
-            process_map_sheet(sheet, domain[0])
-    rows = process_codelists()
+    profile = profiler.create_profiler(args, "map2subsets")
+    writer = metadata_writer.create_writer(args)
+    orders = sheet_order.create_orders(args)
+    with profile.stage("load_spec"):
+        map_workbook = spec_model.load_spec_model(args.map_xls)
+    manifest = build_manifest.BuildManifest(args.manifest, "map2subsets", codelists) if args.manifest else None
+    with profile.stage("process_map_sheets"):
+        process_map_workbook(map_workbook, manifest, profile)
+    if manifest:
+        manifest.save()
+    with profile.stage("process_codelists"):
+        rows = process_codelists()
     write_subset_file()
 
     # create codelist subset worksheet
-    worksheet = def_workbook.add_worksheet("codelists")
-    write_header_row(worksheet, cl_header, header_format)
-    write_codelist_to_xls(worksheet, rows, cl_header)
+    with profile.stage("write_codelists"):
+        writer.write_sheet("codelists", cl_header, sheet_order.sort_rows("codelists", rows, orders))
 
     # create where clause worksheet
-    rows = process_where_clauses()
-    wc_worksheet = def_workbook.add_worksheet("whereclauses")
-    write_header_row(wc_worksheet, wc_header, header_format)
-    write_codelist_to_xls(wc_worksheet, rows, wc_header)
+    with profile.stage("process_where_clauses"):
+        rows = process_where_clauses()
+    with profile.stage("write_whereclauses"):
+        writer.write_sheet("whereclauses", wc_header, sheet_order.sort_rows("whereclauses", rows, orders))
 
     # create VLM
-    rows = process_vlm()
-    vlm_worksheet = def_workbook.add_worksheet("valuelevel")
-    write_header_row(vlm_worksheet, vlm_header, header_format)
-    write_codelist_to_xls(vlm_worksheet, rows, vlm_header)
-
-    def_workbook.close()
+    with profile.stage("process_vlm"):
+        rows = process_vlm(data_profile.create_vlm_profile(args, codelists))
+    with profile.stage("write_valuelevel"):
+        writer.write_sheet("valuelevel", vlm_header, sheet_order.sort_rows("valuelevel", rows, orders))
+        writer.close()
+    profile.close()
 
 
 if __name__ == '__main__':
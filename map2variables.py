@@ -1,14 +1,19 @@
-from openpyxl import Workbook, load_workbook
-import xlsxwriter as XLS
 import argparse
+import json
 import os.path
 import re
+import spec_model
+import build_manifest
+import profiler
+import sheet_order
+import data_profile
+import metadata_writer
 
 """
 map2variables.py extracts the variables from the mapping spreadsheet and generates a Define-XML v2.1 metadata worksheet
 for variables.
 Example Cmd-line (optional args):
-    python map2variables -i ./path/to/mapping_spec.xlsx -o ./path/to/variables_ws.xlsx
+    python map2variables -i ./path/to/mapping_spec.xlsx -o ./path/to/variables_ws.xlsx -l ./path/to/layout.json
 """
 
 # odmlib worksheet column headers to variables
@@ -16,7 +21,8 @@ header = ["OID", "Order", "Dataset", "Variable", "Label", "Data Type", "Length",
           "Format",	"KeySequence", "Mandatory", "CodeList", "Valuelist", "Origin Type", "Origin Source",
           "Pages", "Method", "Predecessor", "Role", "Comment", "IsNonStandard", "HasNoData"]
 
-# class names defined to format SDTM mapping spreadsheet content for use in odmlib and define-xml
+# class names defined to format SDTM mapping spreadsheet content for use in odmlib and define-xml - one per row in the
+# mapping spreadsheet layout, starting at row 1; a layout file can use null for rows that are not used
 format_class = ["Name", "Label", "Type", "Codelist", "Role", "Notes", "Core", "DataType", "Length", "SignificantDigits"]
 
 # SDTM mapping spreadsheet worksheets to skip as they do not contain variables for a given domain
@@ -243,50 +249,120 @@ class SignificantDigits:
                 row_dict["Significant Digits"] = ""
 
 
-def write_header_row(worksheet, header_format):
-    """
-    write the worksheet header column labels to the odmlib worksheet
-    :param worksheet: the odmlib worksheet to write the column headers to
-    :param header_format: the header format to indicate the style of the header columns
-    """
-    for c, header_label in enumerate(header):
-        worksheet.write(0, c, header_label, header_format)
+# data types whose Length is measured from the SDTM datasets when the mapping spreadsheet leaves it blank
+measured_types = ["text", "integer", "float"]
+# formatter classes that can be named in the mapping spreadsheet layout
+formatters = {"Name": Name, "Label": Label, "Type": Type, "Codelist": Codelist, "Role": Role, "Notes": Notes,
+              "Core": Core, "DataType": DataType, "Length": Length, "SignificantDigits": SignificantDigits}
 
 
-def create_define_sheet(table, sheet_name, workbook, header_format):
+class ColumnMapper:
+    def __init__(self, layout=format_class, lengths=None):
+        """
+        compile the mapping spreadsheet layout into the formatters applied to each row of a variable column. The layout
+        is compiled once and the ColumnMapper is re-used for every worksheet with that layout.
+        :param layout: list of formatter class names, one per row of the mapping spreadsheet starting at row 1, with
+        None for rows that are not used
+        :param lengths: dictionary of the longest value of each variable measured in the SDTM datasets keyed by
+        (upper case dataset, variable), used instead of the default Length when the Length cell is blank, or None
+        """
+        unknown = [name for name in layout if name is not None and name not in formatters]
+        if unknown:
+            raise ValueError(f"Unknown formatter(s) {', '.join(unknown)} in the mapping spreadsheet layout")
+        if "Name" not in layout:
+            raise ValueError("The mapping spreadsheet layout must include the Name row")
+        if len(layout) > spec_model.model_rows:
+            raise ValueError(f"The mapping spreadsheet layout cannot have more than {spec_model.model_rows} rows")
+        self.max_row = len(layout)
+        self.name_row = layout.index("Name")
+        self.length_row = layout.index("Length") if "Length" in layout else None
+        self.lengths = lengths or {}
+        self.formatters = [(row_num, formatters[name]().format_content) for row_num, name in enumerate(layout)
+                           if name is not None]
+        self.empty_row = {key: "" for key in header}
+
+    def map_columns(self, columns, domain):
+        """
+        convert the variable columns from a mapping spreadsheet worksheet into odmlib variables worksheet rows
+        :param columns: iterable of column value tuples starting at the first variable column
+        :param domain: 2-letter domain abbreviation used to identify the domain for a variable
+        :return: list of row dictionaries with the content to write to the odmlib variables worksheet
+        """
+        rows = []
+        name_row = self.name_row
+        for col_num, col in enumerate(columns):
+            name = col[name_row]
+            if not name or "CODELIST" in name:
+                continue
+            row_dict = self.empty_row.copy()
+            for row_num, format_content in self.formatters:
+                format_content(col[row_num], row_dict, domain, col_num)
+            if self.lengths and (self.length_row is None or not col[self.length_row]):
+                self.apply_length(row_dict)
+            rows.append(row_dict)
+        return rows
+
+    def apply_length(self, row_dict):
+        """
+        set the Length of a text or numeric variable to the longest value measured in the SDTM datasets
+        :param row_dict: dictionary for the odmlib Define-XML output format
+        """
+        length = self.lengths.get((row_dict["Dataset"].upper(), row_dict["Variable"]))
+        if length and row_dict["Data Type"] in measured_types:
+            row_dict["Length"] = length
+
+
+def load_layout(layout_file):
     """
-    write variable definition rows to the odmlib worksheet
-    :param table: list of row dictionaries with content to write to the worksheet
-    :param sheet_name: name of the odmlib worksheet to create to write variable content
-    :param workbook: workbook object to add the worksheet to
-    :param header_format: format for the header_row used when writing the column headers
+    load a mapping spreadsheet layout for spreadsheets that do not use the T1Dexi row order
+    :param layout_file: path and file name of a JSON file with the list of formatter class names, one per row
+    :return: list of formatter class names
     """
-    worksheet = workbook.add_worksheet(sheet_name)
-    write_header_row(worksheet, header_format)
-    for r, row in enumerate(table):
-        for c, col_name in enumerate(header):
-            worksheet.write(r+1, c, row[col_name])
+    if not layout_file:
+        return format_class
+    with open(layout_file, "r", encoding="utf-8") as file_in:
+        return json.load(file_in)
 
 
-def process_map_sheet(sheet, domain, def_workbook, header_format):
+def process_map_sheets(sheets, mapper, jobs=1, manifest=None, profile=None):
+    """
+    process the domain worksheets in the SDTM mapping spreadsheet to generate the define-xml metadata rows
+    :param sheets: list of (worksheet, domain) tuples for the SDTM mapping spreadsheet worksheets to parse
+    :param mapper: ColumnMapper compiled for the mapping spreadsheet layout
+    :param jobs: number of worker processes the worksheets are shared across
+    :param manifest: BuildManifest with the rows from the previous run to re-use if the worksheet has not changed
+    :param profile: Profiler that records the time taken by each worksheet or None
+    :return: list of the variable rows for each worksheet in the same order as sheets
+    """
+    sheet_rows = [None] * len(sheets)
+    content_hashes = {}
+    if manifest:
+        for idx, (sheet, domain) in enumerate(sheets):
+            content_hashes[idx] = build_manifest.sheet_hash(sheet, mapper.max_row)
+            sheet_rows[idx] = manifest.get_rows(sheet.title, content_hashes[idx])
+    changed = [idx for idx, rows in enumerate(sheet_rows) if rows is None]
+    for idx in changed:
+        print(f"processing {sheets[idx][0].title}...")
+    results = spec_model.map_sheets(create_variable_rows, [sheets[idx] for idx in changed], jobs, mapper,
+                                    profiler=profile)
+    for idx, rows in zip(changed, results):
+        sheet_rows[idx] = rows
+        if manifest:
+            manifest.put_rows(sheets[idx][0].title, content_hashes[idx], rows)
+    return sheet_rows
+
+
+def create_variable_rows(sheet, domain, mapper):
     """
-    process the content in the SDTM mapping spreadsheet to generate the define-xml metadata worksheet
+    create the odmlib variables worksheet rows for the variables in a SDTM mapping spreadsheet worksheet
     :param sheet: SDTM mapping spreadsheet worksheet to parse
     :param domain: 2-letter domain abbreviation used to identify the domain for a variable
-    :param def_workbook: obmlib define-xml workbook to add variables worksheet to
-    :param header_format: format for worksheet column headers
+    :param mapper: ColumnMapper compiled for the mapping spreadsheet layout
+    :return: list of variable row dictionaries in worksheet column order
     """
-    rows = []
     # adjust sheet.max_column to 60 if hidden columns are not counted
-    for col_num, col in enumerate(sheet.iter_cols(min_col=2,max_col=sheet.max_column, min_row=1, max_row=10, values_only=True)):
-        row_dict = {key: "" for key in header}
-        if not col[0] or "CODELIST" in col[0]:
-            continue
-        for row_num, cell in enumerate(col):
-            formatter = eval(format_class[row_num] + "()")
-            formatter.format_content(cell, row_dict, domain, col_num)
-        rows.append(row_dict)
-    create_define_sheet(rows, sheet.title, def_workbook, header_format)
+    columns = sheet.iter_cols(min_col=2, max_col=sheet.max_column, min_row=1, max_row=mapper.max_row, values_only=True)
+    return mapper.map_columns(columns, domain)
 
 
 def set_cmd_line_args():
@@ -299,6 +375,15 @@ def set_cmd_line_args():
                         required=False, dest="map_xls", default=excel_map_file)
     parser.add_argument("-o", "--output_file", help="path and file name of Define-XML v2.1 metadata spreadsheet file",
                         required=False, dest="define_xls", default=excel_define_file)
+    parser.add_argument("-l", "--layout", help="path and file name of a JSON mapping spreadsheet row layout",
+                        required=False, dest="layout_file", default=None)
+    parser.add_argument("-j", "--jobs", help="number of worker processes the domain worksheets are shared across",
+                        required=False, dest="jobs", type=int, default=1)
+    build_manifest.add_manifest_args(parser)
+    metadata_writer.add_writer_args(parser)
+    profiler.add_profile_args(parser)
+    sheet_order.add_order_args(parser)
+    data_profile.add_data_args(parser)
     args = parser.parse_args()
     return args
 
@@ -308,15 +393,33 @@ def main():
     main driver application that processes the SDTM mapping spreadsheet and creates and odmlib variable worksheet
     """
     args = set_cmd_line_args()
-    def_workbook = XLS.Workbook(args.define_xls, {"strings_to_numbers": False})
-    header_format = def_workbook.add_format({"bold": True, "bg_color": "#CCFFFF", "border": True, "border_color": "black"})
-    map_workbook = load_workbook(filename=args.map_xls, read_only=False, data_only=True)
-    for sheet in map_workbook.worksheets:
-        if sheet.title not in worksheet_skip:
-            print(f"processing {sheet.title}...")
-            domain = sheet.title.split()
-            process_map_sheet(sheet, domain[0], def_workbook, header_format)
-    def_workbook.close()
+    profile = profiler.create_profiler(args, "map2variables")
+    layout = load_layout(args.layout_file)
+    with profile.stage("measure_lengths"):
+        lengths = data_profile.create_lengths(args)
+    mapper = ColumnMapper(layout, lengths)
+    if args.manifest:
+        # the rows also depend on the key sequences, common variables and measured lengths so changes to them
+        # invalidate the manifest
+        settings = {"layout": layout, "key_sequence": key_sequence, "common_variables": common_variables,
+                    "lengths": {dataset + "." + variable: length for (dataset, variable), length in lengths.items()}}
+        manifest = build_manifest.BuildManifest(args.manifest, "map2variables", settings)
+    else:
+        manifest = None
+    writer = metadata_writer.create_writer(args)
+    orders = sheet_order.create_orders(args)
+    with profile.stage("load_spec"):
+        map_workbook = spec_model.load_spec_model(args.map_xls)
+    sheets = spec_model.domain_sheets(map_workbook, worksheet_skip)
+    with profile.stage("process_map_sheets"):
+        sheet_rows = process_map_sheets(sheets, mapper, args.jobs, manifest, profile)
+    with profile.stage("write_output"):
+        for (sheet, domain), rows in zip(sheets, sheet_rows):
+            writer.write_sheet(sheet.title, header, sheet_order.sort_rows("variables", rows, orders))
+        writer.close()
+    if manifest:
+        manifest.save()
+    profile.close()
 
 
 if __name__ == '__main__':
@@ -1,8 +1,11 @@
-from openpyxl import load_workbook
-import xlsxwriter as XLS
 import os.path
 import json
 import argparse
+import spec_model
+import metadata_writer
+import profiler
+import sheet_order
+import data_profile
 
 """
 map2vlm.py generates content for the ValueLevel, WhereClauses, and CodeLists worksheets in the T1Dexi odmlib
@@ -24,6 +27,9 @@ subset_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data',
 excel_define_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'vlm-test.xlsx')
 vlm_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'vlm.json')
 
+# Length and SignificantDigits of numeric value level metadata used when they are not measured from the datasets
+default_number_length = 3
+default_sigdigits = 2
 # worksheet headers
 cl_header = ["OID", "Name", "NCI Codelist Code", "Data Type", "Order", "Term", "NCI Term Code", "Decoded Value",
           "Comment", "IsNonStandard", "StandardOID"]
@@ -46,7 +52,10 @@ def process_map_sheet(sheet, domain, codelists):
     process the content in the SDTM mapping spreadsheet for content to use in the define-xml metadata worksheets
     :param sheet: SDTM mapping spreadsheet worksheet to parse
     :param domain: 2-letter domain abbreviation used to identify the domain for a variable
+    :param codelists: dictionary of value level codelists loaded from the vlm.json file
+    :return: dictionary of the updates to the codelists dictionary keyed by DOMAIN.VARIABLE
     """
+    updates = {}
     # assumes not more than 6 VLM (max_row=17)
     for col_num, col in enumerate(sheet.iter_cols(min_col=2,max_col=sheet.max_column, min_row=1, max_row=17, values_only=True)):
         # row_dict = {key: "" for key in header}
@@ -63,9 +72,36 @@ def process_map_sheet(sheet, domain, codelists):
                         subset_codes.append(cell)
                         # if more than one subset then have VLM and must lookup testcds
                 print(f"found {len(subset_codes)} subsets for {var_name} in domain {domain}")
-                codelists[variable_key]["domain"] = domain
+                update = updates.setdefault(variable_key, {})
+                update["domain"] = domain
                 if subset_codes:
-                    codelists[variable_key]["subset_terms"] = subset_codes
+                    update["subset_terms"] = subset_codes
+    return updates
+
+
+def process_map_workbook(map_workbook, codelists, jobs=1, profile=None):
+    """
+    add the codelist subset terms from each domain worksheet in the SDTM mapping spreadsheet to the codelists
+    :param map_workbook: SDTM mapping spreadsheet model
+    :param codelists: dictionary of value level codelists loaded from the vlm.json file
+    :param jobs: number of worker processes the domain worksheets are shared across
+    :param profile: Profiler that records the time taken by each worksheet or None
+    """
+    sheets = spec_model.domain_sheets(map_workbook, worksheet_skip)
+    for sheet, domain in sheets:
+        print(f"processing {sheet.title}...")
+    # the updates are applied in worksheet order so the result does not depend on the number of jobs
+    for updates in spec_model.map_sheets(process_map_sheet, sheets, jobs, codelists, profiler=profile):
+        for variable_key, update in updates.items():
+            codelists[variable_key].update(update)
+
+
+def load_vlm_codelists():
+    """
+    :return: dictionary of value level codelists loaded from the vlm.json file
+    """
+    with open(vlm_file) as file_in:
+        return json.load(file_in)
 
 
 def process_codelists(codelists):
@@ -127,24 +163,31 @@ def find_cl_max_length(codelist):
     return max_length
 
 
-def find_number_length(domain, variable):
+def find_number_length(domain, variable, idx=None, measured=None):
     """
-    placeholder to determine the length of numeric fields assigned as value level metadata
+    determine the length of numeric fields assigned as value level metadata from the values in the SDTM datasets
     :param domain: the domain / dataset in which the variable exists
     :param variable: the name of the variable
-    :return: integer indicating number length - UPDATE THIS DEFAULT VALUE TO GET ACTUAL LENGTH
+    :param idx: index of the where clause for the value level metadata
+    :param measured: dictionary of the value level metadata measured by data_profile.profile_vlm or None
+    :return: integer length of the longest value, or the default length if no values were measured
     """
-    return 3
+    sizes = (measured or {}).get((domain.upper(), variable, idx))
+    return sizes["length"] if sizes else default_number_length
 
 
-def find_number_sigdigits(domain, variable):
+def find_number_sigdigits(domain, variable, idx=None, measured=None):
     """
-    placeholder to determine the number of significant digits for numeric fields assigned as value level metadata
+    determine the number of significant digits for numeric fields assigned as value level metadata from the values
+    in the SDTM datasets
     :param domain: the domain / dataset in which the variable exists
     :param variable: the name of the variable
-    :return: integer indicating number of significant digits - UPDATE THIS DEFAULT TO GET ACTUAL SIGNIFICANT DIGITS
+    :param idx: index of the where clause for the value level metadata
+    :param measured: dictionary of the value level metadata measured by data_profile.profile_vlm or None
+    :return: integer most decimal digits of any value, or the default if no values were measured
     """
-    return 2
+    sizes = (measured or {}).get((domain.upper(), variable, idx))
+    return sizes["significant_digits"] if sizes else default_sigdigits
 
 
 def process_where_clauses(codelists):
@@ -177,22 +220,27 @@ def process_where_clauses(codelists):
     return rows
 
 
-def process_vlm(codelists):
+def process_vlm(codelists, measured=None):
     """
     process the codelist dictionary with SDTM mapping content to generate the Value Level metadata XLS rows
+    :param codelists: dictionary of value level codelists with the SDTM mapping spreadsheet content added
+    :param measured: dictionary of the value level metadata measured by data_profile.profile_vlm or None
     :return: list of dictionaries with value level metadata worksheet rows
     """
     rows = []
     for key, cl in codelists.items():
         domain, variable = key.split(".")
+        wc_values = [generate_wc_name(wc[0]["value"][0]) for wc in cl["whereclause"]]
         for idx, wc in enumerate(cl["whereclause"]):
             row = {key: "" for key in wc_header}
             wc_variable = wc[0]["variable"]
-            wc_value = generate_wc_name(wc[0]["value"][0])
+            wc_value = wc_values[idx]
             # if multiple checks are used in a WhereClause the wc_value won't be unique so we add a number
             row["Where Clause"] = "WC." + domain + "." + variable + "." + wc_variable + "." + str(idx+1)
             #TODO how do the VLM variables get added? May need to generate those variables here
-            row["ItemOID"] = "IT." + domain + "." + variable + "." + wc_value
+            # where clauses that share the first check value, such as FATESTCD EQ EPSDNUM, each get their own ItemOID
+            item_value = wc_value if wc_values.count(wc_value) == 1 else wc_value + "." + str(idx+1)
+            row["ItemOID"] = "IT." + domain + "." + variable + "." + item_value
             row["OID"] = "VL." + domain + "." + variable
             row["Dataset"] = domain
             row["Variable"] = variable
@@ -204,14 +252,14 @@ def process_vlm(codelists):
                 row["Format"] = ""
             elif row["Data Type"] == "integer":
                 row["Codelist"] = ""
-                row["Length"] = find_number_length(domain, variable)
+                row["Length"] = find_number_length(domain, variable, idx, measured)
                 row["Significant Digits"] = ""
                 row["Format"] = ""
             else:
                 row["Codelist"] = ""
-                row["Length"] = find_number_length(domain, variable)
-                row["Significant Digits"] = find_number_sigdigits(domain, variable)
-                row["Format"] = str(find_number_length(domain, variable)) + "." + str(row["Significant Digits"])
+                row["Length"] = find_number_length(domain, variable, idx, measured)
+                row["Significant Digits"] = find_number_sigdigits(domain, variable, idx, measured)
+                row["Format"] = str(row["Length"]) + "." + str(row["Significant Digits"])
             #TODO how determine mandatory for VLM?
             row["Mandatory"] = "No"
             row["Order"] = idx + 1
@@ -232,33 +280,6 @@ def generate_wc_name(wc_name):
     return wc_name_value
 
 
-def write_codelist_to_xls(worksheet, rows, header, row_nbr=0):
-    """
-    write code list, value level, or where clause rows to the odmlib worksheet
-    :param worksheet: odmlib worksheet object to write to
-    :param rows: a list of dictionaries (rows) to write to the worksheet
-    :param row_nbr: integer row number that indicates which worksheet row to begin appending terms
-    :return: integer row number that indicates the next row to begin appending content
-    """
-    for row in rows:
-        row_nbr += 1
-        for c, col_name in enumerate(header):
-            worksheet.write(row_nbr, c, row[col_name])
-    return row_nbr
-
-
-def write_header_row(worksheet, header, header_format):
-    """
-    write the worksheet header column labels to a given odmlib worksheet
-    write the header row for a given worksheet
-    :param worksheet: the odmlib worksheet to write the column headers to
-    :param header: the header for the worksheet to be generated
-    :param header_format: the header format to indicate the style of the header columns
-    """
-    for c, header_label in enumerate(header):
-        worksheet.write(0, c, header_label, header_format)
-
-
 def set_cmd_line_args():
     """
     get the command-line arguments needed to convert the Excel input file into Define-XML
@@ -269,6 +290,12 @@ def set_cmd_line_args():
                         required=False, dest="map_xls", default=excel_map_file)
     parser.add_argument("-o", "--output_file", help="path and file name of Define-XML v2.1 metadata spreadsheet file",
                         required=False, dest="define_xls", default=excel_define_file)
+    parser.add_argument("-j", "--jobs", help="number of worker processes the domain worksheets are shared across",
+                        required=False, dest="jobs", type=int, default=1)
+    metadata_writer.add_writer_args(parser)
+    profiler.add_profile_args(parser)
+    sheet_order.add_order_args(parser)
+    data_profile.add_data_args(parser)
     args = parser.parse_args()
     return args
 
@@ -278,38 +305,36 @@ def main():
     main driver for creating the odmlib worksheet for ValueLists, WhereClauses, and CodeLists
     """
     args = set_cmd_line_args()
-    def_workbook = XLS.Workbook(args.define_xls, {"strings_to_numbers": False})
-    header_format = def_workbook.add_format({"bold": True, "bg_color": "#CCFFFF", "border": True, "border_color": "black"})
+    profile = profiler.create_profiler(args, "map2vlm")
+    writer = metadata_writer.create_writer(args)
+    orders = sheet_order.create_orders(args)
     #TODO re-establish automatically generating the vlm.json file
-    map_workbook = load_workbook(filename=args.map_xls, read_only=False, data_only=True)
-    codelists = json.load(open(vlm_file))
-
-    for sheet in map_workbook.worksheets:
-        if sheet.title not in worksheet_skip:
-            print(f"processing {sheet.title}...")
-            domain = sheet.title.split()
-            process_map_sheet(sheet, domain[0], codelists)
-    rows = process_codelists(codelists)
+    with profile.stage("load_spec"):
+        map_workbook = spec_model.load_spec_model(args.map_xls)
+        codelists = load_vlm_codelists()
+    with profile.stage("process_map_sheets"):
+        process_map_workbook(map_workbook, codelists, args.jobs, profile)
+    with profile.stage("process_codelists"):
+        rows = process_codelists(codelists)
     write_subset_file(codelists)
 
     # create codelist subset worksheet
-    worksheet = def_workbook.add_worksheet("codelists")
-    write_header_row(worksheet, cl_header, header_format)
-    write_codelist_to_xls(worksheet, rows, cl_header)
+    with profile.stage("write_codelists"):
+        writer.write_sheet("codelists", cl_header, sheet_order.sort_rows("codelists", rows, orders))
 
     # create where clause worksheet
-    rows = process_where_clauses(codelists)
-    wc_worksheet = def_workbook.add_worksheet("whereclauses")
-    write_header_row(wc_worksheet, wc_header, header_format)
-    write_codelist_to_xls(wc_worksheet, rows, wc_header)
+    with profile.stage("process_where_clauses"):
+        rows = process_where_clauses(codelists)
+    with profile.stage("write_whereclauses"):
+        writer.write_sheet("whereclauses", wc_header, sheet_order.sort_rows("whereclauses", rows, orders))
 
     # create VLM
-    rows = process_vlm(codelists)
-    vlm_worksheet = def_workbook.add_worksheet("valuelevel")
-    write_header_row(vlm_worksheet, vlm_header, header_format)
-    write_codelist_to_xls(vlm_worksheet, rows, vlm_header)
-
-    def_workbook.close()
+    with profile.stage("process_vlm"):
+        rows = process_vlm(codelists, data_profile.create_vlm_profile(args, codelists))
+    with profile.stage("write_valuelevel"):
+        writer.write_sheet("valuelevel", vlm_header, sheet_order.sort_rows("valuelevel", rows, orders))
+        writer.close()
+    profile.close()
 
 
 if __name__ == '__main__':
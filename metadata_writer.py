@@ -0,0 +1,211 @@
+import xlsxwriter as XLS
+import csv
+import json
+import os
+from operator import itemgetter
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+"""
+metadata_writer.py writes the rows generated by the map2* scripts to odmlib metadata worksheets. Every script shares
+the same writer, which writes a worksheet one whole row at a time from a list or a generator of row dictionaries. In
+constant_memory mode xlsxwriter flushes each row to disk once the next row is started, so worksheets with tens of
+thousands of rows, such as a complete CT package, are written without keeping the worksheet in memory.
+The same rows can also be written as CSV, JSON Lines or Parquet files, one file per worksheet, using the worksheet
+headers as the column names. These formats load much faster than a spreadsheet in downstream tools and are easier to
+diff. Parquet output requires the optional pyarrow package.
+Example:
+    with WorkbookWriter("./data/codelists.xlsx", constant_memory=True) as writer:
+        writer.write_sheet("codelists", header, rows)
+"""
+
+# format used for the column headers in every odmlib worksheet
+header_style = {"bold": True, "bg_color": "#CCFFFF", "border": True, "border_color": "black"}
+# output formats supported by create_writer
+output_formats = ["xlsx", "csv", "jsonl", "parquet"]
+# number of rows buffered for each Parquet row group
+parquet_batch_size = 10000
+
+
+def row_values(header):
+    """
+    :param header: list of worksheet column headers
+    :return: function that returns the values of a row dictionary in header order
+    """
+    if len(header) == 1:
+        return lambda row: (row[header[0]],)
+    return itemgetter(*header)
+
+
+class WorkbookWriter:
+    def __init__(self, file_name, constant_memory=False):
+        """
+        :param file_name: path and file name of the odmlib metadata workbook to create
+        :param constant_memory: flush each row to disk once written instead of keeping the workbook in memory
+        """
+        self.file_name = file_name
+        self.workbook = XLS.Workbook(file_name, {"strings_to_numbers": False, "constant_memory": constant_memory})
+        self.header_format = self.workbook.add_format(header_style)
+
+    def write_sheet(self, sheet_name, header, rows):
+        """
+        add a worksheet and write the column headers and rows to it
+        :param sheet_name: name of the odmlib worksheet to create
+        :param header: list of worksheet column headers that are also the keys of the row dictionaries
+        :param rows: list or generator of row dictionaries to write to the worksheet
+        :return: integer number of rows written not counting the header row
+        """
+        worksheet = self.workbook.add_worksheet(sheet_name)
+        worksheet.write_row(0, 0, header, self.header_format)
+        values = row_values(header)
+        row_nbr = 0
+        for row in rows:
+            row_nbr += 1
+            worksheet.write_row(row_nbr, 0, values(row))
+        return row_nbr
+
+    def close(self):
+        self.workbook.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SheetFileWriter:
+    def __init__(self, output_dir):
+        """
+        base class for the writers that save each worksheet as a separate file in the output directory
+        :param output_dir: directory to write one file per worksheet to; it is created if it does not exist
+        """
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+
+    def sheet_file_name(self, sheet_name, extension):
+        """
+        :param sheet_name: name of the odmlib worksheet
+        :param extension: file extension for the output format
+        :return: path and file name for the worksheet in the output directory
+        """
+        return os.path.join(self.output_dir, sheet_name + "." + extension)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CSVWriter(SheetFileWriter):
+    def write_sheet(self, sheet_name, header, rows):
+        """
+        write the column headers and rows for a worksheet to a CSV file
+        :param sheet_name: name of the odmlib worksheet used as the file name
+        :param header: list of worksheet column headers that are also the keys of the row dictionaries
+        :param rows: list or generator of row dictionaries to write
+        :return: integer number of rows written not counting the header row
+        """
+        values = row_values(header)
+        row_nbr = 0
+        with open(self.sheet_file_name(sheet_name, "csv"), "w", newline="", encoding="utf-8") as file_out:
+            csv_writer = csv.writer(file_out)
+            csv_writer.writerow(header)
+            for row in rows:
+                row_nbr += 1
+                csv_writer.writerow(values(row))
+        return row_nbr
+
+
+class JSONLinesWriter(SheetFileWriter):
+    def write_sheet(self, sheet_name, header, rows):
+        """
+        write the rows for a worksheet to a JSON Lines file with one JSON object per row in header order
+        :param sheet_name: name of the odmlib worksheet used as the file name
+        :param header: list of worksheet column headers that are also the keys of the row dictionaries
+        :param rows: list or generator of row dictionaries to write
+        :return: integer number of rows written
+        """
+        values = row_values(header)
+        row_nbr = 0
+        with open(self.sheet_file_name(sheet_name, "jsonl"), "w", encoding="utf-8") as file_out:
+            for row in rows:
+                row_nbr += 1
+                file_out.write(json.dumps(dict(zip(header, values(row))), default=str) + "\n")
+        return row_nbr
+
+
+class ParquetWriter(SheetFileWriter):
+    def __init__(self, output_dir):
+        """
+        :param output_dir: directory to write one Parquet file per worksheet to
+        """
+        if pa is None:
+            raise ImportError("Parquet output requires the optional pyarrow package: "
+                              "pip install -r requirements-optional.txt")
+        super().__init__(output_dir)
+
+    def write_sheet(self, sheet_name, header, rows):
+        """
+        write the rows for a worksheet to a Parquet file with a string column for each header in batches of rows.
+        The worksheet columns mix numbers and text, such as Length, so every value is saved as a string.
+        :param sheet_name: name of the odmlib worksheet used as the file name
+        :param header: list of worksheet column headers that are also the keys of the row dictionaries
+        :param rows: list or generator of row dictionaries to write
+        :return: integer number of rows written
+        """
+        schema = pa.schema([(col_name, pa.string()) for col_name in header])
+        values = row_values(header)
+        row_nbr = 0
+        batch = []
+        with pq.ParquetWriter(self.sheet_file_name(sheet_name, "parquet"), schema) as parquet_writer:
+            for row in rows:
+                row_nbr += 1
+                batch.append([None if value is None else str(value) for value in values(row)])
+                if len(batch) == parquet_batch_size:
+                    parquet_writer.write_table(self.to_table(schema, batch))
+                    batch = []
+            if batch or not row_nbr:
+                parquet_writer.write_table(self.to_table(schema, batch))
+        return row_nbr
+
+    @staticmethod
+    def to_table(schema, batch):
+        columns = [pa.array([row[c] for row in batch], type=pa.string()) for c in range(len(schema))]
+        return pa.Table.from_arrays(columns, schema=schema)
+
+
+def add_writer_args(parser):
+    """
+    add the metadata output command-line arguments to a script's argparse parser
+    :param parser: argparse parser object
+    """
+    parser.add_argument("--constant_memory", help="write each worksheet row to disk as it is generated instead of "
+                        "keeping the workbook in memory", required=False, dest="constant_memory",
+                        action="store_true", default=False)
+    parser.add_argument("-f", "--format", help="output format: an xlsx workbook or a directory with one csv, jsonl or "
+                        "parquet file per worksheet", required=False, dest="output_format", choices=output_formats,
+                        default="xlsx")
+
+
+def create_writer(args):
+    """
+    create the metadata writer from the command-line arguments added by add_writer_args. For the csv, jsonl and parquet
+    formats the output file name without its extension is used as the directory for the worksheet files.
+    :param args: argparse object with the command-line parameters including define_xls
+    :return: WorkbookWriter, CSVWriter, JSONLinesWriter or ParquetWriter object
+    """
+    if args.output_format == "csv":
+        return CSVWriter(os.path.splitext(args.define_xls)[0])
+    elif args.output_format == "jsonl":
+        return JSONLinesWriter(os.path.splitext(args.define_xls)[0])
+    elif args.output_format == "parquet":
+        return ParquetWriter(os.path.splitext(args.define_xls)[0])
+    return WorkbookWriter(args.define_xls, args.constant_memory)
@@ -0,0 +1,155 @@
+import contextlib
+import cProfile
+import datetime
+import json
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
+
+"""
+profiler.py provides the opt-in instrumentation used by the map2* scripts when they are run with the --profile
+argument. A Profiler records the wall and CPU time of each stage of a script and of each domain worksheet, and writes
+a JSON report with the stage and worksheet timings, the CDISC Library request, byte, cache and latency counters of the
+LibraryClient, the peak resident memory of the process and the peak resident memory of its largest worker process. The
+--profile_dump argument also runs the script under cProfile and saves the profile for hot-path analysis with pstats or
+snakeviz. cProfile only profiles the main thread, so the work of the worker processes, and of other threads such as
+the stage threads run by define_build, is not in the saved profile. When neither argument is given the Profiler does
+not record anything, so the scripts run as before.
+Example:
+    profile = profiler.create_profiler(args, "map2variables")
+    with profile.stage("load_spec"):
+        map_workbook = spec_model.load_spec_model(args.map_xls)
+    profile.close(client)
+"""
+
+
+def peak_rss_mb(children=False):
+    """
+    :param children: True for the largest peak of the child processes that have finished, such as the --jobs and
+        --data_workers worker processes, instead of the peak of this process
+    :return: peak resident memory in megabytes, or None where the resource module is not available
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 3)
+
+
+class Profiler:
+    def __init__(self, script, report_file=None, dump_file=None):
+        """
+        :param script: name of the script being profiled, included in the report
+        :param report_file: path and file name of the JSON report to write or None to skip the report
+        :param dump_file: path and file name of the cProfile output to write or None to skip cProfile
+        """
+        self.script = script
+        self.report_file = report_file
+        self.dump_file = dump_file
+        self.enabled = bool(report_file or dump_file)
+        self.stages = []
+        self.sheets = []
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.cprofile = None
+        if dump_file:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        record the wall and CPU time taken by the code run in the with statement as a stage
+        :param name: name of the stage used in the report
+        """
+        if not self.enabled:
+            yield
+            return
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.stages.append({"stage": name, "wall_seconds": round(time.perf_counter() - start_wall, 6),
+                                "cpu_seconds": round(time.process_time() - start_cpu, 6)})
+
+    @contextlib.contextmanager
+    def sheet(self, title):
+        """
+        record the wall and CPU time taken to process a domain worksheet in the current process
+        :param title: worksheet title
+        """
+        if not self.enabled:
+            yield
+            return
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add_sheet(title, time.perf_counter() - start_wall, time.process_time() - start_cpu)
+
+    def add_sheet(self, title, wall_seconds, cpu_seconds):
+        """
+        record the time taken to process a domain worksheet, such as one processed by a worker process
+        :param title: worksheet title
+        :param wall_seconds: wall time in seconds
+        :param cpu_seconds: CPU time in seconds of the process that processed the worksheet
+        """
+        if self.enabled:
+            self.sheets.append({"sheet": title, "wall_seconds": round(wall_seconds, 6),
+                                "cpu_seconds": round(cpu_seconds, 6)})
+
+    def report(self, client=None):
+        """
+        :param client: LibraryClient used by the script or None if the script does not use the Library
+        :return: dictionary with the content of the JSON report
+        """
+        report = {"script": self.script, "argv": sys.argv[1:],
+                  "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+                  "wall_seconds": round(time.perf_counter() - self.start_wall, 6),
+                  "cpu_seconds": round(time.process_time() - self.start_cpu, 6),
+                  "peak_rss_mb": peak_rss_mb(), "peak_rss_children_mb": peak_rss_mb(children=True),
+                  "stages": self.stages, "sheets": self.sheets}
+        if client is not None:
+            library = client.stats()
+            lookups = library["cache_hits"] + library["cache_misses"]
+            library["cache_hit_rate"] = round(library["cache_hits"] / lookups, 4) if lookups else None
+            report["library"] = library
+        return report
+
+    def close(self, client=None):
+        """
+        stop cProfile and write the cProfile output and the JSON report
+        :param client: LibraryClient used by the script or None if the script does not use the Library
+        """
+        if self.cprofile:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.dump_file)
+            print(f"saved cProfile output to {self.dump_file}...")
+        if self.report_file:
+            with open(self.report_file, "w", encoding="utf-8") as file_out:
+                json.dump(self.report(client), file_out, indent=2)
+            print(f"saved profile report to {self.report_file}...")
+
+
+def add_profile_args(parser):
+    """
+    add the profiling command-line arguments to a script's argparse parser
+    :param parser: argparse parser object
+    """
+    parser.add_argument("--profile", help="path and file name of a JSON report with the stage and worksheet timings, "
+                        "Library statistics and peak memory", required=False, dest="profile", default=None)
+    parser.add_argument("--profile_dump", help="path and file name to save cProfile output of the main thread to",
+                        required=False, dest="profile_dump", default=None)
+
+
+def create_profiler(args, script):
+    """
+    create the profiler from the command-line arguments added by add_profile_args
+    :param args: argparse object with the command-line parameters
+    :param script: name of the script being profiled
+    :return: Profiler object; it does not record anything unless --profile or --profile_dump is given
+    """
+    return Profiler(script, args.profile, args.profile_dump)
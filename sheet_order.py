@@ -0,0 +1,161 @@
+"""
+sheet_order.py sorts the rows of the odmlib output worksheets. Each output worksheet has a SheetOrder that lists the
+row columns to sort on, most significant column first. A column can also have a list of values that sets its sort
+order, such as the dataset classes ordered as in MSG 2.0, so the datasets are ordered by class and then by name.
+Values that are not in the list sort after the listed values. The rows are sorted once with a key built from the
+columns, so the ordering stays fast as the worksheets grow. The sort is stable and numbers sort numerically, so rows
+that share the same key, such as repeated where clauses, keep the order they were created in.
+By default only the datasets are sorted and the other worksheets, including the variables and value level rows, keep
+the order their rows are created in. The orderings can be set or changed for each output worksheet with the --sort
+command-line argument. rank_datasets only changes a variables or value level ordering given with --sort that sorts on
+the Dataset column, such as --sort variables=Dataset,Order, so the rows follow the order of the sorted datasets.
+Example:
+    orders = sheet_order.create_orders(args)
+    rows = sheet_order.sort_rows("datasets", rows, orders)
+"""
+
+# dataset ordering for SDTM define-xml based on MSG 2.0
+class_order = ["TRIAL DESIGN", "SPECIAL PURPOSE", "INTERVENTIONS", "EVENTS", "FINDINGS", "FINDINGS ABOUT",
+               "RELATIONSHIP", "STUDY REFERENCE"]
+# column value orders used for any ordering that sorts on the column
+default_ranks = {"Class": class_order}
+
+
+class SheetOrder:
+    def __init__(self, columns, ranks=None):
+        """
+        :param columns: list of the row columns to sort on, most significant column first
+        :param ranks: dictionary of lists of column values in sort order keyed by column name or None
+        """
+        self.columns = list(columns)
+        self.ranks = {column: value_ranks(values) for column, values in (ranks or {}).items()}
+
+    def with_ranks(self, column, values):
+        """
+        :param column: name of the column to set the value order of
+        :param values: list of column values in sort order
+        :return: copy of the SheetOrder with the value order of the column replaced
+        """
+        order = SheetOrder(self.columns)
+        order.ranks = dict(self.ranks)
+        order.ranks[column] = value_ranks(values)
+        return order
+
+    def key(self, row):
+        """
+        :param row: row dictionary
+        :return: tuple sort key for the row
+        """
+        key = []
+        for column in self.columns:
+            value = row.get(column, "")
+            ranks = self.ranks.get(column)
+            if ranks is not None:
+                key.append(ranks.get(value, len(ranks)))
+            key.append(value_key(value))
+        return tuple(key)
+
+    def sort(self, rows):
+        """
+        :param rows: list or generator of row dictionaries
+        :return: new list of the rows in sort order
+        """
+        return sorted(rows, key=self.key)
+
+
+def value_ranks(values):
+    """
+    :param values: list of column values in sort order
+    :return: dictionary of the sort position of each value keyed by value; the first position wins for repeated values
+    """
+    ranks = {}
+    for rank, value in enumerate(values):
+        ranks.setdefault(value, rank)
+    return ranks
+
+
+def value_key(value):
+    """
+    :param value: row cell value
+    :return: tuple that sorts numbers, including digit strings, numerically before the other values
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return 0, value, ""
+    if isinstance(value, str) and value.isdigit():
+        return 0, int(value), ""
+    return 1, 0, "" if value is None else str(value)
+
+
+# default orderings for each output worksheet; worksheets without an ordering, such as the variables, codelists and
+# value level rows, keep the order the rows were created in unless an ordering is given with --sort
+default_orders = {"datasets": SheetOrder(["Class", "Dataset"], default_ranks)}
+
+
+def sort_rows(sheet, rows, orders=None):
+    """
+    :param sheet: name of the output worksheet the rows are for, such as datasets or valuelevel
+    :param rows: list or generator of row dictionaries
+    :param orders: dictionary of SheetOrder objects keyed by output worksheet or None for the default orders
+    :return: list of the rows sorted by the ordering for the worksheet, or in the same order if it has no ordering
+    """
+    order = (default_orders if orders is None else orders).get(sheet)
+    if order is None:
+        return list(rows)
+    return order.sort(rows)
+
+
+def rank_datasets(orders, datasets):
+    """
+    order the variables and value level rows by dataset in the same order as the sorted datasets rows when their
+    ordering sorts on the Dataset column; the default orders do not sort these rows, so they are returned unchanged
+    :param orders: dictionary of SheetOrder objects keyed by output worksheet or None for the default orders
+    :param datasets: list of dataset rows in sort order
+    :return: new dictionary of SheetOrder objects
+    """
+    orders = dict(default_orders if orders is None else orders)
+    names = [row["Dataset"] for row in datasets]
+    for sheet in ["variables", "valuelevel"]:
+        if sheet in orders and "Dataset" in orders[sheet].columns:
+            orders[sheet] = orders[sheet].with_ranks("Dataset", names)
+    return orders
+
+
+def parse_order(value):
+    """
+    parse a --sort argument value
+    :param value: string with the worksheet name and the columns to sort on, such as codelists=Name,Order
+    :return: tuple of the worksheet name and the SheetOrder, or None to keep the rows in the order they are created
+    """
+    sheet, sep, columns = value.partition("=")
+    if not sep or not sheet:
+        raise ValueError(f"--sort value {value} is not in the form SHEET=COLUMN,COLUMN")
+    columns = [column.strip() for column in columns.split(",") if column.strip()]
+    if not columns:
+        return sheet, None
+    return sheet, SheetOrder(columns, {column: default_ranks[column] for column in columns if column in default_ranks})
+
+
+def add_order_args(parser):
+    """
+    add the output worksheet ordering command-line arguments to a script's argparse parser
+    :param parser: argparse parser object
+    """
+    parser.add_argument("--sort", help="output worksheet and the row columns to sort it on, such as "
+                        "codelists=Name,Order; an empty column list keeps the rows in the order they are created. "
+                        "May be repeated", required=False, dest="sort", action="append", default=[],
+                        type=parse_order, metavar="SHEET=COLUMN,COLUMN")
+
+
+def create_orders(args):
+    """
+    create the output worksheet orderings from the command-line arguments added by add_order_args
+    :param args: argparse object with the command-line parameters
+    :return: dictionary of SheetOrder objects keyed by output worksheet
+    """
+    orders = dict(default_orders)
+    for sheet, order in args.sort:
+        if order is None:
+            orders.pop(sheet, None)
+        else:
+            orders[sheet] = order
+    return orders
@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import random
+import string
+import xlsxwriter as XLS
+import spec_model
+
+"""
+spec_generator.py writes synthetic SDTM mapping spreadsheets, much larger than the study mapping spreadsheet, in the
+layout the map2* scripts parse, together with a matching vlm.json file. The Domains worksheet lists the domains from
+cell A3, each domain worksheet has the variable attributes in rows 1-10 (Name, Label, Type, Codelist, Role, Notes,
+Core, DataType, Length, SignificantDigits) of one column per variable, and the "CODELIST - VARIABLE" columns after the
+variables list the subset terms from row 11. The vlm.json value level codelists refer to the generated CODELIST
+columns. The content is drawn from a random generator with a fixed seed, so the same arguments always produce the same
+spreadsheet. The spreadsheets are used to benchmark and harden the scripts at scale.
+Example Cmd-line (optional args):
+    python spec_generator.py -o ./data/synthetic-spec.xlsx -v ./data/synthetic-vlm.json -d 200 -n 5000 --seed 1
+"""
+
+synthetic_map_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'synthetic-mapping-spec.xlsx')
+synthetic_vlm_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'synthetic-vlm.json')
+# labels in the first column of each domain worksheet for the variable attribute rows
+attribute_labels = ["[Table Name]", "Variable Label", "Type", "Controlled Terms, Codelist or Format", "Role",
+                    "CDISC Notes", "Core", "Data Type", "Max Length", "Significant Digits "]
+# variables at the start of every domain worksheet
+identifier_variables = [("STUDYID", "Study Identifier", 6), ("DOMAIN", "Domain Abbreviation", 2),
+                        ("USUBJID", "Unique Subject Identifier", 20)]
+# Type, DataType, Length and SignificantDigits cells drawn for the other variables in the proportions of the study
+data_types = [("Char", "varchar", 20, "NA")] * 8 + [("Num", "int", 3, "NA"), ("Char", "datetime", 20, "NA"),
+                                                     ("Num", "float", 8, 2), ("Char", "bit", 1, "NA")]
+codelist_cells = [None] * 8 + ["C71620", "C66742", "ISO 8601 datetime", "Non-Standard Variable (NSV)"]
+roles = ["Identifier", "Topic", "Grouping Qualifier", "Result Qualifier", "Record Qualifier", "Timing"]
+cores = ["Req", "Exp", "Perm"]
+
+
+class SpecSize:
+    def __init__(self, domains=200, variables=5000, codelist_columns=2, subset_terms=20, vlm=100, where_clauses=10,
+                 seed=1):
+        """
+        :param domains: number of domain worksheets
+        :param variables: total number of variable columns shared across the domain worksheets
+        :param codelist_columns: number of CODELIST - VARIABLE columns in each domain worksheet
+        :param subset_terms: number of terms in each CODELIST cell
+        :param vlm: number of value level codelists in the vlm.json file
+        :param where_clauses: number of where clauses for each value level codelist
+        :param seed: random seed so the same size produces the same spreadsheet
+        """
+        self.domains = domains
+        self.variables = variables
+        self.codelist_columns = codelist_columns
+        self.subset_terms = subset_terms
+        self.vlm = vlm
+        self.where_clauses = where_clauses
+        self.seed = seed
+
+
+def domain_names(rng, count):
+    """
+    :param rng: random.Random object
+    :param count: number of domains
+    :return: list of unique 2-letter domain abbreviations; 3-letter names are used once the 2-letter names run out
+    """
+    names = [a + b for a in string.ascii_uppercase for b in string.ascii_uppercase]
+    rng.shuffle(names)
+    if count > len(names):
+        names.extend(a + b + c for a in string.ascii_uppercase for b in string.ascii_uppercase
+                     for c in string.ascii_uppercase)
+    return names[:count]
+
+
+def variable_column(rng, domain, num):
+    """
+    :param rng: random.Random object
+    :param domain: domain abbreviation
+    :param num: variable number within the domain
+    :return: tuple of the model_rows cells for a variable column
+    """
+    if num < len(identifier_variables):
+        name, label, length = identifier_variables[num]
+        attributes = [name, label, "Char", domain if name == "DOMAIN" else None, "Identifier", None, "Req",
+                      "varchar", length, "NA"]
+    else:
+        type_name, data_type, length, sig_digits = rng.choice(data_types)
+        attributes = [f"{domain[:2]}V{num:04d}", f"Synthetic Variable {num} of {domain}", type_name,
+                      rng.choice(codelist_cells), rng.choice(roles), None, rng.choice(cores), data_type,
+                      rng.randint(1, length) if data_type == "varchar" else length, sig_digits]
+    sources = [f"tblSource{domain}.Field{num}"]
+    return tuple(attributes + sources + [None] * (spec_model.model_rows - len(attributes) - len(sources)))
+
+
+def codelist_column(rng, variable, size):
+    """
+    :param rng: random.Random object
+    :param variable: name of the variable the codelist subsets are for
+    :param size: SpecSize object
+    :return: tuple of the model_rows cells for a CODELIST - VARIABLE column with the subset terms from row 11
+    """
+    subset_rows = spec_model.model_rows - len(attribute_labels)
+    cells = []
+    for row_num in range(subset_rows):
+        terms = [f"{variable} TERM {row_num + 1}-{n + 1}" + rng.choice(["", " OTHER", " NOT DONE"])
+                 for n in range(size.subset_terms)]
+        cells.append(", ".join(terms))
+    return tuple(["CODELIST - " + variable] + [None] * (len(attribute_labels) - 1) + cells)
+
+
+def generate_spec_model(size):
+    """
+    :param size: SpecSize object
+    :return: tuple of the SpecModel and a list of (domain, variable) tuples for the CODELIST columns
+    """
+    rng = random.Random(size.seed)
+    names = domain_names(rng, size.domains)
+    domains = [(name, f"Synthetic Domain {name}") for name in names]
+    worksheets = [spec_model.SpecSheet(spec_model.domains_sheet, [])]
+    codelist_variables = []
+    per_domain, extra = divmod(size.variables, size.domains)
+    for idx, domain in enumerate(names):
+        columns = [tuple(attribute_labels + [None] * (spec_model.model_rows - len(attribute_labels)))]
+        columns.extend(variable_column(rng, domain, num) for num in range(per_domain + (idx < extra)))
+        for num in range(size.codelist_columns):
+            variable = f"{domain[:2]}ORRES{num}" if num else f"{domain[:2]}ORRES"
+            columns.append(codelist_column(rng, variable, size))
+            codelist_variables.append((domain, variable))
+        worksheets.append(spec_model.SpecSheet(domain, columns))
+    return spec_model.SpecModel("", domains, worksheets), codelist_variables
+
+
+def generate_vlm(size, codelist_variables):
+    """
+    :param size: SpecSize object
+    :param codelist_variables: list of (domain, variable) tuples for the CODELIST columns in the spreadsheet
+    :return: dictionary of value level codelists in the vlm.json layout read by map2vlm
+    """
+    rng = random.Random(size.seed)
+    text_clauses = spec_model.model_rows - len(attribute_labels)
+    vlm = {}
+    for domain, variable in codelist_variables[:size.vlm]:
+        types = ["text" if idx < text_clauses else rng.choice(["integer", "float"])
+                 for idx in range(size.where_clauses)]
+        where_clauses = [[{"variable": domain[:2] + "TESTCD", "comparator": "EQ", "value": [f"TEST{idx + 1}"]}]
+                         for idx in range(size.where_clauses)]
+        for clause in where_clauses[::3]:
+            clause.append({"variable": domain[:2] + "CAT", "comparator": "IN", "value": ["CAT A", "CAT B"]})
+        vlm[domain + "." + variable] = {"IsNonStandard": ["Yes"] * size.where_clauses, "type": types,
+                                        "whereclause": where_clauses}
+    return vlm
+
+
+def write_spec_workbook(model, map_xls):
+    """
+    write a SpecModel as a mapping spreadsheet with the Domains table starting at A3 and the model rows of each
+    domain worksheet
+    :param model: SpecModel to write
+    :param map_xls: path and file name of the mapping spreadsheet to create
+    """
+    workbook = XLS.Workbook(map_xls, {"strings_to_numbers": False, "constant_memory": True})
+    for sheet in model.worksheets:
+        worksheet = workbook.add_worksheet(sheet.title[:31])
+        if sheet.title == spec_model.domains_sheet:
+            worksheet.write_row(0, 0, ["Domains Used"])
+            worksheet.write_row(1, 0, ["Abbreviation", "Name"])
+            for row_num, domain in enumerate(model.domains):
+                worksheet.write_row(row_num + 2, 0, domain)
+            continue
+        for row_num, row in enumerate(zip(*sheet.columns)):
+            worksheet.write_row(row_num, 0, row)
+    workbook.close()
+
+
+def generate_spec(size, map_xls=synthetic_map_file, vlm_file=synthetic_vlm_file):
+    """
+    write a synthetic mapping spreadsheet and its vlm.json file
+    :param size: SpecSize object
+    :param map_xls: path and file name of the mapping spreadsheet to create
+    :param vlm_file: path and file name of the vlm.json file to create
+    :return: SpecModel written to the mapping spreadsheet
+    """
+    model, codelist_variables = generate_spec_model(size)
+    write_spec_workbook(model, map_xls)
+    with open(vlm_file, "w", encoding="utf-8") as file_out:
+        json.dump(generate_vlm(size, codelist_variables), file_out)
+    return model
+
+
+def set_cmd_line_args():
+    """
+    get the command-line arguments needed to generate a synthetic SDTM mapping spreadsheet
+    :return: return the argparse object with the command-line parameters
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output_file", help="path and file name of the mapping spreadsheet to create",
+                        required=False, dest="map_xls", default=synthetic_map_file)
+    parser.add_argument("-v", "--vlm_file", help="path and file name of the vlm.json file to create",
+                        required=False, dest="vlm_file", default=synthetic_vlm_file)
+    parser.add_argument("-d", "--domains", help="number of domain worksheets", required=False, dest="domains",
+                        type=int, default=200)
+    parser.add_argument("-n", "--variables", help="total number of variable columns", required=False,
+                        dest="variables", type=int, default=5000)
+    parser.add_argument("-c", "--codelist_columns", help="number of CODELIST columns in each domain worksheet",
+                        required=False, dest="codelist_columns", type=int, default=2)
+    parser.add_argument("-t", "--subset_terms", help="number of terms in each CODELIST cell", required=False,
+                        dest="subset_terms", type=int, default=20)
+    parser.add_argument("--vlm", help="number of value level codelists in the vlm.json file", required=False,
+                        dest="vlm", type=int, default=100)
+    parser.add_argument("--where_clauses", help="number of where clauses for each value level codelist",
+                        required=False, dest="where_clauses", type=int, default=10)
+    parser.add_argument("--seed", help="random seed so the same arguments produce the same spreadsheet",
+                        required=False, dest="seed", type=int, default=1)
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    """
+    main driver that writes the synthetic mapping spreadsheet and vlm.json file
+    """
+    args = set_cmd_line_args()
+    size = SpecSize(args.domains, args.variables, args.codelist_columns, args.subset_terms, args.vlm,
+                    args.where_clauses, args.seed)
+    model = generate_spec(size, args.map_xls, args.vlm_file)
+    print(f"wrote {len(model.worksheets) - 1} domain worksheets with {size.variables} variables to {args.map_xls}...")
+    print(f"wrote {min(size.vlm, size.domains * size.codelist_columns)} value level codelists to {args.vlm_file}...")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from openpyxl import load_workbook
+
+"""
+spec_model.py parses the SDTM mapping spreadsheet once into a compact model of the content used by the map2* scripts:
+the Domains table and the first 17 rows of every column in each domain worksheet. The first 10 rows hold the variable
+attributes read by map2variables and rows 11-17 hold the CODELIST column terms read by map2subsets and map2vlm. The
+model is saved as JSON next to the mapping spreadsheet together with the SHA-256 hash of the spreadsheet, so later
+scripts and later runs load the model instead of parsing the spreadsheet again until the spreadsheet changes.
+The worksheets in the model provide the title, max_column and iter_cols used by the process_map_sheet functions.
+"""
+
+# number of rows at the top of each worksheet kept in the model
+model_rows = 17
+# worksheet with the table of domains used in the study
+domains_sheet = "Domains"
+# worksheets in the mapping spreadsheet that none of the scripts read
+skip_sheets = ["T1Dexi SDTM Summary", "T1Dexi Tables", "Sheet1"]
+# increment when the model layout changes so older saved models are rebuilt
+model_version = 2
+# worker processes are spawned rather than forked, as define_build calls map_sheets from its stage threads and forking
+# a process with running threads can deadlock the child
+process_context = multiprocessing.get_context("spawn")
+
+
+class SpecSheet:
+    def __init__(self, title, columns):
+        """
+        :param title: worksheet title
+        :param columns: list of column value tuples with the first model_rows rows of each column starting at column A
+        """
+        self.title = title
+        self.columns = columns
+
+    @property
+    def max_column(self):
+        return len(self.columns)
+
+    def iter_cols(self, min_col=1, max_col=None, min_row=1, max_row=None, values_only=True):
+        """
+        iterate over the worksheet columns in the same way as the openpyxl values_only iter_cols
+        :param min_col: first column number (1-based)
+        :param max_col: last column number (1-based); defaults to the last column
+        :param min_row: first row number (1-based)
+        :param max_row: last row number (1-based); cannot be larger than model_rows
+        :param values_only: only cell values are kept in the model so this must be True
+        :return: generator of column value tuples
+        """
+        max_col = max_col or self.max_column
+        max_row = max_row or model_rows
+        for col in self.columns[min_col - 1:max_col]:
+            yield tuple(col[min_row - 1:max_row])
+
+
+class SpecModel:
+    def __init__(self, spec_hash, domains, worksheets):
+        """
+        :param spec_hash: SHA-256 hash of the mapping spreadsheet the model was created from
+        :param domains: list of (domain, description) tuples from the Domains worksheet
+        :param worksheets: list of SpecSheet objects in the order they appear in the mapping spreadsheet
+        """
+        self.spec_hash = spec_hash
+        self.domains = domains
+        self.worksheets = worksheets
+
+    def __getitem__(self, title):
+        for sheet in self.worksheets:
+            if sheet.title == title:
+                return sheet
+        raise KeyError(f"Worksheet {title} does not exist.")
+
+    def to_dict(self):
+        return {"version": model_version, "spec_hash": self.spec_hash, "domains": self.domains,
+                "worksheets": [{"title": sheet.title, "columns": sheet.columns} for sheet in self.worksheets]}
+
+    @classmethod
+    def from_dict(cls, model):
+        worksheets = [SpecSheet(sheet["title"], [tuple(col) for col in sheet["columns"]])
+                      for sheet in model["worksheets"]]
+        return cls(model["spec_hash"], [tuple(domain) for domain in model["domains"]], worksheets)
+
+
+def hash_file(file_name):
+    """
+    :param file_name: path and file name of the file to hash
+    :return: string; hex SHA-256 digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as file_in:
+        for block in iter(lambda: file_in.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def model_file_name(map_xls):
+    """
+    :param map_xls: path and file name of the SDTM mapping spreadsheet
+    :return: path and file name of the saved model next to the mapping spreadsheet
+    """
+    return map_xls + ".model.json"
+
+
+def read_domains(sheet):
+    """
+    read the domain short names and descriptions from the Domains worksheet in the SDTM mapping spreadsheet
+    :param sheet: SDTM mapping spreadsheet Domains worksheet opened in read-only mode
+    :return: list of (domain, description) tuples in the order listed in the worksheet
+    """
+    domains = []
+    for domain, description in sheet.iter_rows(min_row=3, min_col=1, max_col=2, values_only=True):
+        # make sure all domains are listed in the Domains Used table as blank cells will break out of the loop
+        if not domain:
+            break
+        domains.append((domain, description))
+    return domains
+
+
+def read_columns(sheet):
+    """
+    stream the first model_rows rows of a worksheet and return them as columns
+    :param sheet: SDTM mapping spreadsheet worksheet opened in read-only mode
+    :return: list of column value tuples, each with model_rows values
+    """
+    rows = [row for row in sheet.iter_rows(min_row=1, max_row=model_rows, values_only=True)]
+    max_column = max((len(row) for row in rows), default=0)
+    rows.extend([()] * (model_rows - len(rows)))
+    return [tuple(json_value(row[c]) if c < len(row) else None for row in rows) for c in range(max_column)]
+
+
+def extract_model(map_xls, spec_hash=None, skip_sheets=skip_sheets):
+    """
+    parse the SDTM mapping spreadsheet into the model. The spreadsheet is opened in read-only mode so each worksheet
+    is streamed and only the rows kept in the model are read, which keeps memory use flat for large spreadsheets.
+    :param map_xls: path and file name of the SDTM mapping spreadsheet
+    :param spec_hash: SHA-256 hash of the mapping spreadsheet if already computed
+    :param skip_sheets: worksheets that none of the scripts use and are left out of the model
+    :return: SpecModel object
+    """
+    map_workbook = load_workbook(filename=map_xls, read_only=True, data_only=True)
+    try:
+        domains = read_domains(map_workbook[domains_sheet])
+        worksheets = [SpecSheet(sheet.title, read_columns(sheet)) for sheet in map_workbook.worksheets
+                      if sheet.title not in skip_sheets]
+    finally:
+        # read-only workbooks keep the spreadsheet file open until closed
+        map_workbook.close()
+    return SpecModel(spec_hash or hash_file(map_xls), domains, worksheets)
+
+
+def domain_sheets(map_workbook, worksheet_skip):
+    """
+    :param map_workbook: SDTM mapping spreadsheet model
+    :param worksheet_skip: worksheets that do not contain variables for a domain
+    :return: list of (worksheet, domain) tuples for the domain worksheets in the mapping spreadsheet
+    """
+    return [(sheet, sheet.title.split()[0]) for sheet in map_workbook.worksheets if sheet.title not in worksheet_skip]
+
+
+def map_sheets(func, sheets, jobs=1, *args, profiler=None):
+    """
+    apply a function to each domain worksheet. When jobs is more than 1 the worksheets are split into shards of
+    consecutive worksheets and each shard is processed by a worker process that receives only its own worksheets.
+    :param func: module-level function called as func(sheet, domain, *args) for each worksheet
+    :param sheets: list of (worksheet, domain) tuples created by domain_sheets
+    :param jobs: number of worker processes; 1 processes the worksheets in the current process
+    :param args: additional arguments passed to func for every worksheet
+    :param profiler: Profiler that records the time taken by each worksheet or None
+    :return: list of the func results in the same order as sheets
+    """
+    if profiler is None or not profiler.enabled:
+        return map_sheets_in_order(func, sheets, jobs, *args)
+    results = []
+    for (sheet, domain), (result, wall_seconds, cpu_seconds) in zip(
+            sheets, map_sheets_in_order(timed_sheet, sheets, jobs, func, *args)):
+        profiler.add_sheet(sheet.title, wall_seconds, cpu_seconds)
+        results.append(result)
+    return results
+
+
+def map_sheets_in_order(func, sheets, jobs=1, *args):
+    """
+    :param func: module-level function called as func(sheet, domain, *args) for each worksheet
+    :param sheets: list of (worksheet, domain) tuples created by domain_sheets
+    :param jobs: number of worker processes; 1 processes the worksheets in the current process
+    :param args: additional arguments passed to func for every worksheet
+    :return: list of the func results in the same order as sheets
+    """
+    if jobs <= 1 or len(sheets) <= 1:
+        return [func(sheet, domain, *args) for sheet, domain in sheets]
+    jobs = min(jobs, len(sheets))
+    shard_size = -(-len(sheets) // jobs)
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=process_context) as executor:
+        return list(executor.map(func, [sheet for sheet, domain in sheets], [domain for sheet, domain in sheets],
+                                 *[repeat(arg) for arg in args], chunksize=shard_size))
+
+
+def timed_sheet(sheet, domain, func, *args):
+    """
+    call a worksheet function and time it, so worksheets processed by worker processes can be profiled
+    :param sheet: SDTM mapping spreadsheet worksheet
+    :param domain: domain abbreviation for the worksheet
+    :param func: module-level function called as func(sheet, domain, *args)
+    :param args: additional arguments passed to func
+    :return: tuple of the func result and the wall and CPU time in seconds
+    """
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    result = func(sheet, domain, *args)
+    return result, time.perf_counter() - start_wall, time.process_time() - start_cpu
+
+
+def json_value(cell):
+    """
+    :param cell: cell value from the mapping spreadsheet
+    :return: the cell value or its string form when it cannot be saved as JSON, such as a date
+    """
+    if cell is None or isinstance(cell, (str, int, float, bool)):
+        return cell
+    return str(cell)
+
+
+def load_spec_model(map_xls, use_saved=True):
+    """
+    load the model for the SDTM mapping spreadsheet, parsing the spreadsheet only if it has changed since the model
+    was last saved
+    :param map_xls: path and file name of the SDTM mapping spreadsheet
+    :param use_saved: when False the spreadsheet is always parsed and the saved model is replaced
+    :return: SpecModel object
+    """
+    spec_hash = hash_file(map_xls)
+    model_file = model_file_name(map_xls)
+    if use_saved and os.path.exists(model_file):
+        try:
+            with open(model_file, "r", encoding="utf-8") as file_in:
+                model = json.load(file_in)
+            if model.get("version") == model_version and model.get("spec_hash") == spec_hash:
+                print(f"loaded mapping spreadsheet model from {model_file}...")
+                return SpecModel.from_dict(model)
+        except (OSError, ValueError, KeyError):
+            pass
+    model = extract_model(map_xls, spec_hash)
+    try:
+        tmp_file = model_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as file_out:
+            json.dump(model.to_dict(), file_out)
+        os.replace(tmp_file, model_file)
+    except OSError as ex:
+        print(f"unable to save the mapping spreadsheet model to {model_file}: {ex}")
+    return model
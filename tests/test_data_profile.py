@@ -0,0 +1,80 @@
+import pytest
+import data_profile
+import map2variables
+import map2vlm
+
+pytest.importorskip("pandas")
+
+
+def write_csv(path, header, rows):
+    path.write_text("\n".join([",".join(header)] + [",".join(row) for row in rows]) + "\n", encoding="utf-8")
+
+
+def test_profile_lengths_mixed_case_dataset(tmp_path):
+    write_csv(tmp_path / "FAML_meal.csv", ["STUDYID", "FAOBJ", "FAORRES"],
+              [["T1DEXI", "BREAKFAST", "12"], ["T1DEXI", "SNACK", "1250"]])
+    lengths = data_profile.profile_lengths(str(tmp_path))
+    assert lengths[("FAML_MEAL", "FAOBJ")] == 9
+    assert lengths[("FAML_MEAL", "FAORRES")] == 4
+
+
+def test_apply_length_mixed_case_dataset(tmp_path):
+    write_csv(tmp_path / "FAML_meal.csv", ["FAOBJ"], [["BREAKFAST"], ["SNACK"]])
+    mapper = map2variables.ColumnMapper(lengths=data_profile.profile_lengths(str(tmp_path)))
+    row_dict = {"Dataset": "FAML_meal", "Variable": "FAOBJ", "Data Type": "text", "Length": ""}
+    mapper.apply_length(row_dict)
+    assert row_dict["Length"] == 9
+
+
+def test_apply_length_skips_unmeasured_types():
+    mapper = map2variables.ColumnMapper(lengths={("FAML_MEAL", "FADTC"): 16})
+    row_dict = {"Dataset": "FAML_meal", "Variable": "FADTC", "Data Type": "datetime", "Length": ""}
+    mapper.apply_length(row_dict)
+    assert row_dict["Length"] == ""
+
+
+def test_value_sizes_floats_without_repr_noise():
+    pd = pytest.importorskip("pandas")
+    lengths, decimals = data_profile.value_sizes(pd.Series([0.1 + 0.2, 1e+20, 3.0, 12.25, None]))
+    assert list(lengths[:4]) == [3, 21, 1, 5]
+    assert list(decimals[:4]) == [1, 0, 0, 2]
+    assert pd.isna(lengths[4]) and pd.isna(decimals[4])
+
+
+def test_value_lengths_in_utf8_bytes():
+    pd = pytest.importorskip("pandas")
+    lengths = data_profile.value_lengths(pd.Series(["CAFÉ", "ABC", ""]))
+    assert list(lengths[:2]) == [5, 3]
+    assert pd.isna(lengths[2])
+
+
+def test_profile_vlm_measures_each_where_clause(tmp_path):
+    write_csv(tmp_path / "lb.csv", ["LBTESTCD", "LBORRES"],
+              [["GLUC", "5.25"], ["GLUC", "112.5"], ["HBA1C", "7"], ["HBA1C", "10"]])
+    codelists = {"lb.LBORRES": {"type": ["float", "integer"],
+                                "whereclause": [[{"variable": "LBTESTCD", "comparator": "EQ", "value": ["GLUC"]}],
+                                                [{"variable": "LBTESTCD", "comparator": "EQ", "value": ["HBA1C"]}]]}}
+    measured = data_profile.profile_vlm(codelists, str(tmp_path))
+    assert measured[("LB", "LBORRES", 0)] == {"length": 5, "significant_digits": 2}
+    assert measured[("LB", "LBORRES", 1)] == {"length": 2, "significant_digits": 0}
+
+
+def test_find_number_length_mixed_case_domain():
+    measured = {("FAML_MEAL", "FAORRES", 0): {"length": 6, "significant_digits": 1}}
+    assert map2vlm.find_number_length("FAML_meal", "FAORRES", 0, measured) == 6
+    assert map2vlm.find_number_sigdigits("FAML_meal", "FAORRES", 0, measured) == 1
+    assert map2vlm.find_number_length("FAML_meal", "FAORRES", 1, measured) == map2vlm.default_number_length
+
+
+def test_profile_lengths_across_worker_processes(tmp_path):
+    write_csv(tmp_path / "dm.csv", ["USUBJID", "AGE"], [["T1DEXI-001", "34"]])
+    write_csv(tmp_path / "vs.csv", ["VSORRES"], [["120.5"], ["98"]])
+    lengths = data_profile.profile_lengths(str(tmp_path), ["DM", "VS"], workers=2)
+    assert lengths == {("DM", "USUBJID"): 10, ("DM", "AGE"): 2, ("VS", "VSORRES"): 5}
+    assert data_profile.process_context.get_start_method() == "spawn"
+
+
+def test_profile_lengths_with_encoding(tmp_path):
+    (tmp_path / "dm.csv").write_bytes("SITE\nSAINT-ÉTIENNE\n".encode("latin-1"))
+    assert data_profile.profile_lengths(str(tmp_path)) == {}
+    assert data_profile.profile_lengths(str(tmp_path), encoding="latin-1") == {("DM", "SITE"): 14}
@@ -0,0 +1,70 @@
+import sys
+import threading
+import pytest
+import define_build
+
+
+def test_run_passes_dependency_results_in_order():
+    pipeline = define_build.Pipeline(2)
+    pipeline.add_stage("a", lambda: 2)
+    pipeline.add_stage("b", lambda: 3)
+    pipeline.add_stage("product", lambda a, b: a * b, ["a", "b"])
+    pipeline.add_stage("total", lambda product, a: product + a, ["product", "a"])
+    assert pipeline.run() == {"a": 2, "b": 3, "product": 6, "total": 8}
+    assert set(pipeline.timings) == {"a", "b", "product", "total"}
+
+
+def test_independent_stages_run_concurrently():
+    started = threading.Barrier(2, timeout=5)
+    pipeline = define_build.Pipeline(2)
+    # each stage waits for the other to start, so the run only finishes if both run at the same time
+    pipeline.add_stage("library", started.wait)
+    pipeline.add_stage("spec", started.wait)
+    pipeline.run()
+
+
+def test_add_stage_rejects_unknown_and_repeated_stages():
+    pipeline = define_build.Pipeline()
+    pipeline.add_stage("spec", lambda: None)
+    with pytest.raises(ValueError):
+        pipeline.add_stage("spec", lambda: None)
+    with pytest.raises(ValueError):
+        pipeline.add_stage("variables", lambda spec: None, ["spec", "layout"])
+
+
+def test_jobs_short_argument(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["define_build.py", "-j", "3", "--stage_workers", "2"])
+    args = define_build.set_cmd_line_args()
+    assert args.jobs == 3
+    assert args.stage_workers == 2
+
+
+def test_invalidate_reruns_only_dependent_stages():
+    calls = []
+
+    def stage(name, value):
+        def func(*results):
+            calls.append(name)
+            return value + sum(results)
+        return func
+
+    pipeline = define_build.Pipeline(2)
+    pipeline.add_stage("spec", stage("spec", 1))
+    pipeline.add_stage("library_codelists", stage("library_codelists", 10))
+    pipeline.add_stage("vlm_profile", stage("vlm_profile", 100))
+    pipeline.add_stage("vlm", stage("vlm", 0), ["spec", "vlm_profile"])
+    pipeline.add_stage("codelists", stage("codelists", 0), ["library_codelists"])
+    pipeline.add_stage("order", stage("order", 0), ["vlm", "codelists"])
+    pipeline.run()
+    assert pipeline.results["order"] == 111
+
+    calls.clear()
+    assert pipeline.invalidate(["vlm_profile"]) == ["vlm_profile", "vlm", "order"]
+    pipeline.run()
+    assert sorted(calls) == ["order", "vlm", "vlm_profile"]
+
+    calls.clear()
+    assert pipeline.invalidate(["spec"]) == ["spec", "vlm", "order"]
+    pipeline.run()
+    assert sorted(calls) == ["order", "spec", "vlm"]
+    assert pipeline.results["order"] == 111
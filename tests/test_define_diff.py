@@ -0,0 +1,35 @@
+import define_build
+import define_diff
+import define_xml_writer
+import map2variables
+import metadata_writer
+from test_define_xml_writer import create_rows, row
+
+
+def test_workbook_matches_its_own_define(tmp_path):
+    datasets, variables, codelists, value_levels, where_clauses = create_rows()
+    # a stray space in a mapping spreadsheet cell is written as part of the OID
+    variables.append(row(map2variables.header, OID="IT.LB.LBDTC ", Order=3, Dataset="LB", Variable="LBDTC ",
+                         Label="Date/Time of Specimen Collection", **{"Data Type": "datetime"}))
+    rows = {"datasets": datasets, "variables": variables, "codelists": codelists, "valuelevel": value_levels,
+            "whereclauses": where_clauses}
+    workbook = str(tmp_path / "define-metadata.xlsx")
+    define_build.write_workbook(metadata_writer.WorkbookWriter(workbook), rows)
+    define_file = str(tmp_path / "define.xml")
+    with open(define_file, "wb") as file_out:
+        define_xml_writer.DefineXMLWriter(file_out).write_define(datasets, variables, codelists, value_levels,
+                                                                 where_clauses)
+    diff = define_diff.diff_indexes(define_diff.index_define(define_file), define_diff.index_generated(workbook))
+    for kind in define_diff.index_kinds:
+        assert diff[kind] == {"added": [], "removed": [], "changed": {}}, kind
+    assert "IT.LB.LBDTC" in define_diff.index_define(define_file)["ItemGroupDef"]["IG.LB"]["ItemRefs"]
+
+
+def test_range_check_item_oids_are_normalized(tmp_path):
+    define_file = tmp_path / "define.xml"
+    define_file.write_text('<ODM xmlns="http://www.cdisc.org/ns/odm/v1.3" '
+                           'xmlns:def="http://www.cdisc.org/ns/def/v2.1"><def:WhereClauseDef OID=" WC.LB.1 ">'
+                           '<RangeCheck Comparator="EQ" def:ItemOID="IT.LB.LBTESTCD "><CheckValue>GLUC</CheckValue>'
+                           '</RangeCheck></def:WhereClauseDef></ODM>', encoding="utf-8")
+    index = define_diff.index_define(str(define_file))
+    assert index["WhereClauseDef"] == {"WC.LB.1": {"RangeChecks": ["IT.LB.LBTESTCD EQ GLUC"]}}
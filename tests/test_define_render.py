@@ -0,0 +1,21 @@
+import pytest
+import define_render
+
+pytest.importorskip("lxml")
+
+
+def test_render_applies_the_style_sheet(tmp_path):
+    xsl_file = tmp_path / "study.xsl"
+    xsl_file.write_text('<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">'
+                        '<xsl:output method="html" encoding="utf-8"/>'
+                        '<xsl:template match="/"><html><body><p><xsl:value-of select="/study/@name"/></p></body></html>'
+                        '</xsl:template>'
+                        '</xsl:stylesheet>', encoding="utf-8")
+    define_file = tmp_path / "define.xml"
+    define_file.write_text('<study name="T1DEXI"/>', encoding="utf-8")
+    html = tmp_path / "define.html"
+    renderer = define_render.DefineRenderer(str(xsl_file))
+    assert renderer.render(str(define_file), str(html))
+    assert "<p>T1DEXI</p>" in html.read_text(encoding="utf-8")
+    # the HTML file is newer than the Define-XML file and the style sheet so it is not rendered again
+    assert not renderer.render(str(define_file), str(html))
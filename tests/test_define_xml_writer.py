@@ -0,0 +1,118 @@
+import argparse
+import pytest
+import xml.etree.ElementTree as ET
+import define_diff
+import define_xml_writer
+import map2datasets
+import map2variables
+import map2vlm
+
+odm_ns = define_diff.odm_ns
+def_ns = define_diff.def_ns
+
+
+def row(header, **values):
+    return {**{key: "" for key in header}, **values}
+
+
+def create_rows():
+    datasets = [row(map2datasets.header, OID="IG.LB", Dataset="LB", Description="Laboratory Test Results",
+                    Class="FINDINGS", Structure="One record per lab test per visit per subject", Purpose="Tabulation",
+                    Repeating="Yes", **{"Reference Data": "No"})]
+    variables = [row(map2variables.header, OID="IT.LB.LBTESTCD", Order=1, Dataset="LB", Variable="LBTESTCD",
+                     Label="Lab Test or Examination Short Name", Length=8, CodeList="CL.C65047",
+                     **{"Data Type": "text"}),
+                 row(map2variables.header, OID="IT.LB.LBORRES", Order=2, Dataset="LB", Variable="LBORRES",
+                     Label="Result or Finding in Original Units", Length=200, **{"Data Type": "text"})]
+    codelists = [row(map2vlm.cl_header, OID="CL.C65047", Name="LBTESTCD", Order=order, Term=term,
+                     StandardOID="STD.3", **{"Data Type": "text", "NCI Codelist Code": "C65047",
+                                             "NCI Term Code": code, "Decoded Value": decode})
+                 for order, (term, code, decode) in enumerate([("GLUC", "C105585", "Glucose"),
+                                                               ("HBA1C", "C64849", "Hemoglobin A1C")], 1)]
+    value_levels = [row(map2vlm.vlm_header, OID="VL.LB.LBORRES", Order=1, Dataset="LB", Variable="LBORRES",
+                        ItemOID="IT.LB.LBORRES.GLUC", Length=5, Format="5.2", Mandatory="No",
+                        **{"Where Clause": "WC.LB.LBORRES.LBTESTCD.1", "Data Type": "float",
+                           "Significant Digits": 2})]
+    where_clauses = [row(map2vlm.wc_header, OID="WC.LB.LBORRES.LBTESTCD.1", Dataset="LB", Variable="LBTESTCD",
+                         Comparator="EQ", Value="GLUC")]
+    return datasets, variables, codelists, value_levels, where_clauses
+
+
+def write_define(tmp_path, writer_args=None):
+    define_file = str(tmp_path / "define.xml")
+    with open(define_file, "wb") as file_out:
+        if writer_args is None:
+            writer = define_xml_writer.DefineXMLWriter(file_out)
+        else:
+            writer = define_xml_writer.create_writer(writer_args, file_out, "2022-03-25")
+        writer.write_define(*create_rows())
+    return define_file
+
+
+def test_written_define_matches_the_rows(tmp_path):
+    define_file = write_define(tmp_path)
+    diff = define_diff.diff_indexes(define_diff.index_define(define_file), define_diff.index_rows(*create_rows()))
+    for kind in define_diff.index_kinds:
+        assert diff[kind] == {"added": [], "removed": [], "changed": {}}, kind
+    index = define_diff.index_define(define_file)
+    assert index["ItemGroupDef"]["IG.LB"]["ItemRefs"] == ["IT.LB.LBTESTCD", "IT.LB.LBORRES"]
+    assert index["ItemDef"]["IT.LB.LBORRES"]["ValueList"] == "VL.LB.LBORRES"
+    assert index["CodeList"]["CL.C65047"]["Terms"] == ["GLUC", "HBA1C"]
+
+
+def test_define_diff_reports_changed_rows(tmp_path):
+    define_file = write_define(tmp_path)
+    datasets, variables, codelists, value_levels, where_clauses = create_rows()
+    variables[1]["Length"] = 100
+    diff = define_diff.diff_indexes(define_diff.index_define(define_file),
+                                    define_diff.index_rows(datasets, variables, codelists, value_levels, where_clauses))
+    assert diff["ItemDef"]["changed"] == {"IT.LB.LBORRES": {"Length": {"released": "200", "generated": "100"}}}
+
+
+def test_header_from_the_command_line(tmp_path):
+    parser = argparse.ArgumentParser()
+    define_xml_writer.add_define_args(parser)
+    args = parser.parse_args(["--study_name", "STUDY01", "--sdtmig_version", "3.4"])
+    root = ET.parse(write_define(tmp_path, args)).getroot()
+    study = root.find(odm_ns + "Study")
+    assert study.get("OID") == "ODM.STUDY01"
+    assert study.findtext(f"{odm_ns}GlobalVariables/{odm_ns}StudyName") == "STUDY01"
+    standards = {standard.get("OID"): standard.attrib for standard in root.iter(def_ns + "Standard")}
+    assert standards["STD.1"]["Version"] == "3.4"
+    assert standards["STD.3"] == {"OID": "STD.3", "Name": "CDISC/NCI", "Type": "CT", "PublishingSet": "SDTM",
+                                  "Version": "2022-03-25", "Status": "Final"}
+
+
+def test_ct_standard_has_a_publishing_set(tmp_path):
+    root = ET.parse(write_define(tmp_path)).getroot()
+    ct = [standard for standard in root.iter(def_ns + "Standard") if standard.get("Type") == "CT"]
+    assert [standard.get("PublishingSet") for standard in ct] == ["SDTM"]
+
+
+def test_value_list_with_a_repeated_item_oid_is_an_error(tmp_path):
+    datasets, variables, codelists, value_levels, where_clauses = create_rows()
+    value_levels.append({**value_levels[0], "Order": 2, "Where Clause": "WC.LB.LBORRES.LBTESTCD.2"})
+    with open(tmp_path / "define.xml", "wb") as file_out:
+        writer = define_xml_writer.DefineXMLWriter(file_out)
+        with pytest.raises(ValueError, match="IT.LB.LBORRES.GLUC is used more than once in value list VL.LB.LBORRES"):
+            writer.write_define(datasets, variables, codelists, value_levels, where_clauses)
+
+
+def test_variables_for_datasets_not_in_the_domains_are_returned(tmp_path):
+    datasets, variables, codelists, value_levels, where_clauses = create_rows()
+    variables.append(row(map2variables.header, OID="IT.SUPPLB.QVAL", Order=1, Dataset="SUPPLB", Variable="QVAL",
+                         Label="Data Value", Length=200, **{"Data Type": "text"}))
+    with open(tmp_path / "define.xml", "wb") as file_out:
+        missing = define_xml_writer.DefineXMLWriter(file_out).write_define(datasets, variables, codelists,
+                                                                             value_levels, where_clauses)
+    assert missing == ["SUPPLB"]
+    assert "IT.SUPPLB.QVAL" not in define_diff.index_define(str(tmp_path / "define.xml"))["ItemDef"]
+
+
+def test_where_clauses_sharing_a_check_value_get_their_own_item_oids():
+    where_clause = [{"variable": "FATESTCD", "value": ["EPSDNUM"]}, {"variable": "FACAT", "value": ["HYPO"]}]
+    codelists = {"FA.FAORRES": {"whereclause": [where_clause, where_clause[:1] + [{"variable": "FACAT",
+                                                                                   "value": ["HYPER"]}]],
+                                "type": ["integer", "integer"]}}
+    rows = map2vlm.process_vlm(codelists)
+    assert [vlm_row["ItemOID"] for vlm_row in rows] == ["IT.FA.FAORRES.EPSDNUM.1", "IT.FA.FAORRES.EPSDNUM.2"]
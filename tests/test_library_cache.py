@@ -0,0 +1,103 @@
+import os
+import time
+import pytest
+import library_cache
+import library_client
+import library_stub
+
+endpoint = "/mdr/ct/packages/sdtmct-2021-12-17/codelists/C66731"
+body = {"conceptId": "C66731", "submissionValue": "SEX"}
+
+
+@pytest.fixture
+def stub(tmp_path):
+    library_stub.record_fixture(str(tmp_path / "fixtures"), endpoint, body, '"etag-1"')
+    with library_stub.LibraryStub(library_stub.load_fixtures(str(tmp_path / "fixtures"))).start() as stub:
+        yield stub
+
+
+def test_put_and_get_by_package(tmp_path):
+    cache = library_cache.LibraryCache(str(tmp_path))
+    cache.put(endpoint, body, '"etag-1"', "sdtmct-2021-12-17")
+    entry = cache.get(endpoint, "sdtmct-2021-12-17")
+    assert entry["body"] == body
+    assert entry["etag"] == '"etag-1"'
+    assert cache.get(endpoint, "sdtmct-2022-03-25") is None
+
+
+def test_get_from_a_read_only_cache(tmp_path, monkeypatch):
+    cache = library_cache.LibraryCache(str(tmp_path))
+    cache.put(endpoint, body, '"etag-1"', "sdtmct-2021-12-17")
+
+    def utime(path, times=None):
+        raise PermissionError(path)
+
+    monkeypatch.setattr(os, "utime", utime)
+    assert cache.get(endpoint, "sdtmct-2021-12-17")["body"] == body
+
+
+def test_is_fresh_until_the_ttl_passes(tmp_path):
+    cache = library_cache.LibraryCache(str(tmp_path), ttl_days=1)
+    entry = cache.put(endpoint, body)
+    assert cache.is_fresh(entry)
+    entry["fetched"] = time.time() - 2 * 24 * 60 * 60
+    assert not cache.is_fresh(entry)
+    cache.refresh(entry)
+    assert cache.is_fresh(cache.get(endpoint))
+
+
+def test_fresh_entry_is_a_cache_hit(tmp_path, stub):
+    cache = library_cache.LibraryCache(str(tmp_path / "cache"))
+    client = library_client.LibraryClient("", cache, stub.base_url)
+    assert client.fetch_json(endpoint) == body
+    assert client.fetch_json(endpoint) == body
+    client.close()
+    assert stub.requests == 1
+    assert client.stats()["cache_hits"] == 1
+    assert client.stats()["cache_misses"] == 1
+
+
+def test_expired_entry_is_revalidated_with_its_etag(tmp_path, stub):
+    cache = library_cache.LibraryCache(str(tmp_path / "cache"), ttl_days=0)
+    client = library_client.LibraryClient("", cache, stub.base_url)
+    client.fetch_json(endpoint)
+    fetched = cache.get(endpoint)["fetched"]
+    assert client.fetch_json(endpoint) == body
+    client.close()
+    assert stub.requests == 2
+    assert client.stats()["revalidations"] == 1
+    assert cache.get(endpoint)["fetched"] >= fetched
+
+
+def test_changed_etag_replaces_the_entry(tmp_path, stub):
+    cache = library_cache.LibraryCache(str(tmp_path / "cache"), ttl_days=0)
+    cache.put(endpoint, {"conceptId": "C66731", "submissionValue": "OLD"}, '"etag-0"')
+    client = library_client.LibraryClient("", cache, stub.base_url)
+    assert client.fetch_json(endpoint) == body
+    client.close()
+    assert client.stats()["revalidations"] == 0
+    assert cache.get(endpoint)["etag"] == '"etag-1"'
+
+
+def test_offline_miss_raises(tmp_path):
+    cache = library_cache.LibraryCache(str(tmp_path), ttl_days=0, offline=True)
+    client = library_client.LibraryClient("", cache, "http://127.0.0.1:9/api")
+    with pytest.raises(library_cache.LibraryCacheMiss):
+        client.fetch_json(endpoint)
+    # an expired entry is used without revalidating it
+    cache.put(endpoint, body)
+    assert client.fetch_json(endpoint) == body
+    client.close()
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    cache = library_cache.LibraryCache(str(tmp_path))
+    cache.put("/old", {"terms": "x" * 1000})
+    cache.put("/new", {"terms": "y" * 1000})
+    old_path = cache._path(cache.make_key("/old"))
+    past = time.time() - 60
+    os.utime(old_path, (past, past))
+    cache.max_bytes = 1500
+    cache.evict()
+    assert cache.get("/old") is None
+    assert cache.get("/new") is not None
@@ -0,0 +1,72 @@
+import pytest
+import library_cache
+import library_client
+import library_stub
+
+endpoint = "/mdr/ct/packages/sdtmct-2021-12-17/codelists/C66731"
+body = {"conceptId": "C66731", "submissionValue": "SEX"}
+
+
+@pytest.fixture
+def fixtures(tmp_path):
+    library_stub.record_fixture(str(tmp_path), endpoint, body, '"etag-1"')
+    return library_stub.load_fixtures(str(tmp_path))
+
+
+def test_fetch_json_retries_then_raises(fixtures):
+    with library_stub.LibraryStub(fixtures, error_rate=1.0).start() as stub:
+        client = library_client.LibraryClient("", None, stub.base_url, retries=2, backoff=0)
+        with pytest.raises(library_client.LibraryRequestError) as info:
+            client.fetch_json(endpoint)
+        client.close()
+    assert info.value.status_code == 503
+    assert info.value.attempts == 3
+    assert endpoint in str(info.value)
+    assert stub.requests == 3
+    assert client.stats()["errors"] == 3
+    assert client.stats()["retries"] == 2
+
+
+def test_fetch_json_recovers_after_retry(fixtures):
+    # with this seed the first request fails and the second succeeds
+    with library_stub.LibraryStub(fixtures, error_rate=0.5, seed=9).start() as stub:
+        client = library_client.LibraryClient("", None, stub.base_url, retries=3, backoff=0)
+        assert client.fetch_json(endpoint) == body
+        client.close()
+    assert client.stats()["retries"] == 1
+    assert stub.requests == 2
+
+
+def test_fetch_json_does_not_retry_not_found(fixtures):
+    with library_stub.LibraryStub(fixtures).start() as stub:
+        client = library_client.LibraryClient("", None, stub.base_url, retries=3, backoff=0)
+        with pytest.raises(library_client.LibraryRequestError) as info:
+            client.fetch_json("/mdr/ct/packages/sdtmct-2021-12-17/codelists/C99999")
+        client.close()
+    assert info.value.status_code == 404
+    assert stub.requests == 1
+
+
+def test_get_many_raises_the_request_error(fixtures):
+    with library_stub.LibraryStub(fixtures, error_rate=1.0).start() as stub:
+        client = library_client.LibraryClient("", None, stub.base_url, retries=0)
+        with pytest.raises(library_client.LibraryRequestError):
+            client.get_many([endpoint, endpoint])
+        client.close()
+
+
+def test_record_dir_records_cached_responses(fixtures, tmp_path):
+    cache = library_cache.LibraryCache(str(tmp_path / "cache"))
+    with library_stub.LibraryStub(fixtures).start() as stub:
+        client = library_client.LibraryClient("", cache, stub.base_url)
+        client.fetch_json(endpoint)
+        client.close()
+        # a fresh cache entry is served without a request and an expired one is revalidated with a 304
+        for ttl_days in [30, 0]:
+            record_dir = str(tmp_path / f"record-{ttl_days}")
+            cache.ttl = ttl_days * 24 * 60 * 60
+            client = library_client.LibraryClient("", cache, stub.base_url, record_dir=record_dir)
+            assert client.fetch_json(endpoint) == body
+            client.close()
+            assert library_stub.load_fixtures(record_dir)[endpoint]["etag"] == '"etag-1"'
+    assert stub.requests == 2
@@ -0,0 +1,34 @@
+import pytest
+import benchmark
+import library_client
+import map2datasets
+
+
+@pytest.fixture
+def client(tmp_path):
+    fixtures = benchmark.synthetic_fixtures(["DM", "LB", "FAML_meal"], [], 0)
+    with benchmark.start_stub(fixtures, str(tmp_path)) as stub:
+        client = library_client.LibraryClient("", None, stub.base_url, retries=0)
+        yield client
+        client.close()
+
+
+def test_create_dataset_rows(client):
+    rows = map2datasets.create_dataset_rows([("DM", "Demographics"), ("LB", "Laboratory Test Results"),
+                                             ("FAML_meal", "Findings About Meals")], client)
+    assert sorted(row["Dataset"] for row in rows) == ["DM", "FAML_meal", "LB"]
+    assert {row["Dataset"]: row["Repeating"] for row in rows}["DM"] == "No"
+
+
+def test_domain_without_library_content_is_skipped(client, capsys):
+    rows = map2datasets.create_dataset_rows([("DM", "Demographics"), ("XX", "Custom Domain")], client)
+    assert [row["Dataset"] for row in rows] == ["DM"]
+    assert "skipping dataset XX" in capsys.readouterr().out
+
+
+def test_missing_classes_raise(tmp_path):
+    with benchmark.start_stub({}, str(tmp_path)) as stub:
+        client = library_client.LibraryClient("", None, stub.base_url, retries=0)
+        with pytest.raises(library_client.LibraryRequestError):
+            map2datasets.create_dataset_rows([("DM", "Demographics")], client)
+        client.close()
@@ -0,0 +1,60 @@
+import argparse
+import pytest
+import sheet_order
+
+
+def parse_orders(*args):
+    parser = argparse.ArgumentParser()
+    sheet_order.add_order_args(parser)
+    return sheet_order.create_orders(parser.parse_args(list(args)))
+
+
+def test_datasets_sorted_by_class_order_then_name():
+    rows = [{"Dataset": "VS", "Class": "FINDINGS"}, {"Dataset": "XX", "Class": "CUSTOM"},
+            {"Dataset": "DM", "Class": "SPECIAL PURPOSE"}, {"Dataset": "CM", "Class": "INTERVENTIONS"},
+            {"Dataset": "LB", "Class": "FINDINGS"}, {"Dataset": "TA", "Class": "TRIAL DESIGN"}]
+    sorted_rows = sheet_order.sort_rows("datasets", rows)
+    # classes that are not in the class order sort after the listed classes
+    assert [row["Dataset"] for row in sorted_rows] == ["TA", "DM", "CM", "LB", "VS", "XX"]
+
+
+def test_other_sheets_keep_creation_order_by_default():
+    rows = [{"OID": "CL.B", "Order": 2}, {"OID": "CL.A", "Order": 1}]
+    for sheet in ["variables", "codelists", "whereclauses", "valuelevel"]:
+        assert sheet_order.sort_rows(sheet, rows) == rows
+        assert sheet_order.sort_rows(sheet, rows, parse_orders()) == rows
+
+
+def test_numbers_sort_numerically_and_sort_is_stable():
+    rows = [{"OID": "CL.A", "Order": "10", "Term": "first"}, {"OID": "CL.A", "Order": 2},
+            {"OID": "CL.A", "Order": "10", "Term": "second"}, {"OID": "CL.A", "Order": "1"}]
+    orders = parse_orders("--sort", "codelists=OID,Order")
+    assert [(row["Order"], row.get("Term")) for row in sheet_order.sort_rows("codelists", rows, orders)] == \
+        [("1", None), (2, None), ("10", "first"), ("10", "second")]
+
+
+def test_empty_sort_keeps_creation_order():
+    rows = [{"Dataset": "VS", "Class": "FINDINGS"}, {"Dataset": "DM", "Class": "SPECIAL PURPOSE"}]
+    assert sheet_order.sort_rows("datasets", rows, parse_orders("--sort", "datasets=")) == rows
+
+
+def test_rank_datasets_groups_rows_in_dataset_order():
+    datasets = [{"Dataset": "DM"}, {"Dataset": "LB"}, {"Dataset": "AE"}]
+    orders = sheet_order.rank_datasets(parse_orders("--sort", "valuelevel=Dataset,Order"), datasets)
+    rows = [{"Dataset": "AE", "Order": 1}, {"Dataset": "LB", "Order": 2}, {"Dataset": "LB", "Order": 1},
+            {"Dataset": "DM", "Order": 1}]
+    assert [(row["Dataset"], row["Order"]) for row in sheet_order.sort_rows("valuelevel", rows, orders)] == \
+        [("DM", 1), ("LB", 1), ("LB", 2), ("AE", 1)]
+
+
+def test_rank_datasets_keeps_creation_order_by_default():
+    datasets = [{"Dataset": "DM"}, {"Dataset": "LB"}]
+    orders = sheet_order.rank_datasets(parse_orders(), datasets)
+    rows = [{"Dataset": "LB", "Order": 2}, {"Dataset": "DM", "Order": 1}, {"Dataset": "LB", "Order": 1}]
+    for sheet in ["variables", "valuelevel"]:
+        assert sheet_order.sort_rows(sheet, rows, orders) == rows
+
+
+def test_parse_order_rejects_values_without_a_sheet():
+    with pytest.raises(ValueError):
+        sheet_order.parse_order("Name,Order")
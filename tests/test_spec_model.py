@@ -0,0 +1,11 @@
+import spec_model
+
+
+def test_map_sheets_in_order_keeps_sheet_order_across_workers():
+    sheets = [("b", "a"), ("c", "d"), ("f", "e"), ("g", "h")]
+    assert spec_model.map_sheets_in_order(max, sheets, 2) == ["b", "d", "f", "h"]
+    assert spec_model.map_sheets_in_order(max, sheets, 1) == ["b", "d", "f", "h"]
+
+
+def test_worker_processes_are_spawned():
+    assert spec_model.process_context.get_start_method() == "spawn"